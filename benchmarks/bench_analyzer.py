@@ -0,0 +1,78 @@
+"""
+Benchmark: row-by-row vs columnar Analyzer.analyze_batch.
+
+Usage: python -m benchmarks.bench_analyzer [--repeat N]
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from core.analyzer import Analyzer
+
+BATCH_SIZES = [50, 500, 5000, 50000]
+
+def make_batch(size, seed=42):
+    """Simulator-shaped records: sparse scalar fields, nullable fields and a nested blob."""
+    rng = random.Random(seed)
+    base = datetime(2024, 1, 1)
+    batch = []
+    for i in range(size):
+        record = {
+            "sys_ingested_at": base + timedelta(seconds=i),
+            "username": f"user_{rng.randint(0, 999)}",
+            "timestamp": (base + timedelta(seconds=i)).isoformat()
+        }
+        if rng.random() < 0.9:
+            record["age"] = rng.randint(18, 70)
+        if rng.random() < 0.8:
+            record["altitude"] = round(rng.uniform(1, 3000), 2)
+        if rng.random() < 0.7:
+            record["device_model"] = rng.choice(["iPhone 14", "Pixel 8", "Samsung S23", "OnePlus 12"])
+        if rng.random() < 0.6:
+            record["charging"] = rng.choice([True, False])
+        if rng.random() < 0.5:
+            record["item"] = rng.choice(["book", "phone", "shoes", "bag", "laptop", None])
+        if rng.random() < 0.5:
+            record["error_code"] = rng.choice([None, 100, 200, 500, 404, 403])
+        if rng.random() < 0.4:
+            record["session_id"] = f"{rng.getrandbits(128):032x}"
+        if rng.random() < 0.3:
+            record["metadata"] = {"is_bot": rng.random() < 0.5, "tags": ["a", "b"]}
+        batch.append(record)
+    return batch
+
+def time_analyze(batch, columnar, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        analyzer = Analyzer(columnar=columnar)
+        start = time.perf_counter()
+        analyzer.analyze_batch(batch)
+        best = min(best, time.perf_counter() - start)
+    return best, analyzer
+
+def same_stats(a, b):
+    sa, sb = a.get_schema_stats(), b.get_schema_stats()
+    keys = ("count", "detected_type", "null_count", "min", "max", "max_length", "is_nested")
+    return sa.keys() == sb.keys() and all(
+        all(sa[f][k] == sb[f][k] for k in keys) for f in sa
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'batch':>8} {'rows (ms)':>12} {'columnar (ms)':>14} {'rows rec/s':>12} {'col rec/s':>12} {'speedup':>8}  match")
+    for size in BATCH_SIZES:
+        batch = make_batch(size)
+        row_time, row_analyzer = time_analyze(batch, False, args.repeat)
+        col_time, col_analyzer = time_analyze(batch, True, args.repeat)
+        print(
+            f"{size:>8} {row_time * 1000:>12.2f} {col_time * 1000:>14.2f} "
+            f"{size / row_time:>12.0f} {size / col_time:>12.0f} {row_time / col_time:>7.2f}x  "
+            f"{'yes' if same_stats(row_analyzer, col_analyzer) else 'NO'}"
+        )
+
+if __name__ == "__main__":
+    main()
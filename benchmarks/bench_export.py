@@ -0,0 +1,97 @@
+"""
+Streaming export versus an in-memory join of both databases.
+
+Loads a deterministic stream at 100 records/s of ingest time into SQLite
+and the in-memory document store, then rebuilds every record twice: with
+the Exporter's merge join to an NDJSON file, and by reading both sides
+whole and joining them in a dict. Peak traced memory of the streaming
+export should stay flat as the record count grows.
+
+Usage:
+    python -m benchmarks.bench_export [--records N ...] [--partitions P]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from benchmarks.bench_pipeline import run_pipeline
+from benchmarks.generator import RecordGenerator
+from benchmarks.stand_ins import MemoryMongoHandler, SQLiteHandler
+from core.export import Exporter, join_second
+from core.normalizer import Normalizer
+
+class _ClockedNormalizer(Normalizer):
+    """Stamps sys_ingested_at from a synthetic clock instead of now()."""
+    def __init__(self, start=datetime(2024, 1, 1), step=timedelta(milliseconds=10)):
+        super().__init__()
+        self.clock = start
+        self.step = step
+
+    def normalize_record(self, record):
+        record = dict(record, sys_ingested_at=self.clock)
+        self.clock += self.step
+        return super().normalize_record(record)
+
+def load(records, directory):
+    lines = [json.dumps(rec) for rec in RecordGenerator().records(records)]
+    path = os.path.join(directory, f"bench-{records}.db")
+    mongo = MemoryMongoHandler()
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_pipeline(lines, 200, sql_handler=SQLiteHandler(path), mongo_handler=mongo, normalizer=_ClockedNormalizer())
+    sql = SQLiteHandler(path)
+    sql.connect()
+    return sql, mongo
+
+def in_memory_join(sql, mongo):
+    rows, _ = sql.fetch_older_than(datetime.max, 10**9)
+    docs = [{k: v for k, v in d.items() if k != "_id"} for d in mongo.documents]
+    joined = {}
+    for row in rows:
+        joined[(join_second(row["sys_ingested_at"]), row["username"])] = dict(row)
+    for doc in docs:
+        joined.setdefault((join_second(doc["sys_ingested_at"]), doc["username"]), {}).update(doc)
+    return len(joined)
+
+def measure(fn):
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+
+    # Separate pass for memory: tracemalloc would skew the timing
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 2**20
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, action="append")
+    parser.add_argument("--partitions", type=int, default=1)
+    args = parser.parse_args()
+
+    os.environ.pop("GROQ_API_KEY", None)
+
+    print(f"\n  {'records':>8}  {'method':<10}{'rec/s':>10}{'peak MB':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for records in args.records or [5000, 20000]:
+            sql, mongo = load(records, directory)
+            exporter = Exporter(sql, mongo, {})
+            out = os.path.join(directory, f"export-{records}")
+
+            results, elapsed, peak = measure(lambda: exporter.export(out, partitions=args.partitions))
+            exported = sum(count for _, count in results)
+            print(f"  {records:>8}  {'streaming':<10}{exported / elapsed:>10.0f}{peak:>10.1f}")
+
+            joined, elapsed, peak = measure(lambda: in_memory_join(sql, mongo))
+            print(f"  {records:>8}  {'in-memory':<10}{joined / elapsed:>10.0f}{peak:>10.1f}")
+            sql.close()
+
+if __name__ == "__main__":
+    main()
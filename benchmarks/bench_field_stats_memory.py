@@ -0,0 +1,81 @@
+"""
+Benchmark: memory held by Analyzer.field_stats at large field counts.
+
+Compares the compact FieldStats records against the previous dict-of-sets
+layout (one dict per field with a set of type-name strings).
+
+Usage: python -m benchmarks.bench_field_stats_memory
+"""
+import gc
+import time
+import tracemalloc
+
+from core.analyzer import Analyzer
+from core.sketch import CardinalitySketch
+
+FIELD_COUNTS = [10000, 100000]
+RECORDS_PER_FIELD = 3
+
+def make_batches(field_count):
+    # Long-tail keys: each field shows up in a few records with a few values
+    for start in range(0, field_count, 1000):
+        keys = [f"dyn_field_{i}" for i in range(start, min(start + 1000, field_count))]
+        yield [{key: n * 7 + len(key) for key in keys} for n in range(RECORDS_PER_FIELD)]
+
+def build_dict_layout(field_count):
+    field_stats = {}
+    for batch in make_batches(field_count):
+        for record in batch:
+            for key, value in record.items():
+                if key not in field_stats:
+                    field_stats[key] = {
+                        "count": 0, "types": set(), "is_nested": False, "null_count": 0,
+                        "min": None, "max": None, "max_length": 0, "sketch": CardinalitySketch()
+                    }
+                stats = field_stats[key]
+                stats["count"] += 1
+                stats["types"].add(type(value).__name__)
+                stats["sketch"].add(value)
+                if stats["min"] is None or value < stats["min"]:
+                    stats["min"] = value
+                if stats["max"] is None or value > stats["max"]:
+                    stats["max"] = value
+    return field_stats
+
+def build_compact(field_count):
+    analyzer = Analyzer(columnar=True)
+    for batch in make_batches(field_count):
+        analyzer.analyze_batch(batch)
+    return analyzer
+
+def measure(builder, field_count):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = builder(field_count)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, peak, elapsed
+
+def main():
+    print(f"{'fields':>8} {'layout':>10} {'retained MB':>12} {'peak MB':>9} {'B/field':>8} {'build s':>8} {'export s':>9}")
+    for field_count in FIELD_COUNTS:
+        for name, builder in (("dict", build_dict_layout), ("slots", build_compact)):
+            result, current, peak, elapsed = measure(builder, field_count)
+
+            start = time.perf_counter()
+            if name == "slots":
+                result.export_stats()
+            else:
+                {k: dict(v, types=list(v["types"]), sketch=v["sketch"].to_dict()) for k, v in result.items()}
+            export_time = time.perf_counter() - start
+
+            print(
+                f"{field_count:>8} {name:>10} {current / 2**20:>12.1f} {peak / 2**20:>9.1f} "
+                f"{current / field_count:>8.0f} {elapsed:>8.2f} {export_time:>9.2f}"
+            )
+            del result
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Storage of the MongoDB side under the document and bucketed layouts.
+
+Runs the pipeline over a deterministic stream, then measures the BSON
+bytes, document count and index entries the MongoDB half of every record
+would take as one document each versus in key-compressed user buckets.
+
+Usage:
+    python -m benchmarks.bench_mongo_layout [--records N] [--bucket-seconds S]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+
+import bson
+
+from benchmarks.bench_pipeline import run_pipeline
+from benchmarks.generator import RecordGenerator
+from benchmarks.stand_ins import MemoryMongoHandler
+from db.bucket_layout import BucketLayout, KeyDictionary
+
+class _Capture(MemoryMongoHandler):
+    """Keeps every Mongo half exactly as the router produced it."""
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+
+    def insert_batch(self, records):
+        self.batches.append(records)
+        super().insert_batch(records)
+
+def document_layout(documents):
+    size = sum(len(bson.encode({"_id": bson.ObjectId(), **doc})) for doc in documents)
+    # _id index only
+    return {"documents": len(documents), "bytes": size, "index_entries": len(documents)}
+
+def bucketed_layout(batches, bucket_seconds, max_bucket_records):
+    dictionary = KeyDictionary()
+    layout = BucketLayout(dictionary, bucket_seconds=bucket_seconds, max_bucket_records=max_bucket_records)
+    buckets = {}
+    for batch in batches:
+        for query, update in layout.updates(batch):
+            key = (query["u"], query["b"])
+            open_buckets = buckets.setdefault(key, [])
+            if not open_buckets or open_buckets[-1]["n"] >= max_bucket_records:
+                open_buckets.append({"_id": bson.ObjectId(), "u": key[0], "b": key[1], "n": 0, "r": []})
+            bucket = open_buckets[-1]
+            bucket["r"].extend(update["$push"]["r"]["$each"])
+            bucket["n"] += update["$inc"]["n"]
+
+    docs = [b for open_buckets in buckets.values() for b in open_buckets]
+    size = sum(len(bson.encode(b)) for b in docs)
+    size += sum(len(bson.encode({"_id": name, "c": code})) for name, code in dictionary.codes.items())
+    return {
+        "documents": len(docs),
+        "bytes": size,
+        # _id and (u, b) per bucket, _id and c per dictionary entry
+        "index_entries": 2 * len(docs) + 2 * len(dictionary.codes)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--bucket-seconds", type=int, default=3600)
+    parser.add_argument("--bucket-records", type=int, default=500)
+    args = parser.parse_args()
+
+    os.environ.pop("GROQ_API_KEY", None)
+
+    lines = [json.dumps(rec) for rec in RecordGenerator().records(args.records)]
+    mongo = _Capture()
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_pipeline(lines, args.batch_size, mongo_handler=mongo)
+
+    documents = [{k: v for k, v in doc.items() if k != "_id"} for batch in mongo.batches for doc in batch]
+    results = {
+        "document": document_layout(documents),
+        "bucketed": bucketed_layout(mongo.batches, args.bucket_seconds, args.bucket_records)
+    }
+
+    base = results["document"]
+    print(f"\nMongoDB side of {args.records} records ({args.bucket_seconds}s buckets, max {args.bucket_records} records):")
+    print(f"  {'layout':<10}{'documents':>11}{'MB':>9}{'index entries':>16}")
+    for name, r in results.items():
+        print(
+            f"  {name:<10}{r['documents']:>11}{r['bytes'] / 2**20:>9.2f}{r['index_entries']:>16}"
+            f"   ({r['bytes'] / base['bytes']:.0%} bytes, {r['index_entries'] / base['index_entries']:.0%} entries)"
+        )
+
+if __name__ == "__main__":
+    main()
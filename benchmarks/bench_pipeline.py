@@ -0,0 +1,181 @@
+"""
+End-to-end pipeline benchmark, in-process and without live databases.
+
+Drives decode -> Normalizer -> Analyzer -> Classifier -> Router over a
+deterministic record stream, with SQLite and an in-memory document store
+standing in for MySQL and MongoDB. Reports records/sec, time per stage and
+peak traced memory, and compares against stored baselines. Throughput is
+the median of --runs timed passes, so one noisy pass cannot fail the gate.
+
+Usage:
+    python -m benchmarks.bench_pipeline                   # run and print
+    python -m benchmarks.bench_pipeline --save-baseline   # record baselines
+    python -m benchmarks.bench_pipeline --compare         # exit 1 on regression
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+from benchmarks.generator import RecordGenerator
+from benchmarks.stand_ins import MemoryMongoHandler, SQLiteHandler
+from core.analyzer import Analyzer
+from core.classifier import Classifier
+from core.coordinator import ShardCoordinator
+from core.normalizer import Normalizer
+from core.router import Router
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baselines.json")
+
+SCENARIOS = {
+    "steady-10k-b50": {"records": 10000, "batch_size": 50},
+    "steady-20k-b500": {"records": 20000, "batch_size": 500},
+    "type-flip-10k-b50": {"records": 10000, "batch_size": 50, "drift": "type_flip"},
+}
+
+STAGES = ["decode", "normalize", "analyze", "classify", "schema_update", "route", "sql_write", "mongo_write"]
+
+class _Timed:
+    """Forwards to a handler, adding insert_batch time to a stage counter."""
+    def __init__(self, handler, stage, timings):
+        self._handler = handler
+        self._stage = stage
+        self._timings = timings
+
+    def insert_batch(self, records):
+        start = time.perf_counter()
+        self._handler.insert_batch(records)
+        self._timings[self._stage] += time.perf_counter() - start
+
+    def __getattr__(self, name):
+        return getattr(self._handler, name)
+
+def run_pipeline(lines, batch_size, sql_handler=None, mongo_handler=None, normalizer=None, rollups=None):
+    timings = defaultdict(float)
+    sql_handler = sql_handler or SQLiteHandler()
+    mongo_handler = mongo_handler or MemoryMongoHandler()
+    sql_handler.connect()
+
+    normalizer = normalizer or Normalizer()
+    analyzer = Analyzer(columnar=True)
+    classifier = Classifier(lower_threshold=0.75, upper_threshold=0.85)
+    coordinator = ShardCoordinator(analyzer, classifier, merge_interval=0)
+    shard = coordinator.create_shard()
+    router = Router(
+        _Timed(sql_handler, "sql_write", timings), _Timed(mongo_handler, "mongo_write", timings), rollups=rollups
+    )
+
+    def timed(stage, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        timings[stage] += time.perf_counter() - start
+        return result
+
+    start = time.perf_counter()
+    for i in range(0, len(lines), batch_size):
+        raw = timed("decode", lambda chunk: [json.loads(line) for line in chunk], lines[i:i + batch_size])
+        batch = timed("normalize", normalizer.normalize_batch, raw)
+        timed("analyze", shard.analyze_batch, batch)
+        epoch, decisions = timed("classify", coordinator.maybe_merge)
+        decisions = router.resolve_decisions(decisions, epoch)
+        timed("schema_update", sql_handler.update_schema, decisions)
+
+        writes_before = timings["sql_write"] + timings["mongo_write"]
+        timed("route", router.process_batch, batch, decisions)
+        timings["route"] -= timings["sql_write"] + timings["mongo_write"] - writes_before
+    elapsed = time.perf_counter() - start
+
+    sql_handler.close()
+    mongo_handler.close()
+    return elapsed, timings
+
+def run_scenario(name, records, batch_size, drift=None, verbose=False, runs=3):
+    lines = [json.dumps(rec) for rec in RecordGenerator(scenario=drift).records(records)]
+    quiet = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+
+    with quiet:
+        passes = sorted((run_pipeline(lines, batch_size) for _ in range(runs)), key=lambda run: run[0])
+        elapsed, timings = passes[len(passes) // 2]
+
+        # Separate pass for memory: tracemalloc would skew the timings
+        tracemalloc.start()
+        run_pipeline(lines, batch_size)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        "records_per_sec": records / elapsed,
+        "peak_memory_mb": peak / 2**20,
+        "stage_seconds": {stage: timings[stage] for stage in STAGES}
+    }
+
+def print_result(name, result):
+    print(f"\n[{name}] {result['records_per_sec']:.0f} rec/s, peak {result['peak_memory_mb']:.1f} MB")
+    total = sum(result["stage_seconds"].values()) or 1.0
+    for stage in STAGES:
+        seconds = result["stage_seconds"][stage]
+        print(f"  {stage:<14} {seconds * 1000:>9.1f} ms  {seconds / total:>6.1%}")
+
+def compare(name, result, baseline, tolerance):
+    failures = []
+    if result["records_per_sec"] < baseline["records_per_sec"] * (1 - tolerance):
+        failures.append(
+            f"throughput {result['records_per_sec']:.0f} rec/s < baseline {baseline['records_per_sec']:.0f} rec/s"
+        )
+    if result["peak_memory_mb"] > baseline["peak_memory_mb"] * (1 + tolerance):
+        failures.append(
+            f"peak memory {result['peak_memory_mb']:.1f} MB > baseline {baseline['peak_memory_mb']:.1f} MB"
+        )
+    for failure in failures:
+        print(f"  REGRESSION [{name}]: {failure}")
+    return not failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), action="append")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative regression")
+    parser.add_argument("--runs", type=int, default=3, help="timed passes per scenario; the median is kept")
+    parser.add_argument("--baseline-file", default=BASELINE_FILE)
+    parser.add_argument("--verbose", action="store_true", help="show pipeline log output")
+    args = parser.parse_args()
+
+    # Never call out to the AI uniqueness check from a benchmark
+    os.environ.pop("GROQ_API_KEY", None)
+
+    baselines = {}
+    if os.path.exists(args.baseline_file):
+        with open(args.baseline_file) as f:
+            baselines = json.load(f)
+
+    ok = True
+    for name in args.scenario or sorted(SCENARIOS):
+        result = run_scenario(name, verbose=args.verbose, runs=args.runs, **SCENARIOS[name])
+        print_result(name, result)
+
+        if args.compare:
+            if name not in baselines:
+                print(f"  No baseline for '{name}'; run with --save-baseline first.")
+                ok = False
+            else:
+                ok = compare(name, result, baselines[name], args.tolerance) and ok
+        if args.save_baseline:
+            baselines[name] = {k: result[k] for k in ("records_per_sec", "peak_memory_mb")}
+
+    if args.save_baseline:
+        with open(args.baseline_file, 'w') as f:
+            json.dump(baselines, f, indent=4)
+        print(f"\nBaselines written to {args.baseline_file}")
+
+    if args.compare:
+        print("\nComparison:", "OK" if ok else "FAILED")
+        sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
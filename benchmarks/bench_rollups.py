@@ -0,0 +1,85 @@
+"""
+Rollup maintenance cost and per-user summary reads, rollup versus raw rows.
+
+Runs the pipeline over a deterministic stream twice, without and with the
+rollups defined in config.ROLLUPS, and reports the write throughput of each.
+Then it answers "average heart_rate per hour" for a sample of users from
+the rollup table and from all of the users' stored records. Rollup reads
+should stay flat as the record count grows; raw reads grow with it.
+
+Usage:
+    python -m benchmarks.bench_rollups [--records N ...] [--users U]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from benchmarks.bench_pipeline import run_pipeline
+from benchmarks.generator import RecordGenerator
+from benchmarks.stand_ins import MemoryMongoHandler, SQLiteHandler, SQLiteRollupStore
+from core.rollups import Rollups
+from config import ROLLUPS
+
+def raw_hourly(sql, mongo, username):
+    """Averages heart_rate per hour over every stored record of the user."""
+    rows = sql.find({"username": username}, 10**9) + mongo.find({"username": username}, 10**9)
+    readings = defaultdict(list)
+    for row in rows:
+        value = row.get("heart_rate")
+        if isinstance(value, int) and not isinstance(value, bool):
+            ts = datetime.fromisoformat(str(row["timestamp"]))
+            readings[ts.replace(minute=0, second=0, microsecond=0)].append(value)
+    return {hour: sum(values) / len(values) for hour, values in readings.items()}
+
+def per_user_ms(lookup, usernames):
+    started = time.perf_counter()
+    for username in usernames:
+        lookup(username)
+    return (time.perf_counter() - started) * 1000 / len(usernames)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, action="append")
+    parser.add_argument("--users", type=int, default=50, help="users looked up per method")
+    args = parser.parse_args()
+
+    os.environ.pop("GROQ_API_KEY", None)
+
+    print(f"\n  {'records':>8}{'plain rec/s':>13}{'rollup rec/s':>14}{'raw ms/user':>13}{'rollup ms/user':>16}")
+    with tempfile.TemporaryDirectory() as directory:
+        for records in args.records or [10000, 40000]:
+            lines = [json.dumps(rec) for rec in RecordGenerator().records(records)]
+            with contextlib.redirect_stdout(io.StringIO()):
+                plain, _ = run_pipeline(lines, 50)
+
+            path = os.path.join(directory, f"bench-{records}.db")
+            mongo = MemoryMongoHandler()
+            rollups = Rollups(SQLiteRollupStore(), ROLLUPS)
+            with contextlib.redirect_stdout(io.StringIO()):
+                maintained, _ = run_pipeline(
+                    lines, 50, sql_handler=SQLiteHandler(path), mongo_handler=mongo, rollups=rollups
+                )
+            sql = SQLiteHandler(path)
+            sql.connect()
+
+            usernames = sorted({json.loads(line).get("username") for line in lines} - {None})
+            sample = random.Random(7).sample(usernames, min(args.users, len(usernames)))
+            raw_ms = per_user_ms(lambda username: raw_hourly(sql, mongo, username), sample)
+            rollup_ms = per_user_ms(lambda username: rollups.lookup("user_heart_rate_hourly", username), sample)
+
+            print(
+                f"  {records:>8}{records / plain:>13.0f}{records / maintained:>14.0f}"
+                f"{raw_ms:>13.2f}{rollup_ms:>16.3f}"
+            )
+            sql.close()
+            rollups.store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Benchmark: exact versus sampled Analyzer.analyze_batch under load.
+
+Analyzes the same stream of simulator-shaped batches exactly and at
+several sample fractions, and reports throughput, the largest frequency
+error against the exact stats, and how many fields' exact frequency lies
+within the reported 95% bound (about 95% is expected).
+
+Usage: python -m benchmarks.bench_sampling [--records N] [--batch-size B]
+"""
+import argparse
+import math
+import random
+import time
+
+from benchmarks.bench_analyzer import make_batch
+from core.analyzer import Analyzer
+
+FRACTIONS = [0.5, 0.2, 0.1]
+
+def analyze(batches, fraction):
+    analyzer = Analyzer(columnar=True)
+    start = time.perf_counter()
+    for batch in batches:
+        size = None if fraction is None else math.ceil(len(batch) * fraction)
+        analyzer.analyze_batch(batch, size)
+    return time.perf_counter() - start, analyzer.get_schema_stats()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=50)
+    args = parser.parse_args()
+
+    records = make_batch(args.records)
+    batches = [records[i:i + args.batch_size] for i in range(0, len(records), args.batch_size)]
+    random.seed(7)
+
+    elapsed, exact = analyze(batches, None)
+    print(f"{'mode':>10} {'rec/s':>10} {'max |err|':>10} {'in bound':>9}")
+    print(f"{'exact':>10} {len(records) / elapsed:>10.0f} {'-':>10} {'-':>9}")
+    for fraction in FRACTIONS:
+        elapsed, sampled = analyze(batches, fraction)
+        errors = [abs(sampled[f]["frequency_ratio"] - exact[f]["frequency_ratio"]) for f in exact]
+        covered = sum(
+            abs(sampled[f]["frequency_ratio"] - exact[f]["frequency_ratio"]) <= sampled[f]["frequency_error"]
+            for f in exact if sampled[f]["frequency_error"]
+        )
+        bounded = sum(1 for f in exact if sampled[f]["frequency_error"])
+        print(
+            f"{fraction:>10.0%} {len(records) / elapsed:>10.0f} {max(errors):>10.4f} "
+            f"{covered:>4}/{bounded:<4}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""Deterministic record stream built from the simulator's field pool."""
+import random
+from datetime import datetime, timedelta
+
+import simulation_code
+
+class RecordGenerator:
+    """
+    Replays the simulator's records under a fixed seed, optionally with one
+    of simulation_code.SCENARIOS applied after `drift_at` of the stream.
+    Wall-clock fields ('timestamp', 'last_seen') are rewritten from a
+    synthetic clock so two runs produce identical records.
+    """
+    def __init__(self, seed=42, start=datetime(2024, 1, 1), step=timedelta(milliseconds=10),
+                 scenario=None, drift_at=0.5):
+        self.seed = seed
+        self.scenario = scenario
+        self.drift_at = drift_at
+        self.start = start
+        self.step = step
+
+    def records(self, count):
+        random.seed(self.seed)
+        simulation_code.faker.seed_instance(self.seed)
+        clock = self.start
+
+        for index in range(count):
+            record = simulation_code.generate_scenario_record(index, count, self.scenario, self.drift_at)
+            record["timestamp"] = clock.isoformat()
+            if "last_seen" in record:
+                record["last_seen"] = (clock - timedelta(minutes=5)).isoformat()
+            clock += self.step
+            yield record
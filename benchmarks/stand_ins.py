@@ -0,0 +1,412 @@
+"""
+Local stand-ins for SQLHandler, RollupStore and MongoHandler so the
+pipeline can run without a MySQL or MongoDB server. They implement the
+same methods the Router and main.py call; SQL goes to SQLite, documents
+stay in memory.
+"""
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+from core.classifier import OVERFLOW_COLUMN
+from db.rollup_store import APPLIED_COLUMNS, APPLIED_TABLE, COLUMN_TYPES, column_definitions, merge_assignments
+from db.sql_handler import json_path, unpack_row
+
+class SQLiteHandler:
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self.table_name = "structured_data"
+        self.conn = None
+        self.cursor = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        # Return DATETIME columns as datetime objects, as mysql.connector does
+        sqlite3.register_converter("DATETIME", lambda raw: datetime.fromisoformat(raw.decode()))
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+        self.cursor = self.conn.cursor()
+        self._create_base_table()
+
+    def _create_base_table(self):
+        self.cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {self.table_name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username VARCHAR(255),
+            timestamp DATETIME,
+            sys_ingested_at DATETIME
+        )
+        """)
+        self.cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_sys_ingested_at ON {self.table_name} (sys_ingested_at)")
+        self.cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_username ON {self.table_name} (username)")
+        self.conn.commit()
+        self._refresh_schema_cache()
+
+    def _refresh_schema_cache(self):
+        # table_xinfo also lists generated columns, flagged by hidden = 2 (virtual) or 3 (stored)
+        self.cursor.execute(f"PRAGMA table_xinfo({self.table_name})")
+        rows = self.cursor.fetchall()
+        self.existing_cols = {row[1] for row in rows}
+        self.column_types = {row[1]: row[2].lower() for row in rows}
+        self.generated_cols = {row[1] for row in rows if row[6] in (2, 3)}
+
+    def refresh_schema(self):
+        self._refresh_schema_cache()
+
+    def sync_schema(self, schema_decisions):
+        if any(
+            decision['target'] in ['SQL', 'BOTH'] and decision.get('column', field) not in self.existing_cols
+            or decision['target'] == 'JSON' and decision.get('indexed') != (decision['column'] in self.existing_cols)
+            for field, decision in schema_decisions.items()
+        ):
+            self._refresh_schema_cache()
+
+    def update_schema(self, schema_decisions):
+        for field, decision in schema_decisions.items():
+            column = decision.get('column', field)
+            if decision['target'] in ['SQL', 'BOTH'] and column not in self.existing_cols:
+                sql_type = decision.get('sql_type', 'TEXT')
+                self.cursor.execute(f"ALTER TABLE {self.table_name} ADD COLUMN {column} {sql_type}")
+                if decision.get('is_unique', False):
+                    # SQLite can't add a UNIQUE column in place
+                    self.cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS uq_{column} ON {self.table_name} ({column})")
+                self.existing_cols.add(column)
+                self.column_types[column] = sql_type.lower()
+            elif decision['target'] in ['SQL', 'BOTH']:
+                # SQLite columns are dynamically typed; widening is bookkeeping only
+                self.column_types[column] = decision.get('sql_type', 'TEXT').lower()
+            elif decision['target'] == 'JSON':
+                self._update_overflow(field, decision)
+        self.conn.commit()
+
+    def _update_overflow(self, field, decision):
+        if OVERFLOW_COLUMN not in self.existing_cols:
+            self.cursor.execute(f"ALTER TABLE {self.table_name} ADD COLUMN {OVERFLOW_COLUMN} TEXT")
+            self.existing_cols.add(OVERFLOW_COLUMN)
+            self.column_types[OVERFLOW_COLUMN] = 'text'
+        column = decision['column']
+        if decision.get('indexed') and column not in self.existing_cols:
+            # json_extract returns true/false as 1/0, as the MySQL expression does
+            self.cursor.execute(
+                f"ALTER TABLE {self.table_name} ADD COLUMN {column} "
+                f"GENERATED ALWAYS AS (json_extract({OVERFLOW_COLUMN}, '{json_path(field)}')) VIRTUAL"
+            )
+            self.cursor.execute(f"CREATE INDEX {column} ON {self.table_name} ({column})")
+            self.existing_cols.add(column)
+            self.generated_cols.add(column)
+        elif not decision.get('indexed') and column in self.existing_cols:
+            self.drop_column(column)
+
+    def fetch_column(self, column):
+        self.cursor.execute(
+            f"SELECT username, sys_ingested_at, {column} FROM {self.table_name} WHERE {column} IS NOT NULL"
+        )
+        return self.cursor.fetchall()
+
+    def fetch_json_field(self, field):
+        if OVERFLOW_COLUMN not in self.existing_cols:
+            return []
+        self.cursor.execute(
+            f"SELECT username, sys_ingested_at, {OVERFLOW_COLUMN} -> ? FROM {self.table_name} "
+            f"WHERE json_type({OVERFLOW_COLUMN}, ?) IS NOT NULL",
+            (json_path(field), json_path(field))
+        )
+        return [(username, sys_time, json.loads(value)) for username, sys_time, value in self.cursor.fetchall()]
+
+    def move_to_json(self, field, sql_type=None):
+        if field not in self.existing_cols:
+            return
+        value = f"json(CASE WHEN {field} THEN 'true' ELSE 'false' END)" if sql_type == 'BOOLEAN' else field
+        self.cursor.execute(
+            f"UPDATE {self.table_name} SET {OVERFLOW_COLUMN} = json_set(COALESCE({OVERFLOW_COLUMN}, '{{}}'), ?, {value}) "
+            f"WHERE {field} IS NOT NULL",
+            (json_path(field),)
+        )
+        self.conn.commit()
+        self.drop_column(field)
+
+    def drop_json_field(self, field, column=None):
+        if column:
+            self.drop_column(column)
+        if OVERFLOW_COLUMN not in self.existing_cols:
+            return
+        self.cursor.execute(
+            f"UPDATE {self.table_name} SET {OVERFLOW_COLUMN} = json_remove({OVERFLOW_COLUMN}, ?) "
+            f"WHERE json_type({OVERFLOW_COLUMN}, ?) IS NOT NULL",
+            (json_path(field), json_path(field))
+        )
+        self.conn.commit()
+
+    def find(self, filters, limit=10, json_filters=None):
+        conditions = [f"{column} = ?" for column in filters]
+        params = [*map(_sql_value, filters.values())]
+        for field, value in (json_filters or {}).items():
+            conditions.append(f"{OVERFLOW_COLUMN} -> ? = json(?)")
+            params += [json_path(field), json.dumps(value)]
+        where = ' AND '.join(conditions) or '1=1'
+        cursor = self.conn.cursor()
+        cursor.execute(f"SELECT * FROM {self.table_name} WHERE {where} LIMIT ?", [*params, limit])
+        names = [d[0] for d in cursor.description]
+        return [unpack_row(dict(zip(names, row)), self.generated_cols) for row in cursor.fetchall()]
+
+    def scan(self, start=None, end=None, batch_size=1000):
+        conditions, params = ["sys_ingested_at IS NOT NULL"], []
+        if start is not None:
+            conditions.append("sys_ingested_at >= ?")
+            params.append(_sql_value(start))
+        if end is not None:
+            conditions.append("sys_ingested_at < ?")
+            params.append(_sql_value(end))
+
+        cursor = self.conn.cursor()
+        with self.lock:
+            cursor.execute(
+                f"SELECT * FROM {self.table_name} WHERE {' AND '.join(conditions)} ORDER BY sys_ingested_at, id",
+                params
+            )
+            names = [d[0] for d in cursor.description]
+        while True:
+            # Partitions share the one SQLite connection
+            with self.lock:
+                rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield unpack_row(dict(zip(names, row)), self.generated_cols)
+
+    def ingested_range(self):
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute(f"SELECT MIN(sys_ingested_at), MAX(sys_ingested_at) FROM {self.table_name}")
+            row = cursor.fetchone()
+        # Aggregates lose the declared type
+        return tuple(datetime.fromisoformat(v) if isinstance(v, str) else v for v in row)
+
+    def fetch_older_than(self, cutoff, limit):
+        cursor = self.conn.cursor()
+        cursor.execute(
+            f"SELECT * FROM {self.table_name} WHERE sys_ingested_at < ? ORDER BY id LIMIT ?", (_sql_value(cutoff), limit)
+        )
+        names = [d[0] for d in cursor.description]
+        rows = [unpack_row(dict(zip(names, row)), self.generated_cols) for row in cursor.fetchall()]
+        return rows, [row['id'] for row in rows]
+
+    def delete_rows(self, ids):
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            self.cursor.execute(f"DELETE FROM {self.table_name} WHERE id IN ({', '.join(['?'] * len(chunk))})", chunk)
+        self.conn.commit()
+
+    def drop_column(self, column):
+        if column not in self.existing_cols:
+            return
+        self.cursor.execute(f"DROP INDEX IF EXISTS uq_{column}")
+        if column in self.generated_cols:
+            # MySQL drops a column's indexes with it; SQLite refuses
+            self.cursor.execute(f"DROP INDEX IF EXISTS {column}")
+        self.cursor.execute(f"ALTER TABLE {self.table_name} DROP COLUMN {column}")
+        self.conn.commit()
+        self.existing_cols.discard(column)
+        self.generated_cols.discard(column)
+        self.column_types.pop(column, None)
+
+    def indexes(self):
+        self.cursor.execute(f"PRAGMA index_list({self.table_name})")
+        names = [row[1] for row in self.cursor.fetchall()]
+        indexes = {}
+        for name in names:
+            self.cursor.execute(f"PRAGMA index_info({name})")
+            indexes[name] = [row[2] for row in sorted(self.cursor.fetchall())]
+        return indexes
+
+    def create_index(self, name, columns):
+        self.cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {self.table_name} ({', '.join(columns)})")
+        self.conn.commit()
+
+    def drop_index(self, name):
+        self.cursor.execute(f"DROP INDEX IF EXISTS {name}")
+        self.conn.commit()
+
+    def insert_batch(self, records):
+        if not records:
+            return
+
+        for record in records:
+            filtered_rec = {
+                k: _sql_value(v) for k, v in record.items() if k in self.existing_cols and k not in self.generated_cols
+            }
+            if not filtered_rec:
+                continue
+            if OVERFLOW_COLUMN in filtered_rec:
+                filtered_rec[OVERFLOW_COLUMN] = json.dumps(filtered_rec[OVERFLOW_COLUMN])
+
+            columns = ', '.join(filtered_rec.keys())
+            placeholders = ', '.join(['?'] * len(filtered_rec))
+            try:
+                self.cursor.execute(
+                    f"INSERT INTO {self.table_name} ({columns}) VALUES ({placeholders})",
+                    list(filtered_rec.values())
+                )
+            except sqlite3.Error as err:
+                print(f"Insert Error: {err}")
+
+        self.conn.commit()
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+
+def _sql_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+class SQLiteRollupStore:
+    """RollupStore on SQLite: the same tables and merge rules, as INSERT ... ON CONFLICT."""
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        sqlite3.register_converter("DATETIME", lambda raw: datetime.fromisoformat(raw.decode()))
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+        self.conn.row_factory = sqlite3.Row
+
+    def ensure(self, rollup):
+        with self.lock:
+            if self.conn is None:
+                self.connect()
+            self.conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {rollup.table} "
+                f"({', '.join(column_definitions(rollup))}, PRIMARY KEY ({', '.join(rollup.key_columns)}))"
+            )
+            existing = {row[1] for row in self.conn.execute(f"PRAGMA table_info({rollup.table})")}
+            for column, merge in rollup.columns:
+                if column not in existing:
+                    self.conn.execute(f"ALTER TABLE {rollup.table} ADD COLUMN {column} {COLUMN_TYPES[merge]}")
+            self.conn.commit()
+
+    def ensure_applied(self):
+        with self.lock:
+            if self.conn is None:
+                self.connect()
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS {APPLIED_TABLE} ({APPLIED_COLUMNS})")
+            self.conn.commit()
+
+    def applied(self, source, lsns):
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT lsn FROM {APPLIED_TABLE} WHERE source = ? AND lsn BETWEEN ? AND ?",
+                (source, min(lsns), max(lsns))
+            ).fetchall()
+        return {row[0] for row in rows} & set(lsns)
+
+    def upsert(self, updates, source=None, lsns=()):
+        with self.lock:
+            try:
+                for rollup, rows in updates:
+                    columns = rollup.key_columns + [column for column, _ in rollup.columns]
+                    self.conn.executemany(
+                        f"INSERT INTO {rollup.table} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))}) "
+                        f"ON CONFLICT ({', '.join(rollup.key_columns)}) "
+                        f"DO UPDATE SET {merge_assignments(rollup, lambda column: f'excluded.{column}')}",
+                        [[_sql_value(v) for v in row] for row in rows]
+                    )
+                if lsns:
+                    self.conn.executemany(
+                        f"INSERT INTO {APPLIED_TABLE} (source, lsn) VALUES (?, ?)", [(source, lsn) for lsn in lsns]
+                    )
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def forget(self, source, checkpoint):
+        with self.lock:
+            self.conn.execute(f"DELETE FROM {APPLIED_TABLE} WHERE source = ? AND lsn <= ?", (source, checkpoint))
+            self.conn.commit()
+
+    def fetch(self, rollup, username, filters, limit):
+        conditions = ['username = ?'] + [f"{column} = ?" for column in filters]
+        order = ', '.join(f"{column} DESC" for column in reversed(rollup.key_columns[1:])) or 'username'
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT * FROM {rollup.table} WHERE {' AND '.join(conditions)} ORDER BY {order} LIMIT ?",
+                [username, *(_sql_value(v) for v in filters.values()), limit]
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+
+class MemoryMongoHandler:
+    """In-memory document store with the MongoHandler write and find methods."""
+    def __init__(self):
+        self.documents = []
+        self.next_id = 0
+
+    def _new_id(self):
+        self.next_id += 1
+        return self.next_id
+
+    def insert_batch(self, records):
+        for rec in records:
+            doc = dict(rec)
+            doc["_id"] = self._new_id()
+            self.documents.append(doc)
+
+    def set_field(self, field, rows):
+        index = {(d.get("username"), d.get("sys_ingested_at")): d for d in self.documents}
+        for username, sys_time, value in rows:
+            key = (username, sys_time)
+            doc = index.get(key)
+            if doc is None:
+                doc = {"_id": self._new_id(), "username": username, "sys_ingested_at": sys_time}
+                self.documents.append(doc)
+                index[key] = doc
+            doc[field] = value
+
+    def find(self, filters, limit=10):
+        matches = []
+        for doc in self.documents:
+            if all(_lookup(doc, field) == value for field, value in filters.items()):
+                matches.append({k: v for k, v in doc.items() if k != "_id"})
+                if len(matches) >= limit:
+                    break
+        return matches
+
+    def scan(self, start=None, end=None, batch_size=1000):
+        docs = [
+            d for d in self.documents
+            if isinstance(d.get("sys_ingested_at"), datetime)
+            and (start is None or d["sys_ingested_at"] >= start)
+            and (end is None or d["sys_ingested_at"] < end)
+        ]
+        docs.sort(key=lambda d: d["sys_ingested_at"])
+        for doc in docs:
+            yield {k: v for k, v in doc.items() if k != "_id"}
+
+    def ingested_range(self):
+        times = [d["sys_ingested_at"] for d in self.documents if isinstance(d.get("sys_ingested_at"), datetime)]
+        return (min(times), max(times)) if times else (None, None)
+
+    def fetch_older_than(self, cutoff, limit):
+        docs = [
+            d for d in self.documents
+            if isinstance(d.get("sys_ingested_at"), datetime) and d["sys_ingested_at"] < cutoff
+        ][:limit]
+        return [{k: v for k, v in d.items() if k != "_id"} for d in docs], [d["_id"] for d in docs]
+
+    def delete_ids(self, ids):
+        ids = set(ids)
+        self.documents = [d for d in self.documents if d["_id"] not in ids]
+
+    def close(self):
+        pass
+
+def _lookup(doc, path):
+    for segment in path.split('.'):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(segment)
+    return doc
@@ -0,0 +1,52 @@
+"""Settings and saved metadata shared by main.py and the standalone tools."""
+import json
+import os
+
+METADATA_FILE = "metadata/schema_map.json"
+# Committed batches are published here for tail_feed.py and other consumers
+FEED_DIR = "data/feed"
+FEED_SEGMENT_BYTES = 16 * 1024 * 1024
+FEED_RETAIN_BYTES = 256 * 1024 * 1024
+
+# Per-user summaries maintained as batches are written; see core/rollups.py
+ROLLUPS = [
+    {
+        "name": "user_device",
+        "aggregates": {
+            "device_model": ["latest", "device_model"],
+            "os": ["latest", "os"],
+            "app_version": ["latest", "app_version"],
+            "battery": ["latest", "battery"],
+            "network": ["latest", "network"]
+        }
+    },
+    {
+        "name": "user_actions",
+        "group_by": ["action"],
+        "aggregates": {"records": ["count", None], "purchase_value": ["sum", "purchase_value"]}
+    },
+    {
+        "name": "user_heart_rate_hourly",
+        "bucket": "hour",
+        "aggregates": {
+            "readings": ["count", "heart_rate"],
+            "heart_rate_avg": ["avg", "heart_rate"],
+            "heart_rate_min": ["min", "heart_rate"],
+            "heart_rate_max": ["max", "heart_rate"]
+        }
+    }
+]
+
+def load_metadata():
+    if os.path.exists(METADATA_FILE):
+        try:
+            with open(METADATA_FILE, 'r') as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            return {}
+    return {}
+
+def save_metadata(stats):
+    os.makedirs(os.path.dirname(METADATA_FILE), exist_ok=True)
+    with open(METADATA_FILE, 'w') as f:
+        json.dump(stats, f, indent=4)
@@ -1,42 +1,305 @@
 """Analyzes field statistics from incoming data."""
-import copy
+import math
+import random
+import sys
 import threading
-from datetime import datetime
 
-class Analyzer:
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from core.sketch import CardinalitySketch
+
+# Below this many values a builtin min()/max() beats the NumPy conversion cost
+NUMPY_MIN_COLUMN = 256
+# z for the two-sided 95% bounds reported on sampled frequencies
+CONFIDENCE_Z = 1.96
+
+# Type membership is a bitmask; unseen type names get the next free bit.
+# Names (not bits) are what gets persisted, so bit order never leaks out.
+# Nulls are counted in null_count rather than as a type.
+TYPE_NAMES = ['str', 'int', 'float', 'bool', 'datetime', 'dict', 'list']
+TYPE_BITS = {name: 1 << i for i, name in enumerate(TYPE_NAMES)}
+_type_lock = threading.Lock()
+
+def type_bit(name):
+    bit = TYPE_BITS.get(name)
+    if bit is None:
+        with _type_lock:
+            bit = TYPE_BITS.get(name)
+            if bit is None:
+                bit = 1 << len(TYPE_NAMES)
+                TYPE_NAMES.append(name)
+                TYPE_BITS[name] = bit
+    return bit
+
+def type_names(mask):
+    return [name for i, name in enumerate(TYPE_NAMES) if mask >> i & 1]
+
+class FieldStats:
+    """Per-field running statistics, kept compact for large field counts."""
+    __slots__ = ('count', 'type_mask', 'is_nested', 'null_count', 'min', 'max', 'max_length', 'sketch',
+                 'imputed', 'variance')
+
     def __init__(self):
+        self.count = 0
+        self.type_mask = 0
+        self.is_nested = False
+        self.null_count = 0
+        self.min = None
+        self.max = None
+        self.max_length = 0
+        self.sketch = CardinalitySketch()
+        # Part of count credited to records skipped by sampling, and the variance that adds
+        self.imputed = 0
+        self.variance = 0.0
+
+    @property
+    def types(self):
+        return type_names(self.type_mask)
+
+    def merge_range(self, low, high):
+        if self.min is None or low < self.min:
+            self.min = low
+        if self.max is None or high > self.max:
+            self.max = high
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "types": type_names(self.type_mask),
+            "is_nested": self.is_nested,
+            "null_count": self.null_count,
+            "min": self.min,
+            "max": self.max,
+            "max_length": self.max_length,
+            "sketch": self.sketch.to_dict(),
+            "imputed": self.imputed,
+            "variance": self.variance
+        }
+
+    def merge_dict(self, other):
+        self.count += other["count"]
+        for name in other["types"]:
+            # Older metadata listed NoneType as a type
+            if name != 'NoneType':
+                self.type_mask |= type_bit(name)
+        self.is_nested = self.is_nested or other["is_nested"]
+        self.null_count += other.get("null_count", 0)
+        self.imputed += other.get("imputed", 0)
+        self.variance += other.get("variance", 0.0)
+        if other.get("min") is not None:
+            self.merge_range(other["min"], other["max"])
+        if other.get("max_length", 0) > self.max_length:
+            self.max_length = other["max_length"]
+        if "sketch" in other:
+            self.sketch.merge(CardinalitySketch.from_dict(other["sketch"]))
+        elif other.get("unique_values"):
+            # Older metadata only kept a small sample of raw values
+            self.sketch.update(other["unique_values"])
+
+class SamplingPolicy:
+    """
+    Decides, per batch, whether the processors can afford exact analysis.
+    Sampling starts once the raw queue is high_water full or records wait
+    max_lag seconds between ingest and analysis, and stops when both have
+    fallen back (below low_water and half of max_lag). While sampling, a
+    `fraction` of each batch is analyzed; every record is still routed.
+    """
+    def __init__(self, high_water=0.5, low_water=0.2, max_lag=2.0, fraction=0.2, min_sample=10):
+        self.high_water = high_water
+        self.low_water = low_water
+        self.max_lag = max_lag
+        self.fraction = fraction
+        self.min_sample = min_sample
+        self.sampling = False
+        self.lock = threading.Lock()
+
+    def sample_size(self, batch_size, fill, lag):
+        """Records of the batch to analyze, or None for all of them."""
+        with self.lock:
+            if self.sampling and fill <= self.low_water and lag <= self.max_lag / 2:
+                self.sampling = False
+                print(f"[Analyzer] Load dropped (queue {fill:.0%}, lag {lag:.1f}s); back to exact analysis.")
+            elif not self.sampling and (fill >= self.high_water or lag >= self.max_lag):
+                self.sampling = True
+                print(
+                    f"[Analyzer] Falling behind (queue {fill:.0%}, lag {lag:.1f}s); "
+                    f"analyzing {self.fraction:.0%} samples of each batch."
+                )
+            if not self.sampling:
+                return None
+        return min(batch_size, max(self.min_sample, math.ceil(batch_size * self.fraction)))
+
+class Analyzer:
+    def __init__(self, columnar=False, max_nested_paths=256, max_path_depth=3):
         self.field_stats = {}
         self.total_records_processed = 0
+        # Records whose stats were estimated from a sample of their batch
+        self.sampled_records = 0
+        self.columnar = columnar
+        # Dotted paths inside nested values ("metadata.sensor_data.version")
+        # are tracked like fields, up to a fixed number of paths and segments
+        self.max_nested_paths = max_nested_paths
+        self.max_path_depth = max_path_depth
+        self.nested_paths = set()
+        self.dropped_path_values = 0
         self.lock = threading.Lock()
 
-    def analyze_batch(self, batch):
+    def analyze_batch(self, batch, sample_size=None):
+        """
+        With sample_size below len(batch), only a uniform random sample of
+        that many records is analyzed (what a reservoir over the batch
+        yields) and its counts are scaled up to the whole batch.
+        """
         if not batch:
             return
 
         with self.lock:
             self.total_records_processed += len(batch)
 
-            for record in batch:
-                for key, value in record.items():
-                    if key not in self.field_stats:
-                        self.field_stats[key] = {
-                            "count": 0,
-                            "types": set(),  
-                            "is_nested": False,
-                            "unique_values": set(),
-                            "base_unique_count": 0,
-                            "_unique_capped": False
-                        }
-
-                    self.field_stats[key]["count"] += 1
-                    current_type = type(value).__name__
-                    self.field_stats[key]["types"].add(current_type)
-
-                    if isinstance(value, (dict, list)):
-                        self.field_stats[key]["is_nested"] = True
-                    else:
-                        if len(self.field_stats[key]["unique_values"]) < 1000:
-                            self.field_stats[key]["unique_values"].add(value)
+            if sample_size is not None and sample_size < len(batch):
+                # The columnar pass sees each field's sampled occurrences at once
+                self._analyze_columns(random.sample(batch, max(1, sample_size)), len(batch))
+                self.sampled_records += len(batch)
+            elif self.columnar:
+                self._analyze_columns(batch)
+            else:
+                self._analyze_rows(batch)
+
+    def _field(self, key):
+        stats = self.field_stats.get(key)
+        if stats is None:
+            key = sys.intern(key)
+            stats = self.field_stats[key] = FieldStats()
+            if '.' in key:
+                self.nested_paths.add(key)
+        return stats
+
+    def _track_path(self, path):
+        if path in self.nested_paths:
+            return True
+        if len(self.nested_paths) < self.max_nested_paths:
+            self.nested_paths.add(sys.intern(path))
+            return True
+        self.dropped_path_values += 1
+        return False
+
+    def _flatten(self, prefix, value, segments, out):
+        for key, child in value.items():
+            path = f"{prefix}.{key}"
+            if isinstance(child, dict) and child and segments + 1 < self.max_path_depth:
+                self._flatten(path, child, segments + 1, out)
+            elif self._track_path(path):
+                out.append((path, child))
+        return out
+
+    def _analyze_rows(self, batch):
+        for record in batch:
+            for key, value in record.items():
+                self._observe(self._field(key), value)
+                if isinstance(value, dict) and self.max_path_depth > 1:
+                    for path, child in self._flatten(key, value, 1, []):
+                        self._observe(self._field(path), child)
+
+    def _observe(self, stats, value):
+        stats.count += 1
+        if value is None:
+            stats.null_count += 1
+            return
+        stats.type_mask |= type_bit(type(value).__name__)
+
+        if isinstance(value, (dict, list)):
+            stats.is_nested = True
+            return
+
+        stats.sketch.add(value)
+        if type(value) in (int, float):
+            stats.merge_range(value, value)
+        elif type(value) is str and len(value) > stats.max_length:
+            stats.max_length = len(value)
+
+    def _pivot(self, batch):
+        columns = {}
+        descend = self.max_path_depth > 1
+        for record in batch:
+            for key, value in record.items():
+                column = columns.get(key)
+                if column is None:
+                    columns[key] = [value]
+                else:
+                    column.append(value)
+
+                if descend and isinstance(value, dict):
+                    for path, child in self._flatten(key, value, 1, []):
+                        column = columns.get(path)
+                        if column is None:
+                            columns[path] = [child]
+                        else:
+                            column.append(child)
+        return columns
+
+    def _analyze_columns(self, batch, population=None):
+        """
+        Pivots the batch into per-field columns and updates each field in
+        whole-column passes. With a population, batch is a sample of that
+        many records and counts are scaled to it.
+        """
+        scale = population / len(batch) if population else 1
+        for key, column in self._pivot(batch).items():
+            stats = self._field(key)
+            kinds = set(map(type, column))
+
+            stats.count += len(column) * scale
+            if population:
+                stats.imputed += len(column) * (scale - 1)
+                stats.variance += _sampling_variance(len(column), len(batch), population)
+            scalars = column
+            if type(None) in kinds:
+                kinds.discard(type(None))
+                scalars = [v for v in column if v is not None]
+                stats.null_count += (len(column) - len(scalars)) * scale
+                if not scalars:
+                    continue
+            for kind in kinds:
+                stats.type_mask |= type_bit(kind.__name__)
+
+            if any(issubclass(kind, (dict, list)) for kind in kinds):
+                stats.is_nested = True
+                scalars = [v for v in scalars if not isinstance(v, (dict, list))]
+                if not scalars:
+                    continue
+
+            if int in kinds or float in kinds:
+                if kinds <= {int, float}:
+                    numbers = scalars
+                else:
+                    numbers = [v for v in scalars if type(v) in (int, float)]
+                stats.merge_range(*self._column_range(numbers))
+
+            if str in kinds:
+                strings = scalars if kinds == {str} else [v for v in scalars if type(v) is str]
+                longest = max(map(len, strings))
+                if longest > stats.max_length:
+                    stats.max_length = longest
+
+            if len(kinds) == 1:
+                stats.sketch.update(set(scalars))
+            else:
+                # 1, 1.0 and True are one set element but three values to the sketch
+                stats.sketch.update(value for _, value in {(type(v), v) for v in scalars})
+
+    def _column_range(self, numbers):
+        if np is not None and len(numbers) >= NUMPY_MIN_COLUMN:
+            try:
+                arr = np.asarray(numbers, dtype=np.float64)
+            except (OverflowError, ValueError):
+                pass
+            else:
+                # Index back into the column so ints stay ints
+                return numbers[int(arr.argmin())], numbers[int(arr.argmax())]
+        return min(numbers), max(numbers)
 
     def get_schema_stats(self):
         with self.lock:
@@ -44,87 +307,111 @@ class Analyzer:
 
             for key, stats in self.field_stats.items():
                 freq_ratio = 0.0
+                freq_error = 0.0
                 if self.total_records_processed > 0:
-                    freq_ratio = stats["count"] / self.total_records_processed
+                    freq_ratio = min(1.0, stats.count / self.total_records_processed)
+                    freq_error = CONFIDENCE_Z * math.sqrt(stats.variance) / self.total_records_processed
 
-                unique_types = list(stats["types"])
-                is_stable = (len(unique_types) == 1)
-                detected_type = unique_types[0] if is_stable else "mixed"
+                # "T or null" is stable; a field that was only ever null is NoneType
+                unique_types = type_names(stats.type_mask)
+                is_stable = (len(unique_types) <= 1)
+                if not unique_types:
+                    detected_type = 'NoneType'
+                else:
+                    detected_type = unique_types[0] if is_stable else "mixed"
 
-                session_unique_count = len(stats["unique_values"])
-                total_unique_count = stats.get("base_unique_count", 0) + session_unique_count
-                
+                # Distinct values are judged against the values actually seen, not the scaled count
                 unique_ratio = 0.0
-                if stats["count"] > 0:
-                    unique_ratio = total_unique_count / stats["count"]
-                
-                if session_unique_count >= 1000 or stats.get("_unique_capped"):
-                    pass
+                observed = stats.count - stats.imputed
+                if observed > 0:
+                    unique_ratio = min(1.0, stats.sketch.count() / observed)
 
                 summary[key] = {
                     "frequency_ratio": freq_ratio,
+                    "frequency_error": freq_error,
                     "type_stability": "stable" if is_stable else "unstable",
                     "detected_type": detected_type,
-                    "is_nested": stats["is_nested"],
+                    "types": unique_types,
+                    "nullable": stats.null_count > 0,
+                    "is_nested": stats.is_nested,
                     "unique_ratio": unique_ratio,
-                    "count": stats["count"]
+                    "count": round(stats.count),
+                    "null_count": round(stats.null_count),
+                    "min": stats.min,
+                    "max": stats.max,
+                    "max_length": stats.max_length
                 }
 
             return summary
 
     def export_stats(self):
         with self.lock:
-            export_data = {
-                "total_records_processed": self.total_records_processed,
-                "field_stats": {}
-            }
-            
-            for key, stats in self.field_stats.items():
-                export_stats = copy.deepcopy(stats)
-                export_stats["types"] = list(export_stats["types"])
-                
-                total_unique = stats["base_unique_count"] + len(stats["unique_values"])
-                export_stats["base_unique_count"] = total_unique
-                
-                if len(stats["unique_values"]) > 20:
-                    export_stats["unique_values"] = []
-                    if len(stats["unique_values"]) >= 1000:
-                        stats["_unique_capped"] = True
-                        export_stats["_unique_capped"] = True
-                else:
-                    export_stats["unique_values"] = [
-                        v.isoformat() if isinstance(v, datetime) else v 
-                        for v in stats["unique_values"]
-                    ]
-                
-                export_data["field_stats"][key] = export_stats
-                    
-            return export_data
+            return self._export(self.field_stats, self.total_records_processed)
+
+    def drain_stats(self):
+        """Exports the stats gathered since the last drain and resets them, for shard deltas."""
+        with self.lock:
+            delta = self._export(self.field_stats, self.total_records_processed)
+            self.field_stats = {}
+            self.total_records_processed = 0
+            self.sampled_records = 0
+            # The paths now live in the merged analyzer; the shard starts a fresh budget
+            self.nested_paths = set()
+            self.dropped_path_values = 0
+            return delta
+
+    def _export(self, field_stats, total):
+        return {
+            "total_records_processed": total,
+            "sampled_records": self.sampled_records,
+            "dropped_path_values": self.dropped_path_values,
+            "field_stats": {key: stats.to_dict() for key, stats in field_stats.items()}
+        }
+
+    def merge_stats(self, delta):
+        """Folds exported stats (e.g. a shard's drain_stats()) into this analyzer."""
+        with self.lock:
+            self.total_records_processed += delta.get("total_records_processed", 0)
+            self.sampled_records += delta.get("sampled_records", 0)
+            self.dropped_path_values += delta.get("dropped_path_values", 0)
+
+            for key, other in delta.get("field_stats", {}).items():
+                # Shards each start a fresh path budget after a drain; the cap holds here
+                if '.' in key and key not in self.nested_paths and len(self.nested_paths) >= self.max_nested_paths:
+                    self.dropped_path_values += round(other["count"])
+                    continue
+                self._field(key).merge_dict(other)
+
+    def forget(self, keys):
+        """Drops the stats of evicted fields; paths free their slot for new ones."""
+        with self.lock:
+            for key in keys:
+                self.field_stats.pop(key, None)
+                self.nested_paths.discard(key)
 
     def load_stats(self, loaded_data):
         if "field_stats" in loaded_data:
-            self.total_records_processed = loaded_data.get("total_records_processed", 0)
+            total = loaded_data.get("total_records_processed", 0)
             data_stats = loaded_data["field_stats"]
         else:
             data_stats = loaded_data
-            self.total_records_processed = 0
+            total = 0
 
         with self.lock:
             self.field_stats = {}
-            for key, stats in data_stats.items():
-                self.field_stats[key] = stats
-                stats["types"] = set(stats["types"])
-                
-                is_capped = stats.get("_unique_capped", False)
-                restored_set = set(stats.get("unique_values", []))
-                stats["unique_values"] = restored_set
-                
-                total_from_json = stats.get("base_unique_count", 0)
-                
-                if is_capped:
-                    # If it was already capped, we trick the logic to keep it capped
-                    if len(restored_set) < 1000:
-                        stats["unique_values"] = set(range(1000))
-                    stats["base_unique_count"] = total_from_json - 1000
-                else:
-                    stats["base_unique_count"] = total_from_json - len(restored_set)
\ No newline at end of file
+            self.nested_paths = set()
+            self.total_records_processed = total
+            self.sampled_records = loaded_data.get("sampled_records", 0) if "field_stats" in loaded_data else 0
+            for key, saved in data_stats.items():
+                self._field(key).merge_dict(saved)
+
+def _sampling_variance(hits, sample, population):
+    """
+    Variance of population * hits / sample as an estimate of how many of
+    the population's records hold a field, for a sample drawn without
+    replacement.
+    """
+    if sample < 2 or sample >= population:
+        return 0.0
+    p = hits / sample
+    return population ** 2 * (1 - sample / population) * p * (1 - p) / (sample - 1)
@@ -0,0 +1,188 @@
+"""Pipeline queue bounded by estimated bytes, with a memory-mapped spill ring."""
+import mmap
+import os
+import pickle
+import queue
+import struct
+import sys
+import threading
+import time
+from collections import deque
+
+_LENGTH = struct.Struct('<I')
+_WRAP = 0xFFFFFFFF
+
+def estimate_size(obj):
+    """Rough deep size of a record: containers plus their keys and values."""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += sys.getsizeof(key) + estimate_size(value)
+    elif isinstance(obj, (list, tuple)):
+        for value in obj:
+            size += estimate_size(value)
+    return size
+
+class SpillRing:
+    """
+    Fixed-size ring buffer of length-prefixed pickles in a memory-mapped file.
+    Holds overflow only for the lifetime of the process; durability is the
+    WAL's job, not the spill's.
+    """
+    def __init__(self, path, capacity):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.capacity = capacity
+        self.file = open(path, 'w+b')
+        self.file.truncate(capacity)
+        self.buffer = mmap.mmap(self.file.fileno(), capacity)
+        self.head = 0
+        self.tail = 0
+        self.used = 0
+        self.count = 0
+
+    def can_fit(self, length):
+        need = _LENGTH.size + length
+        if need > self.capacity:
+            return False
+        wasted = self.capacity - self.tail if self.tail + need > self.capacity else 0
+        return self.used + wasted + need <= self.capacity
+
+    def write(self, data):
+        need = _LENGTH.size + len(data)
+        if self.tail + need > self.capacity:
+            if self.capacity - self.tail >= _LENGTH.size:
+                _LENGTH.pack_into(self.buffer, self.tail, _WRAP)
+            self.used += self.capacity - self.tail
+            self.tail = 0
+        _LENGTH.pack_into(self.buffer, self.tail, len(data))
+        self.buffer[self.tail + _LENGTH.size:self.tail + need] = data
+        self.tail = (self.tail + need) % self.capacity
+        self.used += need
+        self.count += 1
+
+    def read(self):
+        if self.capacity - self.head < _LENGTH.size or _LENGTH.unpack_from(self.buffer, self.head)[0] == _WRAP:
+            self.used -= self.capacity - self.head
+            self.head = 0
+        length = _LENGTH.unpack_from(self.buffer, self.head)[0]
+        start = self.head + _LENGTH.size
+        data = bytes(self.buffer[start:start + length])
+        self.head = (start + length) % self.capacity
+        self.used -= _LENGTH.size + length
+        self.count -= 1
+        if self.count == 0:
+            self.head = self.tail = self.used = 0
+        return data
+
+    def close(self):
+        self.buffer.close()
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class ByteBoundedQueue:
+    """
+    Drop-in for queue.Queue bounded by the estimated size of queued items.
+
+    Items stay in memory up to max_bytes. Past that they are pickled into the
+    spill ring; once anything is spilled, later items go to the ring too so
+    FIFO order holds. put() only blocks, on a condition, when both are full.
+    """
+    def __init__(self, max_bytes, spill_path=None, spill_bytes=0, sizeof=estimate_size):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.items = deque()
+        self.memory_bytes = 0
+        self.spill = SpillRing(spill_path, spill_bytes) if spill_path and spill_bytes else None
+        self.unfinished_tasks = 0
+        self.cond = threading.Condition()
+        self.all_tasks_done = threading.Condition(self.cond)
+
+    def put(self, item, block=True, timeout=None):
+        size = self.sizeof(item)
+        data = None
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self.cond:
+            while True:
+                spilled = self.spill is not None and self.spill.count
+                if not spilled and (not self.items or self.memory_bytes + size <= self.max_bytes):
+                    self.items.append((item, size))
+                    self.memory_bytes += size
+                    break
+
+                if self.spill is not None:
+                    if data is None:
+                        data = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+                    if self.spill.can_fit(len(data)):
+                        self.spill.write(data)
+                        break
+
+                if not block:
+                    raise queue.Full
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Full
+                self.cond.wait(remaining)
+
+            self.unfinished_tasks += 1
+            self.cond.notify_all()
+
+    def get(self, block=True, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self.cond:
+            while self._qsize() == 0:
+                if not block:
+                    raise queue.Empty
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                self.cond.wait(remaining)
+
+            if self.items:
+                item, size = self.items.popleft()
+                self.memory_bytes -= size
+            else:
+                item = pickle.loads(self.spill.read())
+
+            self.cond.notify_all()
+            return item
+
+    def task_done(self):
+        with self.all_tasks_done:
+            self.unfinished_tasks -= 1
+            if self.unfinished_tasks <= 0:
+                self.unfinished_tasks = 0
+                self.all_tasks_done.notify_all()
+
+    def join(self):
+        with self.all_tasks_done:
+            while self.unfinished_tasks:
+                self.all_tasks_done.wait()
+
+    def _qsize(self):
+        spilled = self.spill.count if self.spill is not None else 0
+        return len(self.items) + spilled
+
+    def qsize(self):
+        with self.cond:
+            return self._qsize()
+
+    def spilled(self):
+        with self.cond:
+            return self.spill.count if self.spill is not None else 0
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def full(self):
+        with self.cond:
+            if self.memory_bytes < self.max_bytes:
+                return False
+            return self.spill is None or not self.spill.can_fit(0)
+
+    def close(self):
+        if self.spill is not None:
+            self.spill.close()
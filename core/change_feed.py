@@ -0,0 +1,227 @@
+"""Publishes committed batches as an append-only NDJSON feed that consumers tail by offset."""
+import json
+import os
+import threading
+import time
+
+from core.router import SHARED_KEYS
+
+def _segments(directory):
+    """(first offset, path) of every feed segment, oldest first."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    names = sorted(n for n in names if n.startswith("feed-") and n.endswith(".ndjson"))
+    return [(int(n[5:-7]), os.path.join(directory, n)) for n in names]
+
+class ChangeFeed:
+    """
+    The router appends one line per committed batch to
+
+        <directory>/feed-<first offset>.ndjson
+
+    Each line is a JSON object: the batch's `offset`, the decision `epoch`
+    it was routed with, `committed_at`, the distinct `placements` in the
+    batch (the fields written to MySQL and to MongoDB) and its `records`,
+    each with its `id` (Deduplicator.record_id), WAL `lsn`, join keys and
+    the index of its placement.
+
+    Offsets count batches from 1 and are never reused. A batch is published
+    once both databases hold it and before its LSNs are acked, so a batch
+    replayed after a crash can appear again under a new offset; its records
+    keep their ids. Segments roll at segment_bytes, and the oldest are
+    removed once the feed holds more than retain_bytes.
+    """
+    def __init__(self, directory, record_id, segment_bytes=16 * 1024 * 1024, retain_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.record_id = record_id
+        self.segment_bytes = segment_bytes
+        self.retain_bytes = retain_bytes
+        self.published = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self.next_offset = self._recover_tail() + 1
+        segments = _segments(directory)
+        self.segment_path = segments[-1][1] if segments else self._segment_name(self.next_offset)
+        self.segment = open(self.segment_path, 'ab')
+
+    def _segment_name(self, first_offset):
+        return os.path.join(self.directory, f"feed-{first_offset:020d}.ndjson")
+
+    def _recover_tail(self):
+        """Drops a torn line at the end of the last segment and returns the last offset."""
+        segments = _segments(self.directory)
+        if not segments:
+            return 0
+
+        first, path = segments[-1]
+        with open(path, 'rb') as f:
+            data = f.read()
+        valid_end = data.rfind(b'\n') + 1
+        if valid_end < len(data):
+            print(f"[Change Feed] Truncating torn tail of {os.path.basename(path)}")
+            with open(path, 'r+b') as f:
+                f.truncate(valid_end)
+        if not valid_end:
+            return first - 1
+        last_line = data[:valid_end - 1].rsplit(b'\n', 1)[-1]
+        return json.loads(last_line)["offset"]
+
+    def publish(self, batch, placements, epoch, lsns):
+        """Appends a committed batch; placements are the (sql, mongo) field lists from Router.process_batch."""
+        distinct = {}
+        records = []
+        for record, lsn, placement in zip(batch, lsns, placements):
+            index = distinct.setdefault(placement, len(distinct))
+            entry = {"id": self.record_id(record), "lsn": lsn, "placement": index}
+            for key in SHARED_KEYS:
+                if key in record:
+                    entry[key] = record[key]
+            records.append(entry)
+
+        with self.lock:
+            line = {
+                "offset": self.next_offset,
+                "epoch": epoch,
+                "committed_at": time.time(),
+                "placements": [{"sql": list(sql), "mongo": list(mongo)} for sql, mongo in distinct],
+                "records": records
+            }
+            self.segment.write(json.dumps(line, separators=(',', ':'), default=str).encode() + b'\n')
+            # Readers in other processes see the line once it leaves our buffer
+            self.segment.flush()
+            self.next_offset += 1
+            self.published += len(records)
+
+            if self.segment.tell() >= self.segment_bytes:
+                self.segment.close()
+                self.segment_path = self._segment_name(self.next_offset)
+                self.segment = open(self.segment_path, 'ab')
+                self._drop_old_segments()
+        return line["offset"]
+
+    def _drop_old_segments(self):
+        segments = _segments(self.directory)
+        total = sum(os.path.getsize(path) for _, path in segments)
+        for _, path in segments:
+            if total <= self.retain_bytes or path == self.segment_path:
+                break
+            total -= os.path.getsize(path)
+            os.remove(path)
+
+    def report(self):
+        with self.lock:
+            segments = _segments(self.directory)
+            size = sum(os.path.getsize(path) for _, path in segments)
+            oldest = segments[0][0] if segments else self.next_offset
+            return (
+                f"offset {self.next_offset - 1} ({self.published} records published this run), "
+                f"offsets {oldest}+ retained in {len(segments)} segments ({size / 2**20:.1f} MB)"
+            )
+
+    def close(self):
+        with self.lock:
+            self.segment.flush()
+            os.fsync(self.segment.fileno())
+            self.segment.close()
+
+class FeedReader:
+    """
+    Tails a ChangeFeed directory, from this or another process. `offset` is
+    the last offset already consumed; with offset_path it is read from and
+    saved to that file, so a consumer resumes where it last committed.
+    Lines still being written are left for the next poll. If the feed no
+    longer holds the offset after ours, reading resumes at its oldest line.
+    """
+    def __init__(self, directory, offset=0, offset_path=None):
+        self.directory = directory
+        self.offset_path = offset_path
+        self.offset = self._read_offset() if offset_path else offset
+        self.path = None
+        self.position = 0
+
+    def _read_offset(self):
+        try:
+            with open(self.offset_path, 'r') as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _seek(self):
+        """Points at the segment that holds the line after self.offset."""
+        segments = _segments(self.directory)
+        self.path, self.position = None, 0
+        if not segments:
+            return
+        if segments[0][0] > self.offset + 1:
+            print(f"[Change Feed] Offsets {self.offset + 1}-{segments[0][0] - 1} were removed; resuming at {segments[0][0]}.")
+        for first, path in segments:
+            if first <= self.offset + 1 or self.path is None:
+                self.path = path
+
+    def _next_segment(self):
+        for _, path in _segments(self.directory):
+            if path > self.path:
+                return path
+        return None
+
+    def poll(self, max_records=1000):
+        """Returns the batches after the current offset, stopping once max_records are gathered."""
+        batches = []
+        records = 0
+        while records < max_records:
+            if self.path is None:
+                self._seek()
+                if self.path is None:
+                    break
+            # Looked up first: once a newer segment exists, this one is complete
+            newer = self._next_segment()
+            try:
+                with open(self.path, 'rb') as f:
+                    f.seek(self.position)
+                    data = f.read()
+            except FileNotFoundError:
+                self.path = None
+                continue
+
+            end = 0
+            while records < max_records:
+                newline = data.find(b'\n', end)
+                if newline < 0:
+                    break
+                line = json.loads(data[end:newline])
+                end = newline + 1
+                if line["offset"] <= self.offset:
+                    continue
+                batches.append(line)
+                records += len(line["records"])
+                self.offset = line["offset"]
+            self.position += end
+
+            if records >= max_records or end < len(data) or newer is None:
+                break
+            self.path, self.position = newer, 0
+        return batches
+
+    def follow(self, max_records=1000, interval=0.5, stop_event=None):
+        """Yields non-empty lists of batches as they are published."""
+        while stop_event is None or not stop_event.is_set():
+            batches = self.poll(max_records)
+            if batches:
+                yield batches
+            else:
+                time.sleep(interval)
+
+    def commit(self):
+        """Saves the current offset to offset_path, so a restart resumes after it."""
+        if not self.offset_path:
+            return
+        os.makedirs(os.path.dirname(self.offset_path) or '.', exist_ok=True)
+        tmp_path = self.offset_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(str(self.offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.offset_path)
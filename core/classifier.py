@@ -1,16 +1,71 @@
 """Field classification logic for routing data to SQL or MongoDB."""
+import re
+import time
+import zlib
+from collections import Counter
+
+# Numeric types that can share one column, narrowest first
+WIDENING_ORDER = ['bool', 'int', 'float']
+
+# Python value types each SQL column type accepts; anything else is routed to Mongo
+SQL_VALUE_TYPES = {
+    'INT': ['bool', 'int'],
+    'FLOAT': ['bool', 'int', 'float'],
+    'BOOLEAN': ['bool'],
+    'DATETIME': ['datetime'],
+    'TEXT': ['str', 'int', 'float', 'bool', 'datetime'],
+    'VARCHAR(255)': ['str', 'int', 'float', 'bool', 'datetime']
+}
+
+# Value types a key of the JSON overflow column accepts; they must cast cleanly into its generated column
+JSON_VALUE_TYPES = {
+    'INT': ['int'],
+    'FLOAT': ['int', 'float'],
+    'BOOLEAN': ['bool'],
+    'TEXT': ['str']
+}
+# MySQL JSON column holding fields placed in the overflow target
+OVERFLOW_COLUMN = 'overflow'
+# Generated columns exposing hot overflow keys are named prefix + field
+GENERATED_PREFIX = 'jv_'
+# MySQL identifiers are limited to 64 characters
+MAX_IDENTIFIER = 64
+UNSAFE_IDENTIFIER = re.compile(r'[^A-Za-z0-9_]')
+
+# Cost model, in bytes of I/O over the benefit horizon
+ALTER_TABLE_BYTES = 16 * 1024   # one ADD/DROP COLUMN
+MIGRATION_ROW_BYTES = 64        # read from SQL + upsert into Mongo, per row
+ACCESS_BYTES = 4096             # saved per query served from a SQL column
+VALUE_BYTES = {'bool': 1, 'int': 4, 'float': 8, 'datetime': 8}
 
 class Classifier:
-    def __init__(self, lower_threshold=0.75, upper_threshold=0.85, confidence_threshold=1000):
+    def __init__(self, lower_threshold=0.75, upper_threshold=0.85, confidence_threshold=1000, promote_threshold=0.25,
+                 min_dwell_seconds=60, horizon=100000, overflow_threshold=None):
         self.lower_threshold = lower_threshold
         self.upper_threshold = upper_threshold
+        # Stable scalars between this frequency and the SQL band go to the JSON overflow column; None disables it
+        self.overflow_threshold = overflow_threshold
+        # Scalar subpaths of nested fields get their own SQL column at this frequency
+        self.promote_threshold = promote_threshold
         self.confidence_threshold = confidence_threshold
+        # A field keeps its placement at least this long before it may move again
+        self.min_dwell_seconds = min_dwell_seconds
+        # Number of future records a move is expected to pay off over
+        self.horizon = horizon
         self.common_fields = {'username', 'timestamp', 'sys_ingested_at'}
         self.previous_decisions = {}
+        self.decision_reasons = {}
+        self.access_counts = Counter()
         self.ai_decision_cache = {}
 
+    def record_access(self, fields):
+        """Counts query predicates per field; queried fields favour SQL."""
+        for field in fields:
+            self.access_counts[field] += 1
+
     def decide_schema(self, stats):
         schema_decisions = {}
+        now = time.time()
 
         for field, metrics in stats.items():
             
@@ -19,49 +74,235 @@ class Classifier:
                     "target": "BOTH",
                     "sql_type": self._map_python_type_to_sql(metrics["detected_type"], is_unique=False)
                 }
+                self._explain(field, "BOTH", "join key, stored in both databases")
                 continue
 
-            if metrics["is_nested"]:
-                schema_decisions[field] = {"target": "MONGO"}
-                continue
-                
-            if metrics["detected_type"] == 'NoneType':
-                schema_decisions[field] = {"target": "MONGO"}
-                continue
+            metrics = self._widen(metrics)
 
-            if metrics["type_stability"] == "unstable":
-                schema_decisions[field] = {"target": "MONGO"}
-                continue
-
-            freq = metrics["frequency_ratio"]
-            previous_target = self.previous_decisions.get(field, {}).get("target", "MONGO")
-            target = "MONGO"
-            
-            if previous_target == "SQL" or previous_target == "BOTH":
-                if freq >= self.lower_threshold:
-                    target = "SQL"
-                else:
-                    target = "MONGO"
+            if '.' in field:
+                decision = self._decide_subpath(field, metrics)
+                self._explain(field, decision["target"], (
+                    f"nested path at {metrics['frequency_ratio']:.1%} frequency; "
+                    + ("copied to SQL column " + decision["column"] if decision["target"] == "SQL" else "kept in its parent document")
+                ))
             else:
-                if freq >= self.upper_threshold:
-                    target = "SQL"
-                else:
-                    target = "MONGO"
+                decision = self._decide_field(field, metrics, now)
 
-            is_unique = self._is_identifier_field(field, metrics)
-            
-            if target == "SQL":
-                schema_decisions[field] = {
-                    "target": "SQL",
-                    "sql_type": self._map_python_type_to_sql(metrics["detected_type"], is_unique=is_unique),
-                    "is_unique": is_unique
-                }
-            else:
-                schema_decisions[field] = {"target": "MONGO"}
+            schema_decisions[field] = self._stamp(field, decision, metrics, now)
         
         self.previous_decisions.update(schema_decisions)
         return schema_decisions
 
+    def _decide_field(self, field, metrics, now):
+        previous = self.previous_decisions.get(field, {})
+        previous_target = previous.get("target", "MONGO")
+
+        if metrics["is_nested"]:
+            return self._explain(field, {"target": "MONGO"}, "holds nested values")
+
+        if metrics["detected_type"] == 'NoneType':
+            return self._explain(field, {"target": "MONGO"}, "only null values seen so far")
+
+        if metrics["type_stability"] == "unstable":
+            reason = f"mixed types ({', '.join(metrics['types'])})"
+            if previous_target not in ("SQL", "JSON"):
+                return self._explain(field, {"target": "MONGO"}, reason)
+            return self._gate(field, metrics, previous, {"target": "MONGO"}, reason, now, conflict=True)
+
+        freq = metrics["frequency_ratio"]
+        target = "MONGO"
+        overflow = "JSON" if self._in_overflow_band(metrics, previous_target) else "MONGO"
+            
+        if previous_target == "SQL" or previous_target == "BOTH":
+            if freq >= self.lower_threshold:
+                target = "SQL"
+            else:
+                target = overflow
+        elif previous_target == "JSON":
+            # Stays a key above the SQL band too; its generated column serves queries without ALTERs
+            target = overflow
+        else:
+            if freq >= self.upper_threshold:
+                target = "SQL"
+            else:
+                target = overflow
+
+        if target == "SQL":
+            is_unique = self._is_identifier_field(field, metrics)
+            sql_type = self._map_python_type_to_sql(metrics["detected_type"], is_unique=is_unique)
+            decision = {
+                "target": "SQL",
+                "sql_type": sql_type,
+                "is_unique": is_unique,
+                "nullable": metrics.get("nullable", False),
+                "value_types": SQL_VALUE_TYPES.get(sql_type, [metrics["detected_type"]])
+            }
+        elif target == "JSON":
+            decision = self._overflow_decision(field, metrics, previous)
+        else:
+            decision = {"target": "MONGO"}
+
+        band = f"frequency {freq:.1%} (band {self.lower_threshold:.0%}-{self.upper_threshold:.0%})"
+        if target == "JSON":
+            band += f", overflow key{' with indexed column ' + decision['column'] if decision['indexed'] else ''}"
+        if not previous:
+            return self._explain(field, decision, f"{band}, first placement")
+        if target == previous_target:
+            return self._explain(field, decision, f"{band}, placement unchanged")
+        return self._gate(field, metrics, previous, decision, band, now)
+
+    def _in_overflow_band(self, metrics, previous_target):
+        """Stable JSON scalars frequent enough for the overflow column, with hysteresis once in MySQL."""
+        if self.overflow_threshold is None:
+            return False
+        if self._map_python_type_to_sql(metrics["detected_type"]) not in JSON_VALUE_TYPES:
+            return False
+        threshold = self.overflow_threshold
+        if previous_target in ("SQL", "JSON"):
+            threshold = self._overflow_exit()
+        return metrics["frequency_ratio"] >= threshold
+
+    def _overflow_exit(self):
+        return self.overflow_threshold * self.lower_threshold / self.upper_threshold
+
+    def _overflow_decision(self, field, metrics, previous):
+        """
+        A key of the JSON overflow column. Queried keys and keys in or
+        above the SQL band are hot: they get a virtual generated column
+        with an index, added and dropped in place as they heat and cool.
+        """
+        sql_type = self._map_python_type_to_sql(metrics["detected_type"])
+        hot_from = self.lower_threshold
+        if previous.get("target") == "JSON" and previous.get("indexed"):
+            hot_from *= self.lower_threshold / self.upper_threshold
+        return {
+            "target": "JSON",
+            "sql_type": sql_type,
+            "value_types": JSON_VALUE_TYPES[sql_type],
+            "column": column_name(GENERATED_PREFIX + field),
+            "indexed": self.access_counts.get(field, 0) > 0 or metrics["frequency_ratio"] >= hot_from
+        }
+
+    def _gate(self, field, metrics, previous, proposed, reason, now, conflict=False):
+        """
+        Lets a frequency- or type-driven move through only once the field
+        has dwelt in its current store long enough and the expected benefit
+        over the horizon exceeds the cost of moving it.
+        """
+        current = dict(previous) if previous else {"target": "MONGO"}
+        if current["target"] == "SQL" and "value_types" not in current:
+            current["value_types"] = SQL_VALUE_TYPES.get(current.get("sql_type"), ['str'])
+        held = f"held in {current['target']}"
+        if conflict:
+            held += ", off-type values go to MongoDB"
+
+        since = previous.get("since")
+        if since is not None and now - since < self.min_dwell_seconds:
+            return self._explain(field, current, (
+                f"{reason}; {held}: placed {now - since:.0f}s ago, minimum dwell is {self.min_dwell_seconds}s"
+            ))
+
+        cost, benefit = self._move_cost(field, metrics, previous, proposed["target"], conflict)
+        if benefit <= cost:
+            return self._explain(field, current, f"{reason}; {held}: benefit does not cover the move", cost, benefit)
+        return self._explain(field, proposed, f"{reason}; moved to {proposed['target']}", cost, benefit)
+
+    def _move_cost(self, field, metrics, previous, target, conflict):
+        """
+        Returns (cost, benefit) of moving the field to `target`, in bytes.
+        Moving out of SQL or the overflow column costs a read and an upsert
+        per row written since the field got there; out of a column into the
+        overflow column, a copy within the table. The benefit is how far the
+        field sits past its threshold, or all of its values for a type
+        conflict, times the bytes each value occupies over the horizon.
+        Query traffic on the field counts for MySQL.
+        """
+        freq = metrics["frequency_ratio"]
+        value_bytes = self._value_bytes(metrics) + len(field) + 2
+        records = metrics["count"] / freq if freq else metrics["count"]
+        access = self.horizon * self.access_counts.get(field, 0) / max(records, 1) * ACCESS_BYTES
+
+        source = previous.get("target", "MONGO")
+        if source == "MONGO":
+            threshold = self.upper_threshold if target == "SQL" else self.overflow_threshold
+            return ALTER_TABLE_BYTES, self.horizon * (freq - threshold) * value_bytes + access
+
+        rows = max(0, metrics["count"] - previous.get("count_at", 0))
+        row_bytes = 0 if target == "JSON" else MIGRATION_ROW_BYTES
+        cost = ALTER_TABLE_BYTES + rows * (self._value_bytes(metrics) + row_bytes)
+        threshold = self._overflow_exit() if source == "JSON" else self.lower_threshold
+        share = freq if conflict else threshold - freq
+        return cost, self.horizon * share * value_bytes - access
+
+    def _value_bytes(self, metrics):
+        if metrics["detected_type"] in VALUE_BYTES:
+            return VALUE_BYTES[metrics["detected_type"]]
+        # Average string length is not tracked; assume half the longest
+        return max(1, (metrics.get("max_length") or 32) // 2)
+
+    def _stamp(self, field, decision, metrics, now):
+        """Records when the field entered its store and how many values it had then."""
+        previous = self.previous_decisions.get(field, {})
+        if previous.get("target") == decision["target"]:
+            decision["since"] = previous.get("since")
+            decision["count_at"] = previous.get("count_at", 0)
+        else:
+            # A field's first placement is not a move and starts no dwell period
+            decision["since"] = now if previous else None
+            decision["count_at"] = metrics["count"]
+        return decision
+
+    def _explain(self, field, decision, reason, cost=None, benefit=None):
+        target = decision["target"] if isinstance(decision, dict) else decision
+        self.decision_reasons[field] = {"target": target, "reason": reason, "cost": cost, "benefit": benefit}
+        return decision
+
+    def _widen(self, metrics):
+        """
+        Mixed numeric types (e.g. int and float) widen to the broadest one so
+        the field stays a stable SQL column. Anything else is real
+        heterogeneity and stays unstable.
+        """
+        types = metrics.get("types", [])
+        if metrics["type_stability"] != "unstable" or not types:
+            return metrics
+        if not set(types) <= set(WIDENING_ORDER):
+            return metrics
+
+        widened = dict(metrics)
+        widened["detected_type"] = max(types, key=WIDENING_ORDER.index)
+        widened["type_stability"] = "stable"
+        widened["widened_from"] = sorted(types, key=WIDENING_ORDER.index)
+        return widened
+
+    def _decide_subpath(self, path, metrics):
+        """
+        A subpath like 'metadata.sensor_data.version' always stays inside its
+        parent's Mongo document. When it is a stable, frequent scalar it is
+        also copied into its own SQL column so it can be indexed and filtered.
+        """
+        if metrics["is_nested"] or metrics["type_stability"] == "unstable" or metrics["detected_type"] == 'NoneType':
+            return {"target": "MONGO"}
+
+        previous_target = self.previous_decisions.get(path, {}).get("target", "MONGO")
+        threshold = self.promote_threshold
+        if previous_target == "SQL":
+            # Same hysteresis band as top-level fields
+            threshold = self.promote_threshold * self.lower_threshold / self.upper_threshold
+
+        if metrics["frequency_ratio"] < threshold:
+            return {"target": "MONGO"}
+
+        sql_type = self._map_python_type_to_sql(metrics["detected_type"], is_unique=False)
+        return {
+            "target": "SQL",
+            "sql_type": sql_type,
+            "is_unique": False,
+            "value_types": SQL_VALUE_TYPES.get(sql_type, [metrics["detected_type"]]),
+            "column": column_name(path),
+            "promoted_from": path.split('.', 1)[0]
+        }
+
     def _is_identifier_field(self, field, metrics):
         """Identifies true unique identifier fields vs high-cardinality measurement fields.
         Uses AI-enhanced detection with fallback to local rule-based logic."""
@@ -183,6 +424,14 @@ Answer ONLY with: YES or NO"""
             
             return fallback_decision
 
+    def forget(self, fields):
+        """Drops everything kept for evicted fields."""
+        for field in fields:
+            self.previous_decisions.pop(field, None)
+            self.decision_reasons.pop(field, None)
+            self.access_counts.pop(field, None)
+            self.ai_decision_cache.pop(field, None)
+
     def export_decisions(self):
         """Export previous decisions for persistence across sessions."""
         import copy
@@ -192,4 +441,16 @@ Answer ONLY with: YES or NO"""
         """Restore previous decisions from persisted metadata."""
         import copy
         if decisions:
-            self.previous_decisions = copy.deepcopy(decisions)
\ No newline at end of file
+            self.previous_decisions = copy.deepcopy(decisions)
+
+def column_name(path):
+    """
+    MySQL column for a field path, nested levels joined by '__'. Names that
+    needed characters replaced, or are too long, end in a hash of the path,
+    so keys differing only in those characters keep separate columns.
+    """
+    name = path.replace('.', '__')
+    safe = UNSAFE_IDENTIFIER.sub('_', name)
+    if safe != name or safe.isdigit() or len(safe) > MAX_IDENTIFIER:
+        safe = f"{safe[:MAX_IDENTIFIER - 9]}_{zlib.crc32(path.encode()):08x}"
+    return safe
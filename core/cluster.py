@@ -0,0 +1,149 @@
+"""Lets several engine instances share one schema through a common store."""
+import os
+import socket
+import threading
+import time
+
+LEASE_NAME = "schema"
+
+class ClusterMember:
+    """
+    One engine instance's side of the cluster protocol, run once per
+    coordinator merge by sync():
+
+    * The instance appends its shards' analyzer deltas to a shared log and
+      folds in every delta after its position, its own included, so all
+      instances converge on the same cluster-wide stats.
+    * Whoever holds the schema lease runs the classifier and publishes the
+      result as a new decision version, with the stats and classifier state
+      it came from. Only the holder alters the table or migrates data. If it
+      stops renewing, another instance takes over when the lease expires and
+      continues from the published classifier state.
+    * Followers adopt the newest version. Each instance reports the version
+      its router has reached; a migration that drops a SQL column waits until
+      every live instance is past the version that still wrote to it.
+    """
+    def __init__(self, store, instance_id=None, lease_seconds=10.0, snapshot_interval=60.0, keep_versions=20):
+        self.store = store
+        self.instance_id = instance_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = lease_seconds
+        self.snapshot_interval = snapshot_interval
+        self.keep_versions = keep_versions
+        # Local deadline of our lease, measured from before the renewal was sent
+        self.lease_until = 0.0
+        # (version, decisions) replaced as a whole, so the router never sees a mix
+        self.current = (0, {})
+        self.delta_cursor = 0
+        # Highest version the local router has routed with, and the lowest across live instances
+        self.routed_version = 0
+        self.cluster_version = 0
+        self.unsent = []
+        self.last_publish = 0.0
+        self.lock = threading.Lock()
+
+    def bootstrap(self, analyzer, classifier):
+        """Starts from the newest published stats; the log is replayed from its watermark."""
+        latest = self.store.latest_version(with_stats=True)
+        if latest is None:
+            print(f"[Cluster] {self.instance_id} joining an empty cluster.")
+            return
+        analyzer.load_stats(latest["stats"])
+        classifier.load_decisions(latest["classifier"])
+        self.current = (latest["version"], latest["decisions"])
+        self.delta_cursor = latest["watermark"]
+        print(f"[Cluster] {self.instance_id} joined at decision version {self.version}.")
+
+    def sync(self, analyzer, classifier, deltas):
+        """Ships local deltas, folds in the log and returns the (version, decisions) to route with."""
+        with self.lock:
+            self.unsent.extend(d for d in deltas if d.get("total_records_processed") or d.get("field_stats"))
+            try:
+                while self.unsent:
+                    self.store.push_delta(self.instance_id, self.unsent[0])
+                    self.unsent.pop(0)
+                self._pull(analyzer)
+                self._lead(analyzer, classifier)
+                if not self.leader:
+                    self._follow(classifier)
+                self.store.heartbeat(self.instance_id, self.routed_version, self.delta_cursor)
+                lowest_version, _ = self.store.live_positions(self.lease_seconds * 3)
+                self.cluster_version = lowest_version or 0
+            except Exception as e:
+                # Unsent deltas are retried; without the store nobody may alter the schema
+                print(f"[Cluster] Coordination failed: {e}")
+                self.lease_until = 0.0
+            return self.current
+
+    @property
+    def version(self):
+        return self.current[0]
+
+    @property
+    def leader(self):
+        """True while this instance holds an unexpired schema lease."""
+        return time.monotonic() < self.lease_until
+
+    def _pull(self, analyzer):
+        while True:
+            batch = self.store.deltas_after(self.delta_cursor)
+            for delta_id, delta in batch:
+                analyzer.merge_stats(delta)
+                self.delta_cursor = delta_id
+            if not batch:
+                return
+
+    def _lead(self, analyzer, classifier):
+        was_leader = self.leader
+        requested = time.monotonic()
+        if self.store.acquire_lease(LEASE_NAME, self.instance_id, self.lease_seconds):
+            self.lease_until = requested + self.lease_seconds
+        else:
+            self.lease_until = 0.0
+        if self.leader and not was_leader:
+            print(f"[Cluster] {self.instance_id} holds the schema lease.")
+            # Pick up anything a previous leader published after our last look
+            self._follow(classifier)
+        elif was_leader and not self.leader:
+            print(f"[Cluster] {self.instance_id} lost the schema lease.")
+        if not self.leader:
+            return
+
+        decisions = classifier.decide_schema(analyzer.get_schema_stats())
+        if decisions == self.current[1] and time.time() - self.last_publish < self.snapshot_interval:
+            return
+        published = self.store.publish(
+            LEASE_NAME, self.instance_id, self.version + 1, self.delta_cursor,
+            decisions, classifier.export_decisions(), analyzer.export_stats()
+        )
+        if not published:
+            self.lease_until = 0.0
+            print(f"[Cluster] {self.instance_id} could not publish version {self.version + 1}; following.")
+            return
+        self.current = (self.version + 1, decisions)
+        self.last_publish = time.time()
+
+        # Deltas every live instance has folded in, and that the new snapshot covers, can go
+        _, lowest_cursor = self.store.live_positions(self.lease_seconds * 3)
+        self.store.prune(min(lowest_cursor or 0, self.delta_cursor), self.keep_versions)
+
+    def _follow(self, classifier):
+        latest = self.store.latest_version(self.version)
+        if latest is None:
+            return
+        # Keeps dwell times and hysteresis intact if this instance takes over
+        classifier.load_decisions(latest["classifier"])
+        self.current = (latest["version"], latest["decisions"])
+
+    def routed(self, version):
+        """Called by the router with the decision version it routes with."""
+        if version is not None and version > self.routed_version:
+            self.routed_version = version
+
+    def all_routed(self, version):
+        """True once every live instance routes with `version` or newer."""
+        return self.cluster_version >= version
+
+    def leave(self):
+        if self.leader:
+            self.store.release_lease(LEASE_NAME, self.instance_id)
+            self.lease_until = 0.0
@@ -0,0 +1,204 @@
+"""Offloads aged records from MySQL and MongoDB into day-partitioned Parquet files."""
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+ARROW_TYPES = {
+    'int': pa.int64(),
+    'float': pa.float64(),
+    'bool': pa.bool_(),
+    'datetime': pa.timestamp('us'),
+    'str': pa.string()
+}
+STORES = ['sql', 'mongo']
+
+class ColdTier:
+    """
+    Every `interval` seconds the router thread moves records whose
+    sys_ingested_at is older than max_age_days out of both databases, in
+    chunks of chunk_rows, into
+
+        <directory>/<sql|mongo>/day=YYYY-MM-DD/<first id>-<last id>.parquet
+
+    Files are written before the rows are deleted and are named by the id
+    range they hold, so an offload interrupted by a crash rewrites the same
+    file on the next pass. Column types come from the analyzer; a column
+    with mixed, nested or off-type values is stored as JSON text.
+    """
+    def __init__(self, directory, analyzer, max_age_days=30, interval=3600.0, chunk_rows=50000,
+                 max_chunks_per_pass=20):
+        self.directory = directory
+        self.analyzer = analyzer
+        self.max_age = timedelta(days=max_age_days)
+        self.interval = interval
+        self.chunk_rows = chunk_rows
+        self.max_chunks_per_pass = max_chunks_per_pass
+        self.last_run = 0.0
+        self.offloaded = {store: 0 for store in STORES}
+        self.lock = threading.Lock()
+
+    def maybe_offload(self, sql_handler, mongo_handler, decisions):
+        if time.time() - self.last_run < self.interval:
+            return
+        self.last_run = time.time()
+        self.offload(sql_handler, mongo_handler, decisions)
+
+    def offload(self, sql_handler, mongo_handler, decisions, cutoff=None):
+        cutoff = cutoff or datetime.now() - self.max_age
+        columns = self._column_fields(decisions)
+
+        for store, take, delete in (
+            ('sql', sql_handler.fetch_older_than, sql_handler.delete_rows),
+            ('mongo', mongo_handler.fetch_older_than, mongo_handler.delete_ids)
+        ):
+            for _ in range(self.max_chunks_per_pass):
+                records, ids = take(cutoff, self.chunk_rows)
+                if not records:
+                    break
+                self._write(store, records, ids, columns)
+                delete(ids)
+                with self.lock:
+                    self.offloaded[store] += len(records)
+                print(f"[Cold Tier] Moved {len(records)} {store} records older than {cutoff:%Y-%m-%d} to Parquet.")
+
+    def _column_fields(self, decisions):
+        """Maps promoted SQL columns back to the nested path the analyzer tracks."""
+        return {
+            decision['column']: field
+            for field, decision in decisions.items() if decision.get('column')
+        }
+
+    def _write(self, store, records, ids, column_fields):
+        stats = self.analyzer.get_schema_stats()
+        by_day = {}
+        for record in records:
+            ts = record.get('sys_ingested_at')
+            day = ts.date().isoformat() if isinstance(ts, datetime) else 'unknown'
+            by_day.setdefault(day, []).append(record)
+
+        name = f"{ids[0]}-{ids[-1]}.parquet"
+        for day, rows in by_day.items():
+            table = self._table(rows, stats, column_fields)
+            directory = os.path.join(self.directory, store, f"day={day}")
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, name)
+            pq.write_table(table, path + ".tmp", compression='zstd')
+            os.replace(path + ".tmp", path)
+
+    def _table(self, rows, stats, column_fields):
+        columns = {}
+        for row in rows:
+            for key in row:
+                columns.setdefault(key, None)
+
+        arrays, fields = [], []
+        for column in columns:
+            values = [row.get(column) for row in rows]
+            metrics = stats.get(column_fields.get(column, column))
+            arrow_type = column_type(metrics) if metrics else _infer(values)
+            if arrow_type == pa.bool_() and all(v in (None, 0, 1) for v in values):
+                # MySQL hands BOOLEAN columns back as 0/1
+                values = [None if v is None else bool(v) for v in values]
+            if arrow_type is None or not all(value_fits(v, arrow_type) for v in values):
+                arrow_type = pa.string()
+            if arrow_type == pa.string():
+                values = [as_text(v) for v in values]
+            arrays.append(pa.array(values, type=arrow_type))
+            fields.append(pa.field(column, arrow_type))
+        return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+    def _files(self, store):
+        root = os.path.join(self.directory, store)
+        if not os.path.isdir(root):
+            return []
+        days = sorted((d for d in os.listdir(root) if d.startswith("day=")), reverse=True)
+        return [
+            (day[4:], os.path.join(root, day, name))
+            for day in days
+            for name in sorted(os.listdir(os.path.join(root, day)), reverse=True)
+            if name.endswith(".parquet")
+        ]
+
+    def find(self, store, filters, limit=10, columns=None):
+        """
+        Equality lookup over one store's files, newest day first. Files
+        without a filtered column cannot match and are skipped from their
+        footer alone; filters are pushed down to row-group statistics and
+        only the requested columns are read.
+        """
+        results = []
+        for _, path in self._files(store):
+            schema = pq.read_schema(path)
+            if any(field not in schema.names for field in filters):
+                continue
+            # Mixed and nested columns are stored as JSON text
+            expression = [
+                (field, '=', as_text(value) if schema.field(field).type == pa.string() else value)
+                for field, value in filters.items()
+            ]
+            wanted = None if columns is None else [c for c in columns if c in schema.names]
+            try:
+                table = pq.read_table(path, columns=wanted, filters=expression or None)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+                # The value's type does not match the column's
+                continue
+            results.extend(table.slice(0, limit - len(results)).to_pylist())
+            if len(results) >= limit:
+                break
+        return results
+
+    def report(self):
+        lines = []
+        for store in STORES:
+            files = self._files(store)
+            rows = sum(pq.read_metadata(path).num_rows for _, path in files)
+            size = sum(os.path.getsize(path) for _, path in files)
+            days = sorted({day for day, _ in files})
+            span = f"{days[0]} .. {days[-1]}" if days else "-"
+            lines.append(
+                f"{store:<6} {len(files):>5} files  {rows:>10} rows  {size / 2**20:>8.1f} MB  days {span}"
+            )
+        lines.append(f"Records are moved once older than {self.max_age.days} days.")
+        return "\n".join(lines)
+
+def column_type(metrics):
+    """Arrow type for a field from its analyzer stats; None if it needs JSON text."""
+    if metrics["is_nested"]:
+        return None
+    types = set(metrics["types"])
+    if types and types <= {'bool', 'int', 'float'} and len(types) > 1:
+        # Numeric mixes widen, as the classifier does
+        return pa.float64() if 'float' in types else pa.int64()
+    if metrics["type_stability"] != "stable":
+        return None
+    return ARROW_TYPES.get(metrics["detected_type"])
+
+def _infer(values):
+    """Arrow type for a column the analyzer does not track (e.g. the SQL id)."""
+    kinds = {type(v).__name__ for v in values if v is not None}
+    return ARROW_TYPES.get(kinds.pop()) if len(kinds) == 1 else None
+
+def value_fits(value, arrow_type):
+    if value is None:
+        return True
+    if arrow_type == pa.bool_():
+        return isinstance(value, bool)
+    if arrow_type == pa.int64():
+        return isinstance(value, int)
+    if arrow_type == pa.float64():
+        return isinstance(value, (int, float))
+    if arrow_type == pa.timestamp('us'):
+        return isinstance(value, datetime)
+    return isinstance(value, str)
+
+def as_text(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return json.dumps(value, default=str)
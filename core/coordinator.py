@@ -0,0 +1,161 @@
+"""Merges per-worker Analyzer shards and publishes versioned schema decisions."""
+import multiprocessing
+import queue
+import threading
+import time
+
+from core.analyzer import Analyzer
+
+def _run_shard(inbox, outbox, options, ship_interval):
+    """Body of a shard process: analyzes batches and ships its drained stats every ship_interval seconds."""
+    shard = Analyzer(**options)
+    last_ship = time.time()
+    while True:
+        try:
+            item = inbox.get(timeout=ship_interval)
+        except queue.Empty:
+            item = ()
+        if item is None:
+            break
+        if item:
+            shard.analyze_batch(*item)
+        if shard.total_records_processed and time.time() - last_ship >= ship_interval:
+            outbox.put(shard.drain_stats())
+            last_ship = time.time()
+    outbox.put(shard.drain_stats())
+    outbox.put(None)
+
+class ShardProcess:
+    """
+    An Analyzer shard in a worker process, so analysis runs outside this
+    process's GIL. analyze_batch() queues the batch, pickled, and returns;
+    at most max_pending batches wait before it blocks. The process ships
+    its delta every ship_interval seconds, and a collector thread hands it
+    to the coordinator's merge_delta().
+    """
+    def __init__(self, coordinator, options, ship_interval, max_pending=8):
+        # Not fork: the parent already runs threads holding locks
+        context = multiprocessing.get_context('spawn')
+        self.inbox = context.Queue(max_pending)
+        self.outbox = context.Queue()
+        self.process = context.Process(
+            target=_run_shard, args=(self.inbox, self.outbox, options, ship_interval), daemon=True
+        )
+        self.process.start()
+        self.collector = threading.Thread(target=self._collect, args=(coordinator,), daemon=True)
+        self.collector.start()
+
+    def analyze_batch(self, batch, sample_size=None):
+        self.inbox.put((batch, sample_size))
+
+    def _collect(self, coordinator):
+        while True:
+            try:
+                delta = self.outbox.get(timeout=1)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    print(f"[Coordinator] Shard process exited with code {self.process.exitcode}")
+                    return
+                continue
+            if delta is None:
+                return
+            coordinator.merge_delta(delta)
+
+    def close(self):
+        """Ships the last delta and stops the process."""
+        if self.process.is_alive():
+            self.inbox.put(None)
+        self.collector.join()
+        self.process.join()
+
+class ShardCoordinator:
+    """
+    Each processor worker analyzes into a private shard. The coordinator
+    periodically drains every shard into the global analyzer, runs the
+    classifier once on the merged view and publishes the result under a new
+    epoch, so all workers route with the same decisions.
+
+    Shards are threads by default, so they share one GIL: the pure-Python
+    analysis of all workers runs on one core at a time. With processes=True
+    each shard is a ShardProcess instead, which analyzes on its own core and
+    ships deltas to merge_delta(); a merge then sees them up to
+    merge_interval late. close() collects the last ones.
+
+    With a cluster member, deltas go through the cluster's shared log
+    instead, and the epoch is the cluster's decision version.
+
+    With a field registry, rarely seen fields are evicted after a merge.
+    """
+    def __init__(self, analyzer, classifier, merge_interval=1.0, cluster=None, registry=None, processes=False):
+        self.analyzer = analyzer
+        self.classifier = classifier
+        self.merge_interval = merge_interval
+        self.cluster = cluster
+        self.registry = registry
+        self.processes = processes
+        self.shards = []
+        self.shard_processes = []
+        self.pending_deltas = []
+        self.epoch = 0
+        self.decisions = {}
+        self.snapshot = {}
+        self.last_merge = 0.0
+        self.lock = threading.Lock()
+
+    def create_shard(self):
+        options = {
+            "columnar": self.analyzer.columnar,
+            "max_nested_paths": self.analyzer.max_nested_paths,
+            "max_path_depth": self.analyzer.max_path_depth
+        }
+        if self.processes:
+            shard = ShardProcess(self, options, max(self.merge_interval, 0.1))
+            with self.lock:
+                self.shard_processes.append(shard)
+            return shard
+        shard = Analyzer(**options)
+        with self.lock:
+            self.shards.append(shard)
+        return shard
+
+    def merge_delta(self, delta):
+        with self.lock:
+            self.pending_deltas.append(delta)
+
+    def maybe_merge(self):
+        if self.epoch == 0 or time.time() - self.last_merge >= self.merge_interval:
+            return self.merge()
+        return self.current()
+
+    def merge(self):
+        with self.lock:
+            deltas = [shard.drain_stats() for shard in self.shards] + self.pending_deltas
+            self.pending_deltas = []
+
+            if self.cluster is not None:
+                self.epoch, self.decisions = self.cluster.sync(self.analyzer, self.classifier, deltas)
+            else:
+                for delta in deltas:
+                    self.analyzer.merge_stats(delta)
+                stats = self.analyzer.get_schema_stats()
+                self.decisions = self.classifier.decide_schema(stats)
+                self.epoch += 1
+            if self.registry is not None:
+                self.registry.maybe_compact(self.analyzer, self.classifier)
+            self.snapshot = {
+                "stats": self.analyzer.export_stats(),
+                "classifier_decisions": self.classifier.export_decisions()
+            }
+            if self.registry is not None:
+                self.snapshot["field_registry"] = self.registry.export_summary()
+            self.last_merge = time.time()
+            return self.epoch, self.decisions
+
+    def current(self):
+        with self.lock:
+            return self.epoch, self.decisions
+
+    def close(self):
+        """Stops shard processes; their last deltas are folded in by the next merge()."""
+        for shard in self.shard_processes:
+            shard.close()
@@ -0,0 +1,176 @@
+"""Duplicate suppression for re-sent records, backed by a scalable Bloom filter."""
+import hashlib
+import json
+import math
+import os
+import pickle
+import threading
+
+_CANONICAL = json.JSONEncoder(sort_keys=True, separators=(',', ':'), default=str)
+
+def _bloom_bytes(capacity, error_rate):
+    return (max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2)) + 7) // 8
+
+class BloomFilter:
+    __slots__ = ('capacity', 'error_rate', 'num_bits', 'num_hashes', 'count', 'bits')
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = _bloom_bytes(capacity, error_rate) * 8
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.count = 0
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def contains(self, h1, h2):
+        # Double hashing: k positions from two 64-bit hashes
+        bits, m = self.bits, self.num_bits
+        for i in range(self.num_hashes):
+            p = (h1 + i * h2) % m
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def add(self, h1, h2):
+        bits, m = self.bits, self.num_bits
+        for i in range(self.num_hashes):
+            p = (h1 + i * h2) % m
+            bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+    @property
+    def nbytes(self):
+        return len(self.bits)
+
+class ScalableBloomFilter:
+    """
+    A chain of Bloom filters. When the newest one reaches its capacity a
+    new one is added with `growth` times the capacity and `tightening`
+    times the error rate, so the overall false-positive rate stays below
+    error_rate however many keys arrive. Memory is capped at max_bytes by
+    dropping the oldest filter, which forgets the oldest keys first; once
+    a filter would take more than half the cap, filters stop growing.
+    """
+    def __init__(self, initial_capacity=1000000, error_rate=0.001, growth=2, tightening=0.5,
+                 max_bytes=64 * 1024 * 1024):
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.max_bytes = max_bytes
+        self.filters = []
+        self.forgotten = 0
+
+    def _grow(self):
+        if self.filters:
+            last = self.filters[-1]
+            capacity, error_rate = last.capacity * self.growth, last.error_rate * self.tightening
+            if _bloom_bytes(capacity, error_rate) > self.max_bytes // 2:
+                capacity, error_rate = last.capacity, last.error_rate
+        else:
+            # The series error_rate * (1 - tightening) * tightening^i sums to error_rate
+            capacity, error_rate = self.initial_capacity, self.error_rate * (1 - self.tightening)
+        new = BloomFilter(capacity, error_rate)
+
+        while self.filters and self.nbytes + new.nbytes > self.max_bytes:
+            dropped = self.filters.pop(0)
+            self.forgotten += dropped.count
+            print(f"[Dedup] Memory limit reached; forgetting the oldest {dropped.count} keys.")
+        self.filters.append(new)
+
+    def contains(self, h1, h2):
+        return any(f.contains(h1, h2) for f in reversed(self.filters))
+
+    def add(self, h1, h2):
+        if not self.filters or self.filters[-1].full:
+            self._grow()
+        self.filters[-1].add(h1, h2)
+
+    @property
+    def count(self):
+        return sum(f.count for f in self.filters)
+
+    @property
+    def nbytes(self):
+        return sum(f.nbytes for f in self.filters)
+
+class Deduplicator:
+    """
+    Recognizes records that were already ingested, e.g. re-sent after an
+    SSE reconnect or a replayed backfill. A record is keyed by `id_field`
+    when it has one, otherwise by a hash of its content without the sys_*
+    fields the pipeline adds. A false positive drops a new record, at a
+    rate of at most error_rate.
+
+    State is saved to `path` by save(), which the ingest thread calls right
+    after a WAL flush, so every key on disk belongs to a durable record.
+    """
+    def __init__(self, path, error_rate=0.001, initial_capacity=1000000, max_bytes=64 * 1024 * 1024, id_field=None):
+        self.path = path
+        self.id_field = id_field
+        self.duplicates = 0
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.filter = self._load() or ScalableBloomFilter(
+            initial_capacity=initial_capacity, error_rate=error_rate, max_bytes=max_bytes
+        )
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (pickle.UnpicklingError, EOFError) as e:
+            print(f"[Dedup] Ignoring unreadable filter state: {e}")
+            return None
+        print(f"[Dedup] Loaded filter with {state.count} keys.")
+        return state
+
+    def record_id(self, record):
+        """Stable hex ID for a record: its id_field, or a hash of its content."""
+        if self.id_field and record.get(self.id_field) is not None:
+            data = str(record[self.id_field]).encode()
+        else:
+            content = {k: v for k, v in record.items() if not k.startswith('sys_')}
+            data = _CANONICAL.encode(content).encode()
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    def _hashes(self, record):
+        digest = bytes.fromhex(self.record_id(record))
+        return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+    def seen(self, record):
+        """True if the record was ingested before; otherwise remembers it."""
+        h1, h2 = self._hashes(record)
+        with self.lock:
+            if self.filter.contains(h1, h2):
+                self.duplicates += 1
+                return True
+            self.filter.add(h1, h2)
+            self.dirty = True
+            return False
+
+    def add(self, record):
+        """Remembers a record without checking it, e.g. one replayed from the WAL."""
+        h1, h2 = self._hashes(record)
+        with self.lock:
+            self.filter.add(h1, h2)
+            self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with self.lock:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(self.filter, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            self.dirty = False
+        os.replace(tmp_path, self.path)
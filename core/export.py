@@ -0,0 +1,279 @@
+"""Streams full records, reassembled from MySQL and MongoDB, into NDJSON or Arrow files."""
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import islice
+
+import pyarrow as pa
+
+from core.cold_tier import as_text, column_type, value_fits
+
+# Keys the router writes to both databases
+SHARED_KEYS = {'username', 'timestamp', 'sys_ingested_at'}
+FORMATS = {'ndjson': '.ndjson', 'arrow': '.arrow'}
+# Arrow column for fields outside the schema and values that do not fit their column, as JSON
+EXTRA_COLUMN = '_extra'
+HALF_SECOND = timedelta(microseconds=500000)
+
+def join_second(ts):
+    """The second MySQL stores for ts: DATETIME rounds fractions half up."""
+    return (ts + HALF_SECOND).replace(microsecond=0)
+
+class Exporter:
+    """
+    Rebuilds full records by merge-joining structured_data with the
+    MongoDB side on (sys_ingested_at, username). Both databases are read
+    through server-side cursors in sys_ingested_at order and grouped by
+    second. Within a group a document joins the row with its exact
+    username and time; rows from tables created before MySQL kept
+    milliseconds hold whole seconds, and those join any document of the
+    user at most half a second away. Memory is bounded by one second of records (one bucket
+    window with the bucketed layout), however many are exported.
+
+    With partitions > 1 the time range is cut into that many ranges of
+    whole seconds, each written to its own file by its own thread.
+    """
+    def __init__(self, sql_handler, mongo_handler, decisions, stats=None, batch_size=1000):
+        self.sql_handler = sql_handler
+        self.mongo_handler = mongo_handler
+        self.stats = stats or {}
+        self.batch_size = batch_size
+        sql_decisions = {f: d for f, d in decisions.items() if d['target'] in ('SQL', 'BOTH')}
+        # Promoted columns copy a path the MongoDB document still holds
+        self.promoted = {d['column']: f for f, d in sql_decisions.items() if d.get('promoted_from')}
+        # Stored in both databases, so never a sign of a different record
+        self.duplicated = SHARED_KEYS | {f for f, d in sql_decisions.items() if d['target'] == 'BOTH'}
+        # MySQL hands BOOLEAN columns back as 0/1
+        self.booleans = {d.get('column', f) for f, d in sql_decisions.items() if d.get('sql_type') == 'BOOLEAN'}
+        self.exported = 0
+        self.result = None
+        self.error = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def records(self, start=None, end=None):
+        """Yields merged records whose join second is in [start, end)."""
+        # join_second(t) is in [start, end) exactly when t is in [start - 0.5s, end - 0.5s)
+        low = None if start is None else start - HALF_SECOND
+        high = None if end is None else end - HALF_SECOND
+        rows = _by_second(self.sql_handler.scan(low, high, self.batch_size))
+        docs = _by_second(self.mongo_handler.scan(low, high, self.batch_size))
+        for row_group, doc_group in _merge(rows, docs):
+            yield from self._join(row_group, doc_group)
+
+    def _join(self, rows, docs):
+        records, by_key, by_user = [], {}, {}
+        for row in rows:
+            entry = [*self._from_sql(row), False]
+            records.append(entry)
+            key = (entry[0].get('username'), entry[0].get('sys_ingested_at'))
+            by_key.setdefault(key, []).append(entry)
+            by_user.setdefault(key[0], []).append(entry)
+
+        orphans = []
+        for doc in docs:
+            fields = set(doc) - self.duplicated
+            ts = doc.get('sys_ingested_at')
+            candidates = [
+                e for e in by_key.get((doc.get('username'), ts), []) if not fields & e[0].keys()
+            ]
+            if not candidates:
+                # Rows from tables that rounded to the second match any time half a second away
+                candidates = [
+                    e for e in by_user.get(doc.get('username'), [])
+                    if _legacy_match(e[0].get('sys_ingested_at'), ts) and not fields & e[0].keys()
+                ]
+            # A record's own document first; a migrated partial joins any record without its field
+            target = next((e for e in candidates if not e[2]), None) or next(iter(candidates), None)
+            if target is None:
+                orphans.append(doc)
+                continue
+            # The row's join keys stay; the document's copy may be a coarser or later time
+            target[0].update((k, v) for k, v in doc.items() if k not in SHARED_KEYS or k not in target[0])
+            target[2] = True
+
+        for record, promoted, _ in records:
+            for path, value in promoted.items():
+                _set_path(record, path.split('.'), value)
+            yield record
+        yield from orphans
+
+    def _from_sql(self, row):
+        record, promoted = {}, {}
+        for column, value in row.items():
+            if column == 'id' or value is None:
+                continue
+            if column in self.booleans and value in (0, 1):
+                value = bool(value)
+            if column in self.promoted:
+                promoted[self.promoted[column]] = value
+            else:
+                record[column] = value
+        return record, promoted
+
+    def partitions(self, count, start=None, end=None):
+        """Cuts [start, end) into up to `count` ranges of whole seconds covering the stored data."""
+        if count <= 1:
+            return [(start, end)]
+        bounds = [
+            b for b in (self.sql_handler.ingested_range(), self.mongo_handler.ingested_range())
+            if b[0] is not None
+        ]
+        if not bounds:
+            return [(start, end)]
+
+        first = join_second(min(b[0] for b in bounds))
+        last = join_second(max(b[1] for b in bounds)) + timedelta(seconds=1)
+        if start is not None:
+            first = max(first, start)
+        if end is not None:
+            last = min(last, end)
+        span = int((last - first).total_seconds())
+        step = max(1, -(-span // count))
+        cuts = [first + timedelta(seconds=step * i) for i in range(1, count) if step * i < span]
+        # The outer ranges stay open so nothing outside [first, last) is lost
+        edges = [start] + cuts + [end]
+        return list(zip(edges[:-1], edges[1:]))
+
+    def export(self, directory, fmt='ndjson', partitions=1, start=None, end=None):
+        """Writes part-NNNNN files into directory; returns [(path, records written)]."""
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown export format '{fmt}'; use one of {', '.join(FORMATS)}")
+        os.makedirs(directory, exist_ok=True)
+        ranges = self.partitions(partitions, start, end)
+        paths = [os.path.join(directory, f"part-{i:05d}{FORMATS[fmt]}") for i in range(len(ranges))]
+        write = self._write_ndjson if fmt == 'ndjson' else self._write_arrow
+
+        with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+            counts = list(pool.map(lambda i: write(paths[i], self.records(*ranges[i])), range(len(ranges))))
+        return list(zip(paths, counts))
+
+    def start(self, directory, fmt='ndjson', partitions=1):
+        """Runs export() on a background thread; False if one is already running."""
+        if self.thread is not None and self.thread.is_alive():
+            return False
+        self.thread = threading.Thread(target=self._run, args=(directory, fmt, partitions), daemon=True)
+        self.thread.start()
+        return True
+
+    def _run(self, directory, fmt, partitions):
+        try:
+            self.result = self.export(directory, fmt, partitions)
+            print(f"[Export] Wrote {self.exported} records to {directory}.")
+        except Exception as e:
+            self.error = e
+            print(f"[Export] Failed: {e}")
+
+    def _chunks(self, records):
+        records = iter(records)
+        while True:
+            chunk = list(islice(records, self.batch_size))
+            if not chunk:
+                return
+            yield chunk
+            with self.lock:
+                self.exported += len(chunk)
+
+    def _write_ndjson(self, path, records):
+        count = 0
+        with open(path + ".tmp", 'w') as f:
+            for chunk in self._chunks(records):
+                f.writelines(json.dumps(record, default=_json_value) + "\n" for record in chunk)
+                count += len(chunk)
+        os.replace(path + ".tmp", path)
+        return count
+
+    def _write_arrow(self, path, records):
+        schema = self.schema()
+        count = 0
+        with pa.ipc.new_file(path + ".tmp", schema) as writer:
+            for chunk in self._chunks(records):
+                writer.write_batch(self._batch(chunk, schema))
+                count += len(chunk)
+        os.replace(path + ".tmp", path)
+        return count
+
+    def schema(self):
+        """One Arrow schema for the whole export: top-level fields typed from the analyzer's stats."""
+        fields = [pa.field('username', pa.string()), pa.field('sys_ingested_at', pa.timestamp('us'))]
+        for name in sorted(self.stats):
+            if '.' in name or name in ('username', 'sys_ingested_at', EXTRA_COLUMN):
+                continue
+            fields.append(pa.field(name, column_type(self.stats[name]) or pa.string()))
+        fields.append(pa.field(EXTRA_COLUMN, pa.string()))
+        return pa.schema(fields)
+
+    def _batch(self, records, schema):
+        names = set(schema.names)
+        extras = [{k: v for k, v in record.items() if k not in names} for record in records]
+        arrays = []
+        for field in schema:
+            if field.name == EXTRA_COLUMN:
+                values = [json.dumps(extra, default=_json_value) if extra else None for extra in extras]
+            else:
+                values = [record.get(field.name) for record in records]
+                if field.type == pa.string():
+                    values = [as_text(v) for v in values]
+                for i, value in enumerate(values):
+                    if not value_fits(value, field.type):
+                        extras[i][field.name] = value
+                        values[i] = None
+            arrays.append(pa.array(values, type=field.type))
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+    def report(self):
+        if self.thread is None:
+            return "No export has run."
+        if self.thread.is_alive():
+            return f"Export running: {self.exported} records written."
+        if self.error is not None:
+            return f"Export failed after {self.exported} records: {self.error}"
+        lines = [f"Export finished: {self.exported} records."]
+        lines.extend(f"  {path}  {count} records" for path, count in self.result)
+        return "\n".join(lines)
+
+def _by_second(records):
+    """Groups a sys_ingested_at-ordered stream into (join second, records) runs."""
+    key, group = None, []
+    for record in records:
+        second = join_second(record['sys_ingested_at'])
+        if second != key and group:
+            yield key, group
+            group = []
+        key = second
+        group.append(record)
+    if group:
+        yield key, group
+
+def _legacy_match(row_ts, doc_ts):
+    """A whole-second row time, as DATETIME stored it, that doc_ts rounds to."""
+    return (
+        isinstance(row_ts, datetime) and isinstance(doc_ts, datetime) and not row_ts.microsecond
+        and row_ts != doc_ts and abs((doc_ts - row_ts).total_seconds()) <= 0.5
+    )
+
+def _merge(left, right):
+    """Full outer merge of two (key, group) streams ordered by key."""
+    l, r = next(left, None), next(right, None)
+    while l is not None or r is not None:
+        if r is None or (l is not None and l[0] < r[0]):
+            yield l[1], []
+            l = next(left, None)
+        elif l is None or r[0] < l[0]:
+            yield [], r[1]
+            r = next(right, None)
+        else:
+            yield l[1], r[1]
+            l, r = next(left, None), next(right, None)
+
+def _set_path(record, segments, value):
+    for segment in segments[:-1]:
+        record = record.setdefault(segment, {})
+        if not isinstance(record, dict):
+            return
+    record.setdefault(segments[-1], value)
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
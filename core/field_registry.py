@@ -0,0 +1,123 @@
+"""Bounds how many fields the analyzer and classifier keep state for."""
+import re
+import threading
+import time
+from collections import Counter
+
+from core.sketch import CardinalitySketch
+
+# Digit runs are collapsed so dynamic keys ("sensor_812") summarize by shape ("sensor_#")
+DIGITS = re.compile(r'\d+')
+OTHER_SHAPES = '<other>'
+
+class FieldRegistry:
+    """
+    Keeps the analyzer's and classifier's per-field state to at most
+    `capacity` fields. Every `interval` seconds, each field's score decays
+    by `decay` and gains the occurrences it saw since the last pass. Once
+    over capacity, the lowest-scoring fields that only ever live in MongoDB
+    are forgotten until `headroom` of the capacity is free again. Fields
+    with a MySQL placement, the parents of promoted paths and queried fields
+    are never evicted.
+
+    An evicted field that shows up again starts over as a new field, which
+    places it in MongoDB, where it already was. Evicted keys are kept only
+    as a summary: how many and how often they occurred, a sketch of their
+    distinct names, and counts per key shape.
+    """
+    def __init__(self, capacity=10000, decay=0.5, interval=10.0, headroom=0.1, max_shapes=32):
+        self.capacity = capacity
+        self.decay = decay
+        self.interval = interval
+        self.headroom = headroom
+        self.max_shapes = max_shapes
+        self.scores = {}
+        self.last_counts = {}
+        self.last_run = 0.0
+        self.tracked = 0
+        self.evicted = 0
+        self.evicted_occurrences = 0
+        self.evicted_names = CardinalitySketch()
+        self.shapes = Counter()
+        self.lock = threading.Lock()
+
+    def maybe_compact(self, analyzer, classifier):
+        if time.time() - self.last_run < self.interval:
+            return []
+        return self.compact(analyzer, classifier)
+
+    def compact(self, analyzer, classifier):
+        """Rescores every field and evicts the coldest evictable ones; returns the evicted names."""
+        self.last_run = time.time()
+        counts = {key: stats.count for key, stats in list(analyzer.field_stats.items())}
+        scores = {}
+        for key, count in counts.items():
+            seen = count - self.last_counts.get(key, 0)
+            scores[key] = self.scores.get(key, 0.0) * self.decay + max(seen, 0)
+        self.scores = scores
+        self.last_counts = counts
+
+        victims = []
+        keep = int(self.capacity * (1 - self.headroom))
+        if len(counts) > self.capacity:
+            decisions = classifier.previous_decisions
+            anchored = {d.get('promoted_from') for d in decisions.values()}
+            evictable = [
+                key for key in counts
+                if decisions.get(key, {}).get('target', 'MONGO') == 'MONGO'
+                and key not in classifier.common_fields
+                and key not in anchored
+                and not classifier.access_counts.get(key)
+            ]
+            evictable.sort(key=scores.get)
+            victims = evictable[:len(counts) - keep]
+
+        self.tracked = len(counts) - len(victims)
+        if victims:
+            analyzer.forget(victims)
+            classifier.forget(victims)
+            with self.lock:
+                for key in victims:
+                    self.evicted += 1
+                    self.evicted_occurrences += counts[key]
+                    self.evicted_names.add(key)
+                    self._count_shape(key)
+                    del self.scores[key]
+                    del self.last_counts[key]
+            print(f"[Field Registry] Evicted {len(victims)} rarely seen MongoDB-only fields ({self.tracked} tracked).")
+        return victims
+
+    def _count_shape(self, key):
+        shape = DIGITS.sub('#', key)
+        if shape not in self.shapes and len(self.shapes) >= self.max_shapes:
+            shape = OTHER_SHAPES
+        self.shapes[shape] += 1
+
+    def export_summary(self):
+        with self.lock:
+            return {
+                "evicted": self.evicted,
+                "evicted_occurrences": self.evicted_occurrences,
+                "evicted_names": self.evicted_names.to_dict(),
+                "shapes": dict(self.shapes)
+            }
+
+    def load_summary(self, summary):
+        if not summary:
+            return
+        with self.lock:
+            self.evicted = summary.get("evicted", 0)
+            self.evicted_occurrences = summary.get("evicted_occurrences", 0)
+            self.evicted_names = CardinalitySketch.from_dict(summary["evicted_names"])
+            self.shapes = Counter(summary.get("shapes", {}))
+
+    def report(self):
+        with self.lock:
+            line = f"{self.tracked}/{self.capacity} fields tracked, {self.evicted} evicted"
+            if self.evicted:
+                common = ", ".join(f"{shape} x{count}" for shape, count in self.shapes.most_common(3))
+                line += (
+                    f" (~{self.evicted_names.count()} distinct keys, "
+                    f"{self.evicted_occurrences:.0f} occurrences; most common: {common})"
+                )
+            return line
@@ -0,0 +1,192 @@
+"""Proposes, creates and drops secondary indexes on structured_data from query predicates."""
+import threading
+import time
+import zlib
+from collections import Counter
+
+from core.classifier import VALUE_BYTES
+
+INDEX_PREFIX = "adv_"
+# MySQL can only index a prefix of a TEXT column
+TEXT_PREFIX = 64
+ROW_OVERHEAD_BYTES = 20
+PK_BYTES = 4
+
+class IndexAdvisor:
+    """
+    Counts the equality predicates the query layer runs against MySQL and
+    turns the most useful ones into indexes. A column with frequency f and
+    d distinct values matches about f / d of the table per lookup; composite
+    predicates multiply. Candidates are taken greedily by rows saved while
+    they fit both budgets: at most max_indexes advisor indexes, and index
+    bytes written per row at most max_write_amplification times the row.
+
+    Predicate counts decay on every pass, so indexes nobody queries any
+    more are dropped again.
+    """
+    def __init__(self, analyzer, max_indexes=5, max_write_amplification=1.0, max_selectivity=0.1,
+                 min_queries=3, interval=30.0, decay=0.8):
+        self.analyzer = analyzer
+        self.max_indexes = max_indexes
+        self.max_write_amplification = max_write_amplification
+        # Above this a table scan is as good as the index
+        self.max_selectivity = max_selectivity
+        self.min_queries = min_queries
+        self.interval = interval
+        self.decay = decay
+        self.predicates = Counter()
+        self.last_run = 0.0
+        self.last_plan = []
+        self.last_amplification = 0.0
+        self.lock = threading.Lock()
+
+    def record_query(self, columns):
+        """Called by the query layer with the SQL columns of one equality lookup."""
+        if columns:
+            with self.lock:
+                self.predicates[tuple(sorted(columns))] += 1
+
+    def maybe_apply(self, sql_handler, decisions):
+        if time.time() - self.last_run < self.interval:
+            return
+        self.apply(sql_handler, decisions)
+
+    def apply(self, sql_handler, decisions):
+        """Brings the advisor's indexes in line with the current plan. Runs on the writer's thread."""
+        self.last_run = time.time()
+        indexes = sql_handler.indexes()
+        existing = {name: columns for name, columns in indexes.items() if name.startswith(INDEX_PREFIX)}
+        others = [tuple(columns) for name, columns in indexes.items() if not name.startswith(INDEX_PREFIX)]
+        plan = self.plan(decisions, sql_handler.existing_cols, others)
+        wanted = {c["name"]: c for c in plan if c["chosen"]}
+
+        for name in existing:
+            if name not in wanted:
+                print(f"[Index Advisor] Dropping unused index {name}")
+                sql_handler.drop_index(name)
+        for name, candidate in wanted.items():
+            if name not in existing:
+                print(
+                    f"[Index Advisor] Creating {name} on ({', '.join(candidate['columns'])}), "
+                    f"est. selectivity {candidate['selectivity']:.3%}"
+                )
+                sql_handler.create_index(name, candidate["columns"])
+
+        with self.lock:
+            for key in list(self.predicates):
+                self.predicates[key] *= self.decay
+                if self.predicates[key] < 0.5:
+                    del self.predicates[key]
+
+    def plan(self, decisions, existing_cols, other_indexes=()):
+        """
+        Returns every candidate index, best first, marking the ones that fit
+        the budgets. other_indexes are column tuples already indexed outside
+        the advisor (base table and UNIQUE columns).
+        """
+        stats = self.analyzer.get_schema_stats()
+        # Generated columns over JSON overflow keys can be filtered on like any other column
+        fields = {
+            decision.get('column', field): field
+            for field, decision in decisions.items()
+            if decision['target'] in ('SQL', 'BOTH') or decision.get('indexed')
+        }
+        with self.lock:
+            predicates = dict(self.predicates)
+
+        def column_bytes(column):
+            s = stats.get(fields.get(column), {})
+            if s.get("detected_type") in VALUE_BYTES:
+                return VALUE_BYTES[s["detected_type"]]
+            return min(TEXT_PREFIX, s.get("max_length") or TEXT_PREFIX)
+
+        def column_selectivity(column):
+            s = stats.get(fields.get(column))
+            if not s or not s["count"]:
+                return 1.0
+            distinct = max(1.0, s["unique_ratio"] * s["count"])
+            return s["frequency_ratio"] / distinct
+
+        row_bytes = ROW_OVERHEAD_BYTES + sum(
+            column_bytes(column) * stats[field]["frequency_ratio"]
+            for column, field in fields.items() if field in stats
+        )
+
+        candidates = []
+        for columns, queries in predicates.items():
+            if not all(c in existing_cols for c in columns):
+                continue
+            # Most selective column first, so the index also serves lookups on it alone
+            ordered = tuple(sorted(columns, key=column_selectivity))
+            selectivity = 1.0
+            for column in ordered:
+                selectivity *= column_selectivity(column)
+            candidates.append({
+                "name": _index_name(ordered),
+                "columns": ordered,
+                "queries": queries,
+                "selectivity": selectivity,
+                "benefit": queries * (1 - selectivity),
+                "write_bytes": PK_BYTES + sum(column_bytes(c) for c in ordered),
+                "chosen": False,
+                "note": ""
+            })
+        candidates.sort(key=lambda c: c["benefit"], reverse=True)
+
+        chosen = []
+        write_bytes = 0
+        for candidate in candidates:
+            covering = next(
+                (c for c in list(other_indexes) + [c["columns"] for c in chosen]
+                 if c[:len(candidate["columns"])] == candidate["columns"]),
+                None
+            )
+            if covering:
+                candidate["note"] = f"served by index on ({', '.join(covering)})"
+            elif candidate["queries"] < self.min_queries:
+                candidate["note"] = f"fewer than {self.min_queries} recent queries"
+            elif candidate["selectivity"] > self.max_selectivity:
+                candidate["note"] = "not selective enough"
+            elif len(chosen) >= self.max_indexes:
+                candidate["note"] = "over index budget"
+            elif (write_bytes + candidate["write_bytes"]) / row_bytes > self.max_write_amplification:
+                candidate["note"] = "over write-amplification budget"
+            else:
+                candidate["chosen"] = True
+                chosen.append(candidate)
+                write_bytes += candidate["write_bytes"]
+
+        self.last_plan = candidates
+        self.last_amplification = write_bytes / row_bytes
+        return candidates
+
+    def export_predicates(self):
+        with self.lock:
+            return [[list(columns), count] for columns, count in self.predicates.items()]
+
+    def load_predicates(self, predicates):
+        with self.lock:
+            for columns, count in predicates or []:
+                self.predicates[tuple(columns)] = count
+
+    def report(self):
+        if not self.last_plan:
+            return "No index candidates. Run 'find' queries on SQL fields to collect predicates."
+
+        chosen = sum(1 for c in self.last_plan if c["chosen"])
+        lines = [
+            f"Advisor indexes: {chosen}/{self.max_indexes}, "
+            f"write amplification {self.last_amplification:.2f}/{self.max_write_amplification:.2f} of row bytes",
+            f"{'columns':<40}{'queries':>9}{'selectivity':>13}  status"
+        ]
+        for c in self.last_plan:
+            status = "indexed" if c["chosen"] else c["note"]
+            lines.append(f"{', '.join(c['columns']):<40}{c['queries']:>9.1f}{c['selectivity']:>13.4%}  {status}")
+        return "\n".join(lines)
+
+def _index_name(columns):
+    name = INDEX_PREFIX + "__".join(columns)
+    if len(name) > 64:
+        # MySQL identifiers are limited to 64 characters
+        name = f"{name[:55]}_{zlib.crc32(name.encode()):08x}"
+    return name
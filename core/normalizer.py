@@ -1,5 +1,6 @@
 """Normalizes raw JSON data from the API."""
 import re
+import sys
 from datetime import datetime
 
 class Normalizer:
@@ -15,7 +16,9 @@ class Normalizer:
         normalized_record = {}
 
         if 'sys_ingested_at' not in record:
-            normalized_record['sys_ingested_at'] = datetime.now()
+            # Milliseconds, which both MySQL's DATETIME(3) and BSON dates keep exactly
+            now = datetime.now()
+            normalized_record['sys_ingested_at'] = now.replace(microsecond=now.microsecond // 1000 * 1000)
         else:
             normalized_record['sys_ingested_at'] = record['sys_ingested_at']
 
@@ -23,7 +26,7 @@ class Normalizer:
             if key == 'sys_ingested_at':
                 continue
             
-            standard_key = self._to_snake_case(key)
+            standard_key = sys.intern(self._to_snake_case(key))
             
             if isinstance(value, str):
                 cleaned_value = value.strip()
@@ -1,9 +1,27 @@
+import json
+import shlex
 import time
 
+from core.export import FORMATS, Exporter
+
 class QueryEngine:
-    def __init__(self, analyzer, ingestion_queue):
+    def __init__(self, analyzer, ingestion_queue, tracer=None, profiler=None, router=None, classifier=None,
+                 index_advisor=None, dedup=None, cold_tier=None, sampling=None, registry=None, feed=None,
+                 rollups=None):
         self.analyzer = analyzer
         self.queue = ingestion_queue
+        self.tracer = tracer
+        self.profiler = profiler
+        self.router = router
+        self.classifier = classifier
+        self.index_advisor = index_advisor
+        self.dedup = dedup
+        self.cold_tier = cold_tier
+        self.sampling = sampling
+        self.registry = registry
+        self.feed = feed
+        self.rollups = rollups
+        self.export_job = None
         self.start_time = time.time()
 
     def process_command(self, command_str):
@@ -19,7 +37,8 @@ class QueryEngine:
                 "  AVAILABLE COMMANDS\n"
                 + "="*60 + "\n\n"
                 "  status\n"
-                "    Shows system uptime, total records processed, and active field count.\n\n"
+                "    Shows system uptime, total records processed, active field count, and whether\n"
+                "    field stats are being estimated from samples because processing fell behind.\n\n"
                 "  stats <field>\n"
                 "    Displays detailed analytics for a specific field including:\n"
                 "    - Frequency ratio (how often it appears)\n"
@@ -31,6 +50,33 @@ class QueryEngine:
                 "    Shows number of records currently waiting in ingestion buffer.\n\n"
                 "  all_stats\n"
                 "    Displays summary statistics for all tracked fields.\n\n"
+                "  find <field>=<value> [...] [limit=N] [fields=a,b]\n"
+                "    Returns matching records from the database that holds the fields,\n"
+                "    then from its cold-tier Parquet files. fields= limits the columns read.\n"
+                "    Queried fields count towards keeping them in SQL, and index JSON overflow keys.\n"
+                "    Example: find device_model=Pixel limit=5\n\n"
+                "  cold\n"
+                "    Shows Parquet files, rows and size in the cold tier.\n\n"
+                "  export <directory> [format=ndjson|arrow] [partitions=N]\n"
+                "    Writes every record, rejoined from MySQL and MongoDB, to part files in the\n"
+                "    background; N partitions are written in parallel. 'export' alone shows progress.\n\n"
+                "  feed\n"
+                "    Shows the change feed's latest offset and the segments still on disk.\n"
+                "    Consumers tail it with 'python tail_feed.py --offset-file <path>'.\n\n"
+                "  rollup [<name> <username> [field=value ...] [limit=N]]\n"
+                "    Reads a user's rows of a rollup kept up to date as records are written,\n"
+                "    newest bucket first, without scanning the raw tables. 'rollup' alone lists them.\n"
+                "    Example: rollup user_heart_rate_hourly alice limit=3\n\n"
+                "  why <field>\n"
+                "    Explains the field's current placement, with migration cost and benefit.\n\n"
+                "  indexes\n"
+                "    Shows index candidates from 'find' predicates, their estimated selectivity,\n"
+                "    and which ones the advisor has created within its budgets.\n\n"
+                "  trace\n"
+                "    Shows time spent per pipeline stage and sampled ingest-to-durable latency.\n\n"
+                "  profile start [seconds] | profile stop\n"
+                "    Samples all threads and writes a folded-stack file for flamegraph tools.\n"
+                "    With [seconds], sampling stops on its own.\n\n"
                 "  exit\n"
                 "    Gracefully shuts down all worker threads and closes connections.\n"
                 + "="*60 + "\n"
@@ -41,12 +87,38 @@ class QueryEngine:
             msg = (
                 f"System Uptime: {uptime} seconds\n"
                 f"Total Records Processed: {self.analyzer.total_records_processed}\n"
-                f"Active Fields Tracked: {len(self.analyzer.field_stats)}"
+                f"Active Fields Tracked: {len(self.analyzer.field_stats)}\n"
+                f"Nested Paths Tracked: {len(self.analyzer.nested_paths)} "
+                f"(limit {self.analyzer.max_nested_paths}, {self.analyzer.dropped_path_values} values skipped)"
             )
+            if self.registry is not None:
+                msg += f"\nField Registry: {self.registry.report()}"
+            if self.sampling is not None:
+                mode = f"sampled ({self.sampling.fraction:.0%} of each batch)" if self.sampling.sampling else "exact"
+                msg += f"\nAnalysis: {mode}; {self.analyzer.sampled_records} records counted from samples"
+            if self.dedup is not None:
+                bloom = self.dedup.filter
+                msg += (
+                    f"\nDuplicates Suppressed: {self.dedup.duplicates} "
+                    f"({bloom.count} keys in {bloom.nbytes / 2**20:.1f} MB, false-positive rate <= {bloom.error_rate:.2%})"
+                )
+            cluster = self.router.cluster if self.router is not None else None
+            if cluster is not None:
+                msg += (
+                    f"\nCluster Instance: {cluster.instance_id} "
+                    f"({'schema leader' if cluster.leader else 'follower'}, decision version {cluster.version}, "
+                    f"all instances at >= {cluster.cluster_version})"
+                )
             return msg
 
         elif cmd == "queue":
-            return f"Current Queue Size: {self.queue.qsize()} records pending processing."
+            msg = f"Current Queue Size: {self.queue.qsize()} records pending processing."
+            if hasattr(self.queue, 'memory_bytes'):
+                msg += (
+                    f"\n  In Memory: {self.queue.memory_bytes / 2**20:.1f} MB of {self.queue.max_bytes / 2**20:.0f} MB"
+                    f"\n  Spilled to Disk: {self.queue.spilled()} records"
+                )
+            return msg
 
         elif cmd == "stats":
             if len(args) < 2:
@@ -55,16 +127,21 @@ class QueryEngine:
             stats = self.analyzer.get_schema_stats()
             if field in stats:
                 s = stats[field]
+                margin = f" ± {s['frequency_error']:.2%} (sampled)" if s['frequency_error'] else ""
                 return (
                     f"\n{'='*60}\n"
                     f"  FIELD ANALYSIS: '{field}'\n"
                     f"{'='*60}\n"
-                    f"  Frequency Ratio:  {s['frequency_ratio']:.2%} (appears in {s['frequency_ratio']*100:.1f}% of records)\n"
+                    f"  Frequency Ratio:  {s['frequency_ratio']:.2%}{margin} (appears in {s['frequency_ratio']*100:.1f}% of records)\n"
                     f"  Type Stability:   {s['type_stability']}\n"
                     f"  Detected Type:    {s['detected_type']}\n"
+                    f"  Value Types:      {', '.join(s['types']) or '-'}{' (nullable)' if s['nullable'] else ''}\n"
                     f"  Is Nested:        {s['is_nested']}\n"
                     f"  Unique Ratio:     {s['unique_ratio']:.2%}\n"
                     f"  Total Count:      {s['count']} occurrences\n"
+                    f"  Null Count:       {s['null_count']}\n"
+                    f"  Min / Max:        {s['min']} / {s['max']}\n"
+                    f"  Max Length:       {s['max_length']}\n"
                     f"{'='*60}\n"
                 )
             else:
@@ -87,5 +164,227 @@ class QueryEngine:
             result += f"{'='*80}\n"
             return result
 
+        elif cmd == "find":
+            try:
+                # Quoted values may contain spaces
+                terms = shlex.split(command_str)[1:]
+            except ValueError as e:
+                return f"Could not parse query: {e}"
+            return self._find(terms)
+
+        elif cmd == "why":
+            if len(args) < 2:
+                return "Usage: why <field_name>"
+            return self._why(args[1])
+
+        elif cmd == "indexes":
+            if self.index_advisor is None:
+                return "Index advice is not enabled."
+            return self.index_advisor.report()
+
+        elif cmd == "cold":
+            if self.cold_tier is None:
+                return "The cold tier is not enabled."
+            return self.cold_tier.report()
+
+        elif cmd == "feed":
+            if self.feed is None:
+                return "The change feed is not enabled."
+            return f"Change Feed: {self.feed.report()}\nDirectory: {self.feed.directory}"
+
+        elif cmd == "rollup":
+            if self.rollups is None:
+                return "Rollups are not enabled."
+            try:
+                terms = shlex.split(command_str)[1:]
+            except ValueError as e:
+                return f"Could not parse query: {e}"
+            return self._rollup(terms)
+
+        elif cmd == "export":
+            return self._export(args[1:])
+
+        elif cmd == "trace":
+            if self.tracer is None:
+                return "Tracing is not enabled."
+            return self.tracer.report()
+
+        elif cmd == "profile":
+            if self.profiler is None:
+                return "Profiling is not available."
+            action = args[1].lower() if len(args) > 1 else ""
+            if action == "start":
+                try:
+                    duration = float(args[2]) if len(args) > 2 else None
+                except ValueError:
+                    return "Usage: profile start [seconds] | profile stop"
+                if not self.profiler.start(duration):
+                    return "Profiler is already running."
+                window = f" for {duration:g} seconds" if duration else " until 'profile stop'"
+                return f"Profiler started{window}."
+            if action == "stop":
+                path = self.profiler.stop()
+                if path is None:
+                    if self.profiler.last_output:
+                        return f"Profiler is not running. Last profile: {self.profiler.last_output}"
+                    return "Profiler is not running."
+                return f"Profile written to {path} (folded stacks; render with flamegraph.pl or speedscope)."
+            return "Usage: profile start [seconds] | profile stop"
+
         else:
             return f"Unknown command: '{cmd}'. Type 'help' for options."
+
+    def _find(self, terms):
+        if self.router is None:
+            return "Queries are not available."
+
+        limit = 10
+        columns = None
+        filters = {}
+        for term in terms:
+            field, sep, raw = term.partition('=')
+            if not sep or not field:
+                return "Usage: find <field>=<value> [<field>=<value> ...] [limit=N] [fields=a,b]"
+            if field == "limit":
+                try:
+                    limit = int(raw)
+                except ValueError:
+                    return f"limit must be a number, got '{raw}'"
+                continue
+            if field == "fields":
+                columns = [c for c in raw.split(',') if c]
+                continue
+            try:
+                filters[field] = json.loads(raw)
+            except ValueError:
+                filters[field] = raw
+        if not filters:
+            return "Usage: find <field>=<value> [<field>=<value> ...] [limit=N] [fields=a,b]"
+
+        if self.classifier is not None:
+            self.classifier.record_access(filters)
+
+        sql_filters, json_filters, mongo_filters = {}, {}, {}
+        # Cold-tier files hold overflow keys as plain fields
+        cold_sql_filters = {}
+        existing = getattr(self.router.sql_handler, "existing_cols", ())
+        for field, value in filters.items():
+            decision = self.router.previous_decisions.get(field, {"target": "MONGO"})
+            accepted = decision.get("value_types")
+            if accepted is not None and type(value).__name__ not in accepted:
+                # The router sends off-type values of a SQL column to MongoDB
+                mongo_filters[field] = value
+            elif decision["target"] in ("SQL", "BOTH"):
+                sql_filters[decision.get("column", field)] = value
+                cold_sql_filters[decision.get("column", field)] = value
+            elif decision["target"] == "JSON":
+                if decision.get("indexed") and decision["column"] in existing:
+                    sql_filters[decision["column"]] = value
+                else:
+                    json_filters[field] = value
+                cold_sql_filters[field] = value
+            else:
+                mongo_filters[field] = value
+
+        in_sql = {**sql_filters, **json_filters}
+        if in_sql and mongo_filters:
+            return (
+                f"Fields {', '.join(in_sql)} are in MySQL and {', '.join(mongo_filters)} in MongoDB; "
+                "query one database at a time."
+            )
+
+        if sql_filters and self.index_advisor is not None:
+            self.index_advisor.record_query(sql_filters)
+
+        store = "MySQL" if in_sql else "MongoDB"
+        try:
+            if in_sql:
+                rows = self.router.sql_handler.find(sql_filters, limit, json_filters)
+            else:
+                rows = self.router.mongo_handler.find(mongo_filters, limit)
+            if columns is not None:
+                rows = [{c: row.get(c) for c in columns} for row in rows]
+
+            cold_rows = []
+            if self.cold_tier is not None and len(rows) < limit:
+                cold_rows = self.cold_tier.find(
+                    "sql" if in_sql else "mongo", cold_sql_filters or mongo_filters, limit - len(rows), columns
+                )
+        except Exception as e:
+            return f"Query failed: {e}"
+
+        lines = [f"{len(rows)} record(s) from {store}" + (f", {len(cold_rows)} from the cold tier:" if cold_rows else ":")]
+        rows = rows + cold_rows
+        lines.extend(f"  {json.dumps(row, default=str)}" for row in rows)
+        return "\n".join(lines)
+
+    def _rollup(self, terms):
+        if not terms:
+            return self.rollups.report()
+        if len(terms) < 2 or '=' in terms[0] or '=' in terms[1]:
+            return "Usage: rollup <name> <username> [field=value ...] [limit=N]"
+        name, username = terms[0], terms[1]
+        filters = {}
+        limit = 24
+        for term in terms[2:]:
+            key, sep, value = term.partition('=')
+            if not sep:
+                return f"Expected field=value, got '{term}'"
+            if key == 'limit':
+                try:
+                    limit = int(value)
+                except ValueError:
+                    return f"limit must be a number, got '{value}'"
+            else:
+                filters[key] = value
+        try:
+            rows = self.rollups.lookup(name, username, filters, limit)
+        except KeyError:
+            return f"No rollup named '{name}'. Type 'rollup' to list them."
+        except ValueError as e:
+            return str(e)
+        except Exception as e:
+            return f"Rollup lookup failed: {e}"
+        if not rows:
+            return f"No '{name}' rows for {username}."
+        lines = [f"{len(rows)} row(s) from rollup {name}:"]
+        lines.extend(f"  {json.dumps(row, default=str)}" for row in rows)
+        return "\n".join(lines)
+
+    def _export(self, terms):
+        if not terms:
+            return self.export_job.report() if self.export_job is not None else "No export has run."
+        if self.router is None:
+            return "Export is not available."
+        if self.export_job is not None and self.export_job.thread.is_alive():
+            return "An export is already running; 'export' shows its progress."
+
+        directory, options = terms[0], dict(term.partition('=')[::2] for term in terms[1:])
+        fmt = options.get("format", "ndjson")
+        if fmt not in FORMATS or not options.get("partitions", "1").isdigit():
+            return "Usage: export <directory> [format=ndjson|arrow] [partitions=N]"
+
+        self.export_job = Exporter(
+            self.router.sql_handler, self.router.mongo_handler, dict(self.router.previous_decisions),
+            self.analyzer.get_schema_stats()
+        )
+        self.export_job.start(directory, fmt, int(options.get("partitions", "1")))
+        return f"Exporting to {directory} as {fmt}; 'export' shows progress."
+
+    def _why(self, field):
+        if self.classifier is None:
+            return "Placement reasons are not available."
+        explanation = self.classifier.decision_reasons.get(field)
+        if explanation is None:
+            return f"No placement decision for '{field}' yet."
+
+        decision = self.classifier.previous_decisions.get(field, {})
+        lines = [f"'{field}' -> {explanation['target']}"]
+        if decision.get("since"):
+            lines[0] += f" (since {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(decision['since']))})"
+        lines.append(f"  Reason:   {explanation['reason']}")
+        if explanation["cost"] is not None:
+            lines.append(f"  Cost:     {explanation['cost'] / 1024:.1f} KB to move")
+            lines.append(f"  Benefit:  {explanation['benefit'] / 1024:.1f} KB over the next {self.classifier.horizon} records")
+        lines.append(f"  Queries:  {self.classifier.access_counts.get(field, 0)}")
+        return "\n".join(lines)
@@ -0,0 +1,302 @@
+"""Per-user summaries kept up to date from each batch the router writes."""
+import json
+import re
+import threading
+import zlib
+from collections import deque
+from datetime import datetime, timezone
+
+from core.classifier import MAX_IDENTIFIER, column_name
+
+BUCKETS = {
+    'minute': lambda ts: ts.replace(second=0, microsecond=0),
+    'hour': lambda ts: ts.replace(minute=0, second=0, microsecond=0),
+    'day': lambda ts: ts.replace(hour=0, minute=0, second=0, microsecond=0)
+}
+# Stored columns per aggregate: (suffix, how a batch updates it, how the table merges it)
+AGGREGATES = {
+    'count': [('', 'count', 'count')],
+    'sum': [('', 'sum', 'sum')],
+    'min': [('', 'min', 'min')],
+    'max': [('', 'max', 'max')],
+    'avg': [('_sum', 'sum', 'sum'), ('_count', 'numbers', 'count')],
+    'latest': [('', 'latest', 'latest'), ('_at', 'latest_at', 'latest_at')]
+}
+NAME = re.compile(r'^[a-z_][a-z0-9_]*$')
+# Key columns are VARCHAR(255); longer values are cut and tagged with a hash of the whole
+MAX_KEY_LENGTH = 255
+# Batches kept for retry while the rollup tables cannot be written
+MAX_PENDING = 100
+# LSNs the checkpoint must advance by before their applied markers are dropped
+FORGET_EVERY = 10000
+
+def _lookup(record, segments):
+    value = record
+    for segment in segments:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(segment)
+    return value
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _key_value(value):
+    text = value if isinstance(value, str) else json.dumps(value)
+    if len(text) > MAX_KEY_LENGTH:
+        text = f"{text[:MAX_KEY_LENGTH - 9]}_{zlib.crc32(text.encode()):08x}"
+    return text
+
+class Rollup:
+    """
+    One summary table, rollup_<name>, with a row per username, value of each
+    `group_by` field and `bucket` (the record's time_field cut to the
+    minute, hour or day). `aggregates` maps an output name to [kind, field]:
+
+        count   records, or records where field is not null
+        sum, min, max, avg   over the field's numeric values
+        latest  the field's value in the newest record by time_field
+
+    Fields may be dotted paths into nested objects. A record missing a
+    group_by field, or the time a bucket needs, is left out.
+    """
+    def __init__(self, name, aggregates, group_by=(), bucket=None, time_field='timestamp'):
+        if not NAME.match(name) or len(f"rollup_{name}") > MAX_IDENTIFIER:
+            raise ValueError(
+                f"Rollup name '{name}' must be at most {MAX_IDENTIFIER - 7} lower-case letters, digits and underscores"
+            )
+        if bucket is not None and bucket not in BUCKETS:
+            raise ValueError(f"Rollup '{name}': bucket must be one of {', '.join(BUCKETS)}")
+        self.name = name
+        self.table = f"rollup_{name}"
+        self.aggregates = {}
+        self.group_by = list(group_by)
+        self.bucket = bucket
+        self.time_field = time_field
+
+        self.key_columns = ['username'] + [column_name(field) for field in self.group_by]
+        if bucket:
+            self.key_columns.append('bucket')
+        self.group_paths = [field.split('.') for field in self.group_by]
+
+        # (column, update kind, merge kind, path or None)
+        self.slots = []
+        for output, (kind, field) in aggregates.items():
+            # Leaves room for the longest column suffix, '_count'
+            if kind not in AGGREGATES or not NAME.match(output) or len(output) > MAX_IDENTIFIER - 6:
+                raise ValueError(f"Rollup '{name}': bad aggregate {output}={kind}")
+            if field is None and kind != 'count':
+                raise ValueError(f"Rollup '{name}': {kind} needs a field")
+            self.aggregates[output] = (kind, field)
+            path = field.split('.') if field else None
+            for suffix, update, merge in AGGREGATES[kind]:
+                self.slots.append((output + suffix, update, merge, path))
+        self.columns = [(column, merge) for column, _, merge, _ in self.slots]
+
+    @classmethod
+    def from_dict(cls, definition):
+        return cls(
+            definition['name'], definition['aggregates'], definition.get('group_by', ()),
+            definition.get('bucket'), definition.get('time_field', 'timestamp')
+        )
+
+    def _time(self, record):
+        ts = record.get(self.time_field)
+        if isinstance(ts, str):
+            try:
+                ts = datetime.fromisoformat(ts)
+            except ValueError:
+                ts = None
+        if not isinstance(ts, datetime):
+            ts = record.get('sys_ingested_at')
+            if not isinstance(ts, datetime):
+                return None
+        if ts.tzinfo is not None:
+            ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+        return ts
+
+    def accumulate(self, groups, record):
+        """Folds one record into groups: {key tuple: [value per slot]}."""
+        username = record.get('username')
+        if username is None:
+            return
+        key = [_key_value(str(username))]
+        for segments in self.group_paths:
+            value = _lookup(record, segments)
+            if value is None:
+                return
+            key.append(_key_value(value))
+        ts = self._time(record)
+        if self.bucket:
+            if ts is None:
+                return
+            key.append(BUCKETS[self.bucket](ts))
+
+        key = tuple(key)
+        values = groups.get(key)
+        if values is None:
+            values = groups[key] = [0 if merge == 'count' else None for _, merge in self.columns]
+
+        for index, (_, update, _, path) in enumerate(self.slots):
+            value = _lookup(record, path) if path else None
+            if update == 'count':
+                if path is None or value is not None:
+                    values[index] += 1
+            elif update == 'numbers':
+                if _number(value):
+                    values[index] += 1
+            elif update == 'latest':
+                # Sets its _at slot, which follows it
+                if value is not None and ts is not None and (values[index + 1] is None or ts >= values[index + 1]):
+                    values[index] = json.dumps(value, default=str)
+                    values[index + 1] = ts
+            elif update != 'latest_at' and _number(value):
+                current = values[index]
+                if current is None:
+                    values[index] = value
+                elif update == 'sum':
+                    values[index] = current + value
+                elif update == 'min':
+                    values[index] = min(current, value)
+                else:
+                    values[index] = max(current, value)
+
+    def present(self, row):
+        """Turns a stored row into the rollup's keys and output values."""
+        result = {column: row[column] for column in self.key_columns}
+        for output, (kind, _) in self.aggregates.items():
+            if kind == 'avg':
+                count = row[output + '_count']
+                result[output] = row[output + '_sum'] / count if count else None
+            elif kind == 'latest':
+                value = row[output]
+                result[output] = json.loads(value) if value is not None else None
+                result[output + '_at'] = row[output + '_at']
+            else:
+                result[output] = row[output]
+        return result
+
+    def describe(self):
+        keys = ', '.join(self.group_by + ([f"{self.bucket} of {self.time_field}"] if self.bucket else []))
+        aggregates = ', '.join(
+            f"{output}={kind}({field or '*'})" for output, (kind, field) in self.aggregates.items()
+        )
+        return f"{self.name}: per username{' and ' + keys if keys else ''}; {aggregates}"
+
+class Rollups:
+    """
+    Maintains every defined rollup from the batches Router.process_batch
+    writes. Each batch is first summed up per row in memory, then applied
+    with one multi-row upsert per rollup, so a batch costs one statement
+    per rollup however many records it holds.
+
+    Rollups read the records as ingested, before they are split between
+    MySQL and MongoDB, so a field migrating between the two changes
+    nothing here, and migrations, which move stored data without routing
+    it again, are never counted twice. They cover records routed after the
+    rollup was defined.
+
+    With `log`, the WriteAheadLog the batches' LSNs come from, the store
+    records each LSN in the same transaction as its upserts, and records
+    it already holds are skipped, so a batch replayed after a crash is
+    counted once. A batch that cannot be applied is kept and retried
+    before the next one; after MAX_PENDING of them the oldest is dropped.
+    """
+    def __init__(self, store, definitions, log=None):
+        self.store = store
+        self.log = log
+        self.rollups = {}
+        for definition in definitions:
+            rollup = definition if isinstance(definition, Rollup) else Rollup.from_dict(definition)
+            self.rollups[rollup.name] = rollup
+        self.ready = False
+        self.upserted = {name: 0 for name in self.rollups}
+        self.pending = deque()
+        self.skipped = 0
+        self.missed = 0
+        self.forgotten = 0
+        self.lock = threading.Lock()
+
+    def apply(self, batch, lsns=None):
+        """Folds a batch, and any that failed before it, into every rollup; raises if one fails."""
+        if len(self.pending) >= MAX_PENDING:
+            dropped, _ = self.pending.popleft()
+            with self.lock:
+                self.missed += len(dropped)
+            print(f"[Rollups] Dropping a batch of {len(dropped)} records that could not be applied")
+        self.pending.append((batch, lsns))
+        while self.pending:
+            self._apply(*self.pending[0])
+            self.pending.popleft()
+
+    def _apply(self, batch, lsns):
+        if not self.ready:
+            for rollup in self.rollups.values():
+                self.store.ensure(rollup)
+            if self.log is not None:
+                self.store.ensure_applied()
+            self.ready = True
+
+        if self.log is None or not lsns:
+            lsns = ()
+        elif min(lsns) <= self.log.recovered_lsn:
+            # Logged before the restart: a replay, possibly of a batch already counted
+            done = self.store.applied(self.log.log_id, lsns)
+            if done:
+                kept = [(record, lsn) for record, lsn in zip(batch, lsns) if lsn not in done]
+                batch, lsns = [record for record, _ in kept], [lsn for _, lsn in kept]
+                with self.lock:
+                    self.skipped += len(done)
+
+        updates = []
+        for rollup in self.rollups.values():
+            groups = {}
+            for record in batch:
+                rollup.accumulate(groups, record)
+            if groups:
+                updates.append((rollup, [key + tuple(values) for key, values in groups.items()]))
+        if not updates:
+            return
+        self.store.upsert(updates, self.log.log_id if lsns else None, lsns)
+        with self.lock:
+            for rollup, rows in updates:
+                self.upserted[rollup.name] += len(rows)
+
+        if self.log is not None and self.log.checkpoint - self.forgotten >= FORGET_EVERY:
+            checkpoint = self.log.checkpoint
+            self.store.forget(self.log.log_id, checkpoint)
+            self.forgotten = checkpoint
+
+    def lookup(self, name, username, filters=None, limit=24):
+        """Rows of one rollup for a username, newest bucket first, as dicts."""
+        rollup = self.rollups.get(name)
+        if rollup is None:
+            raise KeyError(name)
+        columns = dict(zip(rollup.group_by, rollup.key_columns[1:]))
+        filters = {
+            columns[field] if field in columns else field: _key_value(value) if field in columns else value
+            for field, value in (filters or {}).items()
+        }
+        unknown = set(filters) - set(rollup.key_columns)
+        if unknown:
+            if len(rollup.key_columns) == 1:
+                raise ValueError(f"'{name}' has one row per username and takes no filters")
+            raise ValueError(f"'{name}' can only be filtered on {', '.join(rollup.key_columns[1:])}")
+        rows = self.store.fetch(rollup, _key_value(str(username)), filters, limit)
+        return [rollup.present(row) for row in rows]
+
+    def report(self):
+        if not self.rollups:
+            return "No rollups are defined."
+        with self.lock:
+            lines = [f"Rollups ({len(self.rollups)}):"]
+            for name, rollup in self.rollups.items():
+                lines.append(f"  {rollup.describe()}")
+                lines.append(f"    {self.upserted[name]} row upserts this run, table {rollup.table}")
+            if self.skipped:
+                lines.append(f"  {self.skipped} replayed records were already counted and skipped")
+            if self.pending:
+                lines.append(f"  {len(self.pending)} batches waiting to be retried")
+            if self.missed:
+                lines.append(f"  {self.missed} records were dropped after repeated failures")
+            return "\n".join(lines)
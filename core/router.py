@@ -2,36 +2,122 @@ import time
 import queue
 import threading
 
+from core.classifier import OVERFLOW_COLUMN
+from core.tracing import NULL_TRACER
+
+# Written to both databases, so either side can be joined back to the record
+SHARED_KEYS = ('username', 'timestamp', 'sys_ingested_at')
+
 class Router:
-    def __init__(self, sql_handler, mongo_handler):
+    def __init__(self, sql_handler, mongo_handler, tracer=NULL_TRACER, cluster=None, rollups=None):
         self.sql_handler = sql_handler
         self.mongo_handler = mongo_handler
+        self.tracer = tracer
+        self.cluster = cluster
+        self.rollups = rollups
+        # Fields with a MySQL placement; anything missing goes to MongoDB
         self.previous_decisions = {}
+        self.applied_decisions = None
+        self.decision_epoch = 0
+        # Field -> decision it moved away from, for moves that drop a SQL column
+        self.pending_migrations = {}
+
+    @property
+    def leads_schema(self):
+        """In a cluster only the schema lease holder alters the table and migrates data."""
+        return self.cluster is None or self.cluster.leader
+
+    def resolve_decisions(self, schema_decisions, epoch=None):
+        """
+        Several processors can enqueue batches out of order. A batch decided
+        under an older epoch than one already applied is routed with the
+        newer decisions, so a stale payload never re-adds a migrated column.
+        In a cluster, batches are routed with the newest version this
+        instance has adopted, whatever version they were analyzed under.
+        """
+        if self.cluster is not None:
+            version, decisions = self.cluster.current
+            if epoch is None or version > epoch:
+                epoch, schema_decisions = version, decisions
+        if epoch is None:
+            return schema_decisions
+        if epoch < self.decision_epoch:
+            return dict(self.previous_decisions)
+        self.decision_epoch = epoch
+        if self.cluster is not None:
+            self.cluster.routed(epoch)
+        return schema_decisions
 
-    def process_batch(self, batch, schema_decisions):
-        self._check_and_migrate(schema_decisions)
-        self.previous_decisions.update(schema_decisions)
+    def idle(self):
+        """Called when no batch is waiting: the next one is routed with the newest version."""
+        if self.cluster is not None:
+            self.cluster.routed(self.cluster.version)
+
+    def process_batch(self, batch, schema_decisions, lsns=None):
+        """
+        Writes the batch; returns per record the (MySQL, MongoDB) fields it
+        was stored under. lsns are the records' WAL LSNs, for the rollups.
+        """
+        # Batches of one epoch share its decisions dict; only a new one can change placements
+        if schema_decisions is not self.applied_decisions:
+            self._check_and_migrate(schema_decisions)
+            self._remember(schema_decisions)
+            self.applied_decisions = schema_decisions
+        else:
+            self._run_migrations(self.previous_decisions)
         sql_inserts = []
         mongo_inserts = []
+        placements = []
+        # Columns another instance decided but has not added yet are routed to MongoDB
+        columns = getattr(self.sql_handler, 'existing_cols', None)
+
+        promoted = [
+            (path.split('.'), decision['column'], decision.get('value_types'))
+            for path, decision in schema_decisions.items()
+            if decision.get('promoted_from') and decision['target'] == 'SQL'
+            and (columns is None or decision['column'] in columns)
+        ]
 
         for record in batch:
             sql_rec = {}
             mongo_rec = {}
 
-            for key in ['username', 'timestamp', 'sys_ingested_at']:
+            for segments, column, accepted in promoted:
+                value = self._lookup_path(record, segments)
+                # Off-type values only stay in the Mongo document, which holds the whole parent
+                if value is not None and (accepted is None or type(value).__name__ in accepted):
+                    sql_rec[column] = value
+
+            for key in SHARED_KEYS:
                 if key in record:
                     sql_rec[key] = record[key]
                     mongo_rec[key] = record[key]
 
             for key, value in record.items():
-                if key in ['username', 'timestamp', 'sys_ingested_at']:
+                if key in SHARED_KEYS:
                     continue
                 
                 decision = schema_decisions.get(key, {"target": "MONGO"})
                 target = decision['target']
+                column = OVERFLOW_COLUMN if target == 'JSON' else key
+                if target != 'MONGO' and columns is not None and column not in columns:
+                    target = 'MONGO'
 
                 if target == 'SQL':
-                    sql_rec[key] = value
+                    accepted = decision.get('value_types')
+                    if accepted is None or value is None or type(value).__name__ in accepted:
+                        sql_rec[key] = value
+                    else:
+                        # Off-type value of a column the classifier kept in SQL
+                        mongo_rec[key] = value
+                elif target == 'JSON':
+                    if value is None:
+                        continue
+                    if type(value).__name__ in decision['value_types']:
+                        sql_rec.setdefault(OVERFLOW_COLUMN, {})[key] = value
+                    else:
+                        # Would not cast into the key's generated column
+                        mongo_rec[key] = value
                 elif target == 'MONGO':
                     mongo_rec[key] = value
                 elif target == 'BOTH':
@@ -40,11 +126,41 @@ class Router:
 
             sql_inserts.append(sql_rec)
             mongo_inserts.append(mongo_rec)
+            sql_fields = [k for k in sql_rec if k not in SHARED_KEYS and k != OVERFLOW_COLUMN]
+            sql_fields.extend(sql_rec.get(OVERFLOW_COLUMN, ()))
+            placements.append((tuple(sql_fields), tuple(k for k in mongo_rec if k not in SHARED_KEYS)))
 
         if sql_inserts:
-            self.sql_handler.insert_batch(sql_inserts)
+            with self.tracer.stage("sql_write"):
+                self.sql_handler.insert_batch(sql_inserts)
         if mongo_inserts:
-            self.mongo_handler.insert_batch(mongo_inserts)
+            with self.tracer.stage("mongo_write"):
+                self.mongo_handler.insert_batch(mongo_inserts)
+        if self.rollups is not None:
+            with self.tracer.stage("rollup"):
+                try:
+                    # From the records as ingested, so where each field is stored does not matter
+                    self.rollups.apply(batch, lsns)
+                except Exception as e:
+                    # Both databases hold the batch; the rollups retry it with the next one
+                    print(f"[Router] Rollup update failed ({len(self.rollups.pending)} batches waiting): {e}")
+        return placements
+
+    def _remember(self, schema_decisions):
+        """MongoDB is where unknown fields go anyway, so only other placements are kept."""
+        for field, decision in schema_decisions.items():
+            if decision['target'] == 'MONGO':
+                self.previous_decisions.pop(field, None)
+            else:
+                self.previous_decisions[field] = decision
+
+    def _lookup_path(self, record, segments):
+        value = record
+        for segment in segments:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(segment)
+        return value
 
     def _check_and_migrate(self, new_decisions):
         for field, decision in new_decisions.items():
@@ -53,54 +169,98 @@ class Router:
             if field not in self.previous_decisions:
                 continue
 
-            old_target = self.previous_decisions[field]['target']
+            old_decision = self.previous_decisions[field]
+            old_target = old_decision['target']
 
-            if old_target == 'SQL' and new_target == 'MONGO':
-                print(f"[Router] MIGRATION: '{field}' drifted from SQL to MongoDB. Migrating data...")
-                self._migrate_sql_to_mongo(field)
+            if old_target == 'SQL' and new_target in ('MONGO', 'JSON'):
+                self.pending_migrations[field] = old_decision
 
-            elif old_target == 'MONGO' and new_target == 'SQL':
+            elif old_target == 'JSON' and new_target == 'MONGO':
+                pending = self.pending_migrations.get(field)
+                # Still waiting to leave its SQL column: both copies go to MongoDB
+                self.pending_migrations[field] = dict(pending, via_overflow=old_decision) if pending else old_decision
+
+            elif old_target == 'MONGO' and new_target in ('SQL', 'JSON'):
                 pass
 
+        self._run_migrations({**self.previous_decisions, **new_decisions})
+
+    def _run_migrations(self, decisions):
+        if not self.pending_migrations or not self.leads_schema:
+            return
+        if self.cluster is not None:
+            if not self.cluster.all_routed(self.decision_epoch):
+                # Another instance may still be writing to these columns
+                return
+            # A previous lease holder may have migrated some already
+            self.sql_handler.refresh_schema()
+
+        for field, old_decision in list(self.pending_migrations.items()):
+            del self.pending_migrations[field]
+            new_target = decisions.get(field, {"target": "MONGO"})['target']
+            if new_target == old_decision['target'] or new_target not in ('MONGO', 'JSON'):
+                # Moved back before the migration ran; the column still holds the data
+                continue
+
+            if old_decision['target'] == 'JSON':
+                print(f"[Router] MIGRATION: '{field}' drifted from the overflow column to MongoDB. Migrating data...")
+                self._migrate_json_to_mongo(field, old_decision)
+                continue
+
+            column = old_decision.get('column', field)
+            if self.cluster is not None and column not in self.sql_handler.existing_cols:
+                continue
+
+            if new_target == 'JSON':
+                print(f"[Router] '{field}' left the SQL band; moving its column into '{OVERFLOW_COLUMN}'.")
+                try:
+                    self.sql_handler.move_to_json(field, old_decision.get('sql_type'))
+                except Exception as e:
+                    print(f"[Router] Failed to move '{field}' into the overflow column: {e}")
+            elif old_decision.get('promoted_from'):
+                # Promoted subpaths are copies; the parent document in Mongo still has them
+                print(f"[Router] Demoting nested path '{field}' back to its parent document.")
+                try:
+                    self.sql_handler.drop_column(column)
+                except Exception as e:
+                    print(f"[Router] Failed to drop promoted column for '{field}': {e}")
+            else:
+                print(f"[Router] MIGRATION: '{field}' drifted from SQL to MongoDB. Migrating data...")
+                self._migrate_sql_to_mongo(field)
+                if old_decision.get('via_overflow'):
+                    self._migrate_json_to_mongo(field, old_decision['via_overflow'])
+
     def _migrate_sql_to_mongo(self, field):
         try:
-            query = f"SELECT username, sys_ingested_at, {field} FROM {self.sql_handler.table_name} WHERE {field} IS NOT NULL"
-            self.sql_handler.cursor.execute(query)
-            rows = self.sql_handler.cursor.fetchall()
+            rows = self.sql_handler.fetch_column(field)
 
             if not rows:
                 print(f"[Router] No existing data for '{field}'. Dropping column.")
-                self.sql_handler.cursor.execute(f"ALTER TABLE {self.sql_handler.table_name} DROP COLUMN {field}")
-                self.sql_handler.conn.commit()
+                self.sql_handler.drop_column(field)
                 return
 
             print(f"[Router] Migrating {len(rows)} records...")
-
-            from pymongo import UpdateOne
-            bulk_ops = []
-            for row in rows:
-                username, sys_time, value = row
-                filter_query = {
-                    "username": username, 
-                    "sys_ingested_at": sys_time.isoformat() if hasattr(sys_time, 'isoformat') else sys_time
-                }
-                bulk_ops.append(UpdateOne(filter_query, {"$set": {field: value}}, upsert=True))
-
-            if bulk_ops:
-                self.mongo_handler.collection.bulk_write(bulk_ops)
+            self.mongo_handler.set_field(field, rows)
 
             print(f"[Router] Dropping column '{field}'...")
-            self.sql_handler.cursor.execute(f"ALTER TABLE {self.sql_handler.table_name} DROP COLUMN {field}")
-            self.sql_handler.conn.commit()
-            
-            if hasattr(self.sql_handler, 'existing_cols'):
-                self.sql_handler.existing_cols.discard(field)
+            self.sql_handler.drop_column(field)
 
             print(f"[Router] Migration complete.")
 
         except Exception as e:
             print(f"[Router] MIGRATION FAILED for '{field}': {e}")
 
+    def _migrate_json_to_mongo(self, field, old_decision):
+        try:
+            rows = self.sql_handler.fetch_json_field(field)
+            if rows:
+                print(f"[Router] Migrating {len(rows)} records...")
+                self.mongo_handler.set_field(field, rows)
+            self.sql_handler.drop_json_field(field, old_decision.get('column'))
+            print("[Router] Migration complete.")
+        except Exception as e:
+            print(f"[Router] MIGRATION FAILED for '{field}': {e}")
+
     def export_decisions(self):
         """Export previous decisions for persistence across sessions."""
         import copy
@@ -110,4 +270,6 @@ class Router:
         """Restore previous decisions from persisted metadata."""
         import copy
         if decisions:
-            self.previous_decisions = copy.deepcopy(decisions)
+            self.previous_decisions = {
+                field: decision for field, decision in copy.deepcopy(decisions).items() if decision['target'] != 'MONGO'
+            }
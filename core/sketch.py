@@ -0,0 +1,105 @@
+"""Cardinality sketch used for field uniqueness estimates."""
+import base64
+import hashlib
+import math
+from array import array
+
+class CardinalitySketch:
+    """
+    HyperLogLog distinct counter with an exact mode for small fields.
+
+    Up to EXACT_LIMIT distinct value hashes are kept as-is, which is both
+    exact and smaller than the register array. Past that the sketch switches
+    to 2**precision one-byte registers (~3% error at precision 10).
+    """
+    __slots__ = ('precision', 'exact', 'registers')
+    EXACT_LIMIT = 64
+
+    def __init__(self, precision=10):
+        self.precision = precision
+        self.exact = array('Q')
+        self.registers = None
+
+    @staticmethod
+    def hash_value(value):
+        # blake2b rather than hash(): Python's str hash is salted per process
+        token = f"{type(value).__name__}:{value}".encode('utf-8', 'surrogatepass')
+        return int.from_bytes(hashlib.blake2b(token, digest_size=8).digest(), 'big')
+
+    def add(self, value):
+        self.add_hash(self.hash_value(value))
+
+    def update(self, values):
+        for value in values:
+            self.add_hash(self.hash_value(value))
+
+    def add_hash(self, h):
+        if self.registers is None:
+            if h in self.exact:
+                return
+            if len(self.exact) < self.EXACT_LIMIT:
+                self.exact.append(h)
+                return
+            self._to_registers()
+        self._set_register(h)
+
+    def _set_register(self, h):
+        p = self.precision
+        idx = h >> (64 - p)
+        rest = h & ((1 << (64 - p)) - 1)
+        rank = (64 - p) - rest.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def _to_registers(self):
+        self.registers = bytearray(1 << self.precision)
+        for h in self.exact:
+            self._set_register(h)
+        self.exact = array('Q')
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches with different precision")
+
+        if self.registers is None and other.registers is None:
+            for h in other.exact:
+                self.add_hash(h)
+            return self
+
+        if self.registers is None:
+            self._to_registers()
+        if other.registers is None:
+            for h in other.exact:
+                self._set_register(h)
+        else:
+            self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def count(self):
+        if self.registers is None:
+            return len(self.exact)
+
+        regs = self.registers
+        m = len(regs)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        # Ranks are small, so count each one rather than summing 2**-r per register
+        histogram = {r: regs.count(r) for r in set(regs)}
+        estimate = alpha * m * m / sum(n * 2.0 ** -r for r, n in histogram.items())
+        zeros = histogram.get(0, 0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self):
+        if self.registers is None:
+            return {"p": self.precision, "exact": [format(h, 'x') for h in self.exact]}
+        return {"p": self.precision, "registers": base64.b64encode(bytes(self.registers)).decode('ascii')}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(precision=data.get("p", 10))
+        if "registers" in data:
+            sketch.registers = bytearray(base64.b64decode(data["registers"]))
+        else:
+            sketch.exact = array('Q', (int(h, 16) for h in data.get("exact", [])))
+        return sketch
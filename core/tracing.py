@@ -0,0 +1,194 @@
+"""Per-stage timing, ingest-to-durable latency watermarks and a sampling profiler."""
+import contextlib
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+STAGES = [
+    "ingest", "normalize", "dedup", "analyze", "classify", "schema_update",
+    "sql_write", "mongo_write", "rollup", "publish", "checkpoint"
+]
+
+_NO_OP = contextlib.nullcontext()
+
+class _StageTimer:
+    __slots__ = ('tracer', 'name', 'start')
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, time.perf_counter() - self.start)
+
+class Tracer:
+    """
+    Cheap enough to leave on: one perf_counter pair per timed call.
+    Latency is sampled, one record in `sample_every`, from its
+    sys_ingested_at to the moment its batch is checkpointed.
+    """
+    def __init__(self, enabled=True, sample_every=100, window=10000):
+        self.enabled = enabled
+        self.sample_every = sample_every
+        self.stage_stats = {}
+        self.latencies = deque(maxlen=window)
+        self.durable_watermark = None
+        self.seen = 0
+        self.lock = threading.Lock()
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NO_OP
+        return _StageTimer(self, name)
+
+    def record(self, name, seconds, count=1):
+        with self.lock:
+            stats = self.stage_stats.get(name)
+            if stats is None:
+                stats = self.stage_stats[name] = {"calls": 0, "items": 0, "total": 0.0, "max": 0.0}
+            stats["calls"] += 1
+            stats["items"] += count
+            stats["total"] += seconds
+            if seconds > stats["max"]:
+                stats["max"] = seconds
+
+    def observe_durable(self, batch):
+        """Called once a batch is committed and checkpointed."""
+        if not self.enabled or not batch:
+            return
+
+        now = datetime.now()
+        with self.lock:
+            for record in batch:
+                self.seen += 1
+                if self.seen % self.sample_every:
+                    continue
+                ingested = record.get('sys_ingested_at')
+                if isinstance(ingested, datetime):
+                    self.latencies.append((now - ingested).total_seconds())
+
+            newest = max((r['sys_ingested_at'] for r in batch if isinstance(r.get('sys_ingested_at'), datetime)), default=None)
+            if newest and (self.durable_watermark is None or newest > self.durable_watermark):
+                self.durable_watermark = newest
+
+    def latency_summary(self):
+        with self.lock:
+            samples = sorted(self.latencies)
+            watermark = self.durable_watermark
+        if not samples:
+            return None
+
+        def pct(p):
+            return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+        return {
+            "samples": len(samples),
+            "p50": pct(0.50),
+            "p95": pct(0.95),
+            "p99": pct(0.99),
+            "max": samples[-1],
+            "durable_watermark": watermark
+        }
+
+    def report(self):
+        with self.lock:
+            stats = {name: dict(s) for name, s in self.stage_stats.items()}
+
+        lines = [f"{'stage':<15}{'calls':>9}{'items':>10}{'total s':>10}{'avg ms':>9}{'max ms':>9}"]
+        for name in STAGES + sorted(set(stats) - set(STAGES)):
+            s = stats.get(name)
+            if not s:
+                continue
+            lines.append(
+                f"{name:<15}{s['calls']:>9}{s['items']:>10}{s['total']:>10.2f}"
+                f"{s['total'] / s['calls'] * 1000:>9.2f}{s['max'] * 1000:>9.2f}"
+            )
+
+        latency = self.latency_summary()
+        if latency:
+            lines.append(
+                f"\nIngest-to-durable latency ({latency['samples']} samples): "
+                f"p50 {latency['p50']:.3f}s  p95 {latency['p95']:.3f}s  "
+                f"p99 {latency['p99']:.3f}s  max {latency['max']:.3f}s"
+            )
+            lines.append(f"Durable watermark: records ingested up to {latency['durable_watermark']}")
+        return "\n".join(lines)
+
+NULL_TRACER = Tracer(enabled=False)
+
+class SamplingProfiler:
+    """
+    Samples every thread's stack from a background thread and writes the
+    result in folded-stack format ("a;b;c 42"), which flamegraph.pl and
+    speedscope read directly.
+    """
+    def __init__(self, output_dir="data/profiles", interval=0.005):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.samples = Counter()
+        self.thread = None
+        self.timer = None
+        self.stop_event = threading.Event()
+        self.last_output = None
+        self.lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self, duration=None):
+        with self.lock:
+            if self.thread is not None:
+                return False
+            self.samples = Counter()
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self.thread.start()
+            if duration:
+                self.timer = threading.Timer(duration, self.stop)
+                self.timer.daemon = True
+                self.timer.start()
+            return True
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self.stop_event.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        """Stops sampling and returns the path of the folded-stack file (or None)."""
+        with self.lock:
+            if self.thread is None:
+                return None
+            self.stop_event.set()
+            if self.timer is not None and self.timer is not threading.current_thread():
+                self.timer.cancel()
+            self.thread.join()
+            self.thread = None
+            self.timer = None
+
+            os.makedirs(self.output_dir, exist_ok=True)
+            path = os.path.join(self.output_dir, f"profile-{datetime.now():%Y%m%d-%H%M%S}.folded")
+            with open(path, 'w') as f:
+                for stack, count in self.samples.most_common():
+                    f.write(f"{stack} {count}\n")
+            self.last_output = path
+            return path
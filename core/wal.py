@@ -0,0 +1,239 @@
+"""Append-only write-ahead log for ingested records, with group commit."""
+import json
+import os
+import pickle
+import struct
+import threading
+import uuid
+import zlib
+
+# lsn, payload length, crc32 of payload
+_FRAME = struct.Struct('<QII')
+
+class WriteAheadLog:
+    """
+    Every ingested record is appended here and gets a log sequence number
+    (LSN) before it enters the pipeline. Appends are buffered and fsynced
+    together once group_size records are pending or group_interval seconds
+    pass, so durability costs one fsync per group rather than per record.
+
+    The router acks LSNs once their batch is committed to the databases.
+    The checkpoint is the highest LSN below which everything is acked. It
+    is persisted atomically together with the LSNs acked above it, so
+    replay() can tell which records after it were already committed.
+    A batch that fails downstream is dead-lettered: its records are set
+    aside in dead-letter.ndjson and acked, so one bad batch cannot hold
+    the checkpoint back for the rest of the run.
+    """
+    def __init__(self, directory, group_size=500, group_interval=0.05, segment_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.group_size = group_size
+        self.group_interval = group_interval
+        self.segment_bytes = segment_bytes
+        self.checkpoint_path = os.path.join(directory, "checkpoint")
+        self.dead_letter_path = os.path.join(directory, "dead-letter.ndjson")
+        self.dead_lettered = 0
+
+        self.pending = []
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+        os.makedirs(directory, exist_ok=True)
+        self.log_id = self._read_log_id()
+        self.checkpoint, self.acked = self._read_checkpoint()
+        self.persisted_checkpoint = self.checkpoint
+        self.acked_dirty = False
+        last_lsn = self._recover_tail()
+        # The newest LSN logged before this run; replay() yields nothing after it
+        self.recovered_lsn = last_lsn
+        self.next_lsn = max(last_lsn, self.checkpoint) + 1
+        self.durable_lsn = self.next_lsn - 1
+
+        segments = self._segments()
+        if segments:
+            self.segment_path = segments[-1][1]
+        else:
+            self.segment_path = self._segment_name(self.next_lsn)
+        self.segment = open(self.segment_path, 'ab')
+
+        self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flusher.start()
+
+    def _segment_name(self, first_lsn):
+        return os.path.join(self.directory, f"wal-{first_lsn:020d}.log")
+
+    def _segments(self):
+        names = sorted(n for n in os.listdir(self.directory) if n.startswith("wal-") and n.endswith(".log"))
+        return [(int(n[4:-4]), os.path.join(self.directory, n)) for n in names]
+
+    def _read_log_id(self):
+        """Names this log; a new directory starts LSNs over under a new id."""
+        path = os.path.join(self.directory, "id")
+        try:
+            with open(path, 'r') as f:
+                log_id = f.read().strip()
+            if log_id:
+                return log_id
+        except FileNotFoundError:
+            pass
+        log_id = uuid.uuid4().hex
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(log_id)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return log_id
+
+    def _read_checkpoint(self):
+        """(checkpoint, LSNs acked above it); the second line lists them as ranges."""
+        try:
+            with open(self.checkpoint_path, 'r') as f:
+                lines = f.read().split('\n')
+            checkpoint = int(lines[0].strip() or 0)
+            acked = set()
+            for span in (lines[1].split() if len(lines) > 1 else []):
+                first, _, last = span.partition('-')
+                acked.update(range(int(first), int(last or first) + 1))
+            return checkpoint, acked
+        except (FileNotFoundError, ValueError):
+            return 0, set()
+
+    def _read_frames(self, path):
+        """Yields (offset_after, lsn, payload) for each intact frame."""
+        with open(path, 'rb') as f:
+            data = f.read()
+        offset = 0
+        while offset + _FRAME.size <= len(data):
+            lsn, length, crc = _FRAME.unpack_from(data, offset)
+            start = offset + _FRAME.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            offset = start + length
+            yield offset, lsn, payload
+
+    def _recover_tail(self):
+        """Drops a torn write at the end of the last segment and returns its last LSN."""
+        segments = self._segments()
+        if not segments:
+            return 0
+
+        path = segments[-1][1]
+        last_lsn, valid_end = segments[-1][0] - 1, 0
+        for offset, lsn, _ in self._read_frames(path):
+            last_lsn, valid_end = lsn, offset
+
+        if valid_end < os.path.getsize(path):
+            print(f"[WAL] Truncating torn tail of {os.path.basename(path)}")
+            with open(path, 'r+b') as f:
+                f.truncate(valid_end)
+        return last_lsn
+
+    def replay(self):
+        """
+        Yields (lsn, record, committed) for every logged record after the
+        checkpoint. committed records were acked before the restart and
+        must not be written again.
+        """
+        for _, path in self._segments():
+            for _, lsn, payload in self._read_frames(path):
+                if lsn > self.checkpoint:
+                    yield lsn, pickle.loads(payload), lsn in self.acked
+
+    def append(self, record):
+        payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            lsn = self.next_lsn
+            self.next_lsn += 1
+            self.pending.append(_FRAME.pack(lsn, len(payload), zlib.crc32(payload)) + payload)
+            if len(self.pending) >= self.group_size:
+                self._flush_locked()
+        return lsn
+
+    def flush(self):
+        with self.lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self.pending:
+            return
+        self.segment.write(b''.join(self.pending))
+        self.segment.flush()
+        os.fsync(self.segment.fileno())
+        self.pending = []
+        self.durable_lsn = self.next_lsn - 1
+
+        if self.segment.tell() >= self.segment_bytes:
+            self.segment.close()
+            self.segment_path = self._segment_name(self.next_lsn)
+            self.segment = open(self.segment_path, 'ab')
+
+    def ack(self, lsns):
+        """Marks LSNs as committed downstream and advances the checkpoint."""
+        with self.lock:
+            self.acked.update(lsns)
+            while self.checkpoint + 1 in self.acked:
+                self.checkpoint += 1
+                self.acked.discard(self.checkpoint)
+            self.acked_dirty = True
+
+    def dead_letter(self, lsns, records, error):
+        """Sets aside records of a batch that failed downstream and acks them."""
+        lines = [
+            json.dumps({"lsn": lsn, "error": str(error), "record": record}, default=str) + "\n"
+            for lsn, record in zip(lsns, records)
+        ]
+        with self.lock:
+            with open(self.dead_letter_path, 'a') as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            self.dead_lettered += len(lines)
+        print(f"[WAL] Dead-lettered {len(lines)} records to {self.dead_letter_path}: {error}")
+        self.ack(lsns)
+
+    def _flush_loop(self):
+        while not self.stop_event.wait(self.group_interval):
+            with self.lock:
+                self._flush_locked()
+                self._persist_checkpoint_locked()
+
+    def _persist_checkpoint_locked(self):
+        if self.checkpoint == self.persisted_checkpoint and not self.acked_dirty:
+            return
+
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(f"{self.checkpoint}\n{_ranges(self.acked)}")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.checkpoint_path)
+        self.persisted_checkpoint = self.checkpoint
+        self.acked_dirty = False
+        self._drop_applied_segments()
+
+    def _drop_applied_segments(self):
+        segments = self._segments()
+        # A segment is fully applied once the next one starts at or below checkpoint + 1
+        for (_, path), (next_first, _) in zip(segments, segments[1:]):
+            if next_first - 1 <= self.checkpoint and path != self.segment_path:
+                os.remove(path)
+
+    def close(self):
+        self.stop_event.set()
+        self.flusher.join()
+        with self.lock:
+            self._flush_locked()
+            self._persist_checkpoint_locked()
+            self.segment.close()
+
+def _ranges(lsns):
+    """'3-5 9' for {3, 4, 5, 9}."""
+    spans = []
+    for lsn in sorted(lsns):
+        if spans and spans[-1][1] == lsn - 1:
+            spans[-1][1] = lsn
+        else:
+            spans.append([lsn, lsn])
+    return ' '.join(str(a) if a == b else f"{a}-{b}" for a, b in spans)
@@ -0,0 +1,208 @@
+"""Time-bucketed, key-compressed document layout for the MongoDB side."""
+import threading
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+# Keys the router copies into both databases
+SHARED_KEYS = {'username', 'timestamp', 'sys_ingested_at'}
+# Marks records pushed by a migration, which carry one field of an earlier record
+PARTIAL = '~'
+_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+def _base36(n):
+    code = ''
+    while True:
+        n, rem = divmod(n, 36)
+        code = _DIGITS[rem] + code
+        if not n:
+            return code
+
+class KeyDictionary:
+    """
+    Maps field names to short codes ("0", "1", ... "z", "10"). Codes are
+    stored in a collection with unique name and code, so they survive
+    restarts and two writers can never hand out the same code.
+    """
+    def __init__(self, collection=None):
+        self.collection = collection
+        self.codes = {}
+        self.names = {}
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if self.collection is None:
+            return
+        for doc in self.collection.find():
+            self.codes[doc['_id']] = doc['c']
+            self.names[doc['c']] = doc['_id']
+
+    def code(self, name):
+        code = self.codes.get(name)
+        if code is not None:
+            return code
+
+        with self.lock:
+            while name not in self.codes:
+                code = _base36(len(self.names))
+                if self.collection is not None:
+                    try:
+                        self.collection.insert_one({'_id': name, 'c': code})
+                    except DuplicateKeyError:
+                        # Another writer took the name or the code first
+                        self._load()
+                        continue
+                self.codes[name] = code
+                self.names[code] = name
+        return self.codes[name]
+
+    def lookup(self, name):
+        """Code for a name without assigning one; None if the name was never written."""
+        if name not in self.codes:
+            with self.lock:
+                self._load()
+        return self.codes.get(name)
+
+    def name(self, code):
+        if code not in self.names:
+            with self.lock:
+                self._load()
+        return self.names.get(code, code)
+
+class BucketLayout:
+    """
+    One bucket document holds up to max_bucket_records records of one user
+    whose sys_ingested_at falls in the same bucket_seconds window:
+
+        {"u": username, "b": bucket start, "n": record count, "r": [records]}
+
+    Inside "r" every key, nested ones included, is replaced by its code, and
+    the username lives only on the bucket. Records whose MongoDB half holds
+    nothing beyond the shared keys are not stored at all; the MySQL row
+    already has them.
+    """
+    def __init__(self, dictionary, bucket_seconds=3600, max_bucket_records=500):
+        self.dictionary = dictionary
+        self.bucket_seconds = bucket_seconds
+        self.max_bucket_records = max_bucket_records
+
+    def bucket_start(self, ts):
+        if not isinstance(ts, datetime):
+            return None
+        delta = ts - datetime.min
+        seconds = delta.days * 86400 + delta.seconds
+        return datetime.min + timedelta(seconds=seconds - seconds % self.bucket_seconds)
+
+    def encode(self, value):
+        if isinstance(value, dict):
+            return {self.dictionary.code(k): self.encode(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self.encode(v) for v in value]
+        return value
+
+    def decode(self, value):
+        if isinstance(value, dict):
+            return {self.dictionary.name(k): self.decode(v) for k, v in value.items() if k != PARTIAL}
+        if isinstance(value, list):
+            return [self.decode(v) for v in value]
+        return value
+
+    def updates(self, records, partial=False):
+        """Returns (filter, update) pairs that upsert the records into their buckets."""
+        groups = {}
+        for record in records:
+            if not partial and SHARED_KEYS.issuperset(record):
+                continue
+            key = (record.get('username'), self.bucket_start(record.get('sys_ingested_at')))
+            body = self.encode({k: v for k, v in record.items() if k != 'username'})
+            if partial:
+                body[PARTIAL] = 1
+            groups.setdefault(key, []).append(body)
+
+        pairs = []
+        for (username, bucket), bodies in groups.items():
+            for i in range(0, len(bodies), self.max_bucket_records):
+                chunk = bodies[i:i + self.max_bucket_records]
+                pairs.append((
+                    # A full bucket no longer matches, so the upsert opens a new one
+                    {"u": username, "b": bucket, "n": {"$lt": self.max_bucket_records}},
+                    {"$push": {"r": {"$each": chunk}}, "$inc": {"n": len(chunk)}}
+                ))
+        return pairs
+
+    def filter_query(self, filters):
+        """
+        Bucket filter that matches every bucket holding a candidate record,
+        or None if a field was never written. Records still have to be
+        checked with matches() once expanded.
+        """
+        query = {}
+        for field, value in filters.items():
+            if field == 'username':
+                query['u'] = value
+                continue
+            codes = [self.dictionary.lookup(segment) for segment in field.split('.')]
+            if None in codes:
+                return None
+            query['r.' + '.'.join(codes)] = value
+        return query
+
+    def expand(self, *buckets):
+        """
+        Decodes bucket documents of one user and window back into records,
+        folding migrated partials into their records. A full bucket opens a
+        new document, so a partial may sit in a different document from its
+        record: pass every document of the (u, b) pair together.
+        """
+        records = []
+        partials = []
+        for bucket in buckets:
+            for body in bucket.get('r', []):
+                record = self.decode(body)
+                record['username'] = bucket['u']
+                (partials if PARTIAL in body else records).append(record)
+
+        # Both databases keep sys_ingested_at to the millisecond, so a partial
+        # carries the exact time of its record
+        by_time = {}
+        by_second = {}
+        for record in records:
+            ts = record.get('sys_ingested_at')
+            if isinstance(ts, datetime):
+                by_time.setdefault(ts, []).append(record)
+                by_second.setdefault(ts.replace(microsecond=0), []).append(record)
+
+        for partial in partials:
+            ts = partial.get('sys_ingested_at')
+            fields = {k: v for k, v in partial.items() if k not in SHARED_KEYS}
+            candidates = by_time.get(ts, []) if isinstance(ts, datetime) else []
+            if not candidates and isinstance(ts, datetime) and not ts.microsecond:
+                # Migrated from a table that rounded to the second: any record
+                # at most half a second away
+                candidates = [
+                    r for r in by_second.get(ts, []) + by_second.get(ts - timedelta(seconds=1), [])
+                    if abs((r['sys_ingested_at'] - ts).total_seconds()) <= 0.5
+                ]
+            target = next((r for r in candidates if not set(fields) & set(r)), None)
+            if target is None:
+                records.append(partial)
+            else:
+                target.update(fields)
+        return records
+
+    def expand_groups(self, buckets):
+        """Expands bucket documents, passing those of the same (u, b) pair to expand() together."""
+        groups = {}
+        for bucket in buckets:
+            groups.setdefault((bucket['u'], bucket['b']), []).append(bucket)
+        return [record for group in groups.values() for record in self.expand(*group)]
+
+    def matches(self, record, filters):
+        for field, expected in filters.items():
+            value = record
+            for segment in field.split('.'):
+                value = value.get(segment) if isinstance(value, dict) else None
+            if value != expected:
+                return False
+        return True
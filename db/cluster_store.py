@@ -0,0 +1,182 @@
+import json
+import threading
+
+import mysql.connector
+
+class ClusterStore:
+    """
+    Shared state for several engine instances, kept in MySQL next to
+    structured_data:
+
+        cluster_stat_deltas  append-only log of analyzer deltas
+        cluster_lease        who holds the schema lease, and until when
+        cluster_decisions    decision versions published by the lease holder
+        cluster_instances    per instance: version it routes with, log position, last heartbeat
+
+    Lease expiry is judged by the database clock, so instances need not
+    agree on the time.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        self.conn = mysql.connector.connect(**self.config, autocommit=True)
+        cursor = self.conn.cursor()
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cluster_stat_deltas (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            instance VARCHAR(128),
+            created_at DATETIME(6),
+            delta LONGTEXT
+        )
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cluster_lease (
+            name VARCHAR(64) PRIMARY KEY,
+            holder VARCHAR(128),
+            expires_at DATETIME(6)
+        )
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cluster_decisions (
+            version INT PRIMARY KEY,
+            leader VARCHAR(128),
+            created_at DATETIME(6),
+            watermark BIGINT,
+            decisions LONGTEXT,
+            classifier LONGTEXT,
+            stats LONGTEXT
+        )
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cluster_instances (
+            instance VARCHAR(128) PRIMARY KEY,
+            version INT,
+            delta_cursor BIGINT,
+            seen_at DATETIME(6)
+        )
+        """)
+        cursor.close()
+
+    def _execute(self, query, params=(), fetch=None):
+        with self.lock:
+            if self.conn is None or not self.conn.is_connected():
+                self.connect()
+            cursor = self.conn.cursor()
+            try:
+                cursor.execute(query, params)
+                if fetch == 'one':
+                    return cursor.fetchone()
+                if fetch == 'all':
+                    return cursor.fetchall()
+                return cursor.rowcount
+            finally:
+                cursor.close()
+
+    def push_delta(self, instance, delta):
+        self._execute(
+            "INSERT INTO cluster_stat_deltas (instance, created_at, delta) VALUES (%s, NOW(6), %s)",
+            (instance, json.dumps(delta))
+        )
+
+    def deltas_after(self, delta_id, limit=500):
+        rows = self._execute(
+            "SELECT id, delta FROM cluster_stat_deltas WHERE id > %s ORDER BY id LIMIT %s",
+            (delta_id, limit), fetch='all'
+        )
+        return [(row_id, json.loads(delta)) for row_id, delta in rows]
+
+    def acquire_lease(self, name, instance, seconds):
+        """Takes or renews the lease; True if instance holds it afterwards."""
+        # Assignments run left to right, so expires_at sees the updated holder
+        self._execute(
+            """
+            INSERT INTO cluster_lease (name, holder, expires_at)
+            VALUES (%s, %s, NOW(6) + INTERVAL %s MICROSECOND)
+            ON DUPLICATE KEY UPDATE
+                holder = IF(holder = VALUES(holder) OR expires_at < NOW(6), VALUES(holder), holder),
+                expires_at = IF(holder = VALUES(holder), VALUES(expires_at), expires_at)
+            """,
+            (name, instance, int(seconds * 1e6))
+        )
+        row = self._execute("SELECT holder FROM cluster_lease WHERE name = %s", (name,), fetch='one')
+        return row is not None and row[0] == instance
+
+    def release_lease(self, name, instance):
+        self._execute("DELETE FROM cluster_lease WHERE name = %s AND holder = %s", (name, instance))
+
+    def publish(self, lease, instance, version, watermark, decisions, classifier, stats):
+        """
+        Inserts a decision version, only while instance still holds the
+        lease. Returns False if the lease was lost or the version taken.
+        """
+        try:
+            inserted = self._execute(
+                """
+                INSERT INTO cluster_decisions (version, leader, created_at, watermark, decisions, classifier, stats)
+                SELECT %s, %s, NOW(6), %s, %s, %s, %s FROM cluster_lease
+                WHERE name = %s AND holder = %s AND expires_at > NOW(6)
+                """,
+                (version, instance, watermark, json.dumps(decisions), json.dumps(classifier),
+                 json.dumps(stats), lease, instance)
+            )
+        except mysql.connector.IntegrityError:
+            return False
+        return inserted == 1
+
+    def latest_version(self, after=0, with_stats=False):
+        """Newest decision version above `after` as a dict, or None."""
+        columns = "version, watermark, decisions, classifier" + (", stats" if with_stats else "")
+        row = self._execute(
+            f"SELECT {columns} FROM cluster_decisions WHERE version > %s ORDER BY version DESC LIMIT 1",
+            (after,), fetch='one'
+        )
+        if row is None:
+            return None
+        latest = {
+            "version": row[0],
+            "watermark": row[1],
+            "decisions": json.loads(row[2]),
+            "classifier": json.loads(row[3])
+        }
+        if with_stats:
+            latest["stats"] = json.loads(row[4])
+        return latest
+
+    def heartbeat(self, instance, version, delta_cursor):
+        self._execute(
+            """
+            INSERT INTO cluster_instances (instance, version, delta_cursor, seen_at) VALUES (%s, %s, %s, NOW(6))
+            ON DUPLICATE KEY UPDATE
+                version = VALUES(version), delta_cursor = VALUES(delta_cursor), seen_at = VALUES(seen_at)
+            """,
+            (instance, version, delta_cursor)
+        )
+
+    def live_positions(self, seconds):
+        """(lowest version, lowest log position) over instances seen in the last `seconds`."""
+        return self._execute(
+            """
+            SELECT MIN(version), MIN(delta_cursor) FROM cluster_instances
+            WHERE seen_at > NOW(6) - INTERVAL %s MICROSECOND
+            """,
+            (int(seconds * 1e6),), fetch='one'
+        )
+
+    def prune(self, delta_id, keep_versions):
+        """Drops deltas up to delta_id and all but the newest keep_versions versions."""
+        self._execute("DELETE FROM cluster_stat_deltas WHERE id <= %s", (delta_id,))
+        self._execute(
+            """
+            DELETE FROM cluster_decisions WHERE version <= (
+                SELECT v FROM (SELECT MAX(version) - %s AS v FROM cluster_decisions) AS newest
+            )
+            """,
+            (keep_versions,)
+        )
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
@@ -1,11 +1,36 @@
 import pymongo
 import os 
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
+from pymongo.write_concern import WriteConcern
+
+from db.bucket_layout import BucketLayout, KeyDictionary
 
 load_dotenv()
 
+# MONGO_WRITE_PROFILE: what an insert waits for before it counts as written
+WRITE_PROFILES = {
+    # Journaled on a majority of the replica set; survives failover
+    "durable": WriteConcern(w="majority", j=True),
+    # Acknowledged by the primary (the driver's default)
+    "standard": WriteConcern(w=1),
+    # Fire and forget, for telemetry that can afford to lose records; errors go unseen
+    "unacknowledged": WriteConcern(w=0)
+}
+# Write errors worth retrying: the server was busy, stepping down or unreachable.
+# Anything else (too large, failed validation, bad value) fails the same way again.
+TRANSIENT_ERRORS = {
+    6, 7, 50, 89, 91, 112, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436
+}
+# The document is already stored, e.g. from an attempt that landed before a reconnect
+DUPLICATE_KEY = 11000
+INSERT_RETRIES = 3
+RETRY_BACKOFF = 0.2
+
 class MongoHandler:
-    def __init__(self):
+    def __init__(self, layout=None, write_profile=None):
         # Fetch from environment
         uri = os.getenv("MONGO_URI")
         db_name = os.getenv("MONGO_DB_NAME", "adaptive_db")
@@ -13,26 +38,252 @@ class MongoHandler:
         if not uri:
             raise ValueError("MONGO_URI not found in .env file")
 
-        self.client = pymongo.MongoClient(uri)
+        profile = write_profile or os.getenv("MONGO_WRITE_PROFILE", "standard")
+        if profile not in WRITE_PROFILES:
+            raise ValueError(f"Unknown MONGO_WRITE_PROFILE '{profile}'; use one of {', '.join(WRITE_PROFILES)}")
+        self.write_concern = WRITE_PROFILES[profile]
+        # Inserts above chunk_size records are split and sent from insert_threads connections
+        self.chunk_size = int(os.getenv("MONGO_INSERT_CHUNK", 250))
+        self.insert_threads = int(os.getenv("MONGO_INSERT_THREADS", 4))
+
+        self.client = pymongo.MongoClient(
+            uri,
+            # First one the server also supports wins; zstd and snappy need their client packages
+            compressors=os.getenv("MONGO_COMPRESSORS", "zlib"),
+            zlibCompressionLevel=int(os.getenv("MONGO_ZLIB_LEVEL", 1)),
+            maxPoolSize=int(os.getenv("MONGO_POOL_SIZE", 16))
+        )
         self.db = self.client[db_name]
-        self.collection = self.db["unstructured_data"]
+        self.collection = self.db.get_collection("unstructured_data", write_concern=self.write_concern)
+        # Migrations must know their writes landed before SQL drops the column
+        self.migration_collection = self.collection.with_options(
+            write_concern=self.write_concern if self.write_concern.acknowledged else WriteConcern(w=1)
+        )
+        self.pool = ThreadPoolExecutor(max_workers=self.insert_threads, thread_name_prefix="mongo-insert")
+
+        # "document": one document per record. "bucketed": per-user time
+        # buckets with short field codes, in their own collection.
+        self.layout = None
+        if (layout or os.getenv("MONGO_LAYOUT", "document")) == "bucketed":
+            self.buckets = self.db.get_collection("unstructured_buckets", write_concern=self.write_concern)
+            self.key_dictionary = self.db["key_dictionary"]
+            self.layout = BucketLayout(
+                KeyDictionary(self.key_dictionary),
+                bucket_seconds=int(os.getenv("MONGO_BUCKET_SECONDS", 3600)),
+                max_bucket_records=int(os.getenv("MONGO_BUCKET_RECORDS", 500))
+            )
+
+    def ensure_indexes(self):
+        """Creates the indexes reads rely on. Called once at setup; transient errors are retried."""
+        # Serves ordered scans and the cold tier's age cutoff
+        self._retry("Index creation", self.collection.create_index, "sys_ingested_at")
+        if self.layout is not None:
+            self._retry(
+                "Index creation", self.buckets.create_index, [("u", pymongo.ASCENDING), ("b", pymongo.ASCENDING)]
+            )
+            self._retry("Index creation", self.buckets.create_index, "b")
+            # Two writers can never hand out the same field code
+            self._retry("Index creation", self.key_dictionary.create_index, "c", unique=True)
+
+    def _retry(self, action, operation, *args, **kwargs):
+        """Runs operation, retrying with backoff while it fails for a transient reason."""
+        for attempt in range(INSERT_RETRIES + 1):
+            try:
+                return operation(*args, **kwargs)
+            except (pymongo.errors.AutoReconnect, pymongo.errors.OperationFailure) as e:
+                transient = isinstance(e, pymongo.errors.AutoReconnect) or e.code in TRANSIENT_ERRORS
+                if not transient or attempt == INSERT_RETRIES:
+                    raise
+                print(f"[Mongo Handler] {action} interrupted ({e}); retrying.")
+                time.sleep(RETRY_BACKOFF * 2 ** attempt)
 
     def insert_batch(self, records):
         if not records:
             return
 
-        valid_records = []
-        for rec in records:
-            valid_records.append(rec)
+        if self.layout is not None:
+            self._upsert_buckets(self.layout.updates(records))
+            return
 
-        if valid_records:
+        chunks = [records[i:i + self.chunk_size] for i in range(0, len(records), self.chunk_size)]
+        if len(chunks) == 1:
+            self._insert_chunk(chunks[0])
+            return
+        # Unordered inserts of separate chunks; a failed chunk doesn't hold back the others
+        for future in [self.pool.submit(self._insert_chunk, chunk) for chunk in chunks]:
+            future.result()
+
+    def _insert_chunk(self, docs):
+        """insert_many that retries only the documents that failed for a transient reason."""
+        for attempt in range(INSERT_RETRIES + 1):
             try:
-                self.collection.insert_many(valid_records, ordered=False)
+                self.collection.insert_many(docs, ordered=False)
+                return
             except pymongo.errors.BulkWriteError as bwe:
-                print(f"[Mongo Handler] Bulk Write Error: {bwe.details}")
+                # Indexes are positions in docs; everything not listed was inserted
+                failed = []
+                for error in bwe.details.get("writeErrors", []):
+                    code = error.get("code")
+                    if code in TRANSIENT_ERRORS:
+                        failed.append(docs[error["index"]])
+                    elif code != DUPLICATE_KEY:
+                        print(f"[Mongo Handler] Dropping rejected document (code {code}): {error.get('errmsg')}")
+                for error in bwe.details.get("writeConcernErrors", []):
+                    print(f"[Mongo Handler] Write concern not met: {error.get('errmsg')}")
+                docs = failed
+            except pymongo.errors.AutoReconnect as e:
+                # Documents that did land come back as duplicate keys on the retry
+                print(f"[Mongo Handler] Insert interrupted ({e}); retrying {len(docs)} documents.")
             except Exception as e:
                 print(f"[Mongo Handler] Insert Error: {e}")
+                return
+
+            if not docs:
+                return
+            if attempt < INSERT_RETRIES:
+                time.sleep(RETRY_BACKOFF * 2 ** attempt)
+        print(f"[Mongo Handler] Gave up on {len(docs)} documents after {INSERT_RETRIES} retries.")
+
+    def _upsert_buckets(self, updates, buckets=None):
+        ops = [pymongo.UpdateOne(query, update, upsert=True) for query, update in updates]
+        if not ops:
+            return
+        try:
+            # Ordered, so a second chunk for the same bucket sees the first one's count
+            (buckets or self.buckets).bulk_write(ops, ordered=True)
+        except pymongo.errors.BulkWriteError as bwe:
+            print(f"[Mongo Handler] Bulk Write Error: {bwe.details}")
+        except Exception as e:
+            print(f"[Mongo Handler] Insert Error: {e}")
+
+    def set_field(self, field, rows):
+        """Upserts one field onto the documents matching each (username, sys_ingested_at, value) row."""
+        if self.layout is not None:
+            # Pushed as partial records; reads fold them into the record they belong to
+            partials = [
+                {"username": username, "sys_ingested_at": sys_time, field: value}
+                for username, sys_time, value in rows
+            ]
+            self._upsert_buckets(self.layout.updates(partials, partial=True), self.buckets.with_options(
+                write_concern=self.migration_collection.write_concern
+            ))
+            return
+
+        bulk_ops = []
+        for username, sys_time, value in rows:
+            # Kept as a datetime so it sorts and ages like every other document
+            filter_query = {"username": username, "sys_ingested_at": sys_time}
+            bulk_ops.append(pymongo.UpdateOne(filter_query, {"$set": {field: value}}, upsert=True))
+
+        if bulk_ops:
+            self.migration_collection.bulk_write(bulk_ops)
+
+    def find(self, filters, limit=10):
+        """Returns up to `limit` documents matching every field=value filter."""
+        if self.layout is None:
+            return list(self.collection.find(filters, {"_id": 0}).limit(limit))
+
+        query = self.layout.filter_query(filters)
+        if query is None:
+            return []
+        results, seen = [], set()
+        for bucket in self.buckets.find(query, {"u": 1, "b": 1}):
+            key = (bucket["u"], bucket["b"])
+            if key in seen:
+                continue
+            seen.add(key)
+            # The partials of a record may sit in a sibling bucket the filter did not match
+            group = self.buckets.find({"u": key[0], "b": key[1]})
+            for record in self.layout.expand(*group):
+                if self.layout.matches(record, filters):
+                    results.append(record)
+                    if len(results) >= limit:
+                        return results
+        return results
+
+    def scan(self, start=None, end=None, batch_size=1000):
+        """Yields records in sys_ingested_at order, for start <= sys_ingested_at < end."""
+        if self.layout is None:
+            query = {"sys_ingested_at": _time_range(start, end)}
+            cursor = self.collection.find(query, {"_id": 0}).sort("sys_ingested_at", 1).batch_size(batch_size)
+            yield from cursor
+            return
+
+        # Records only sort within a bucket window, so one window is expanded at a time
+        window_start = None if start is None else self.layout.bucket_start(start)
+        buckets = self.buckets.find({"b": _time_range(window_start, end)}).sort("b", 1).batch_size(
+            max(1, batch_size // self.layout.max_bucket_records)
+        )
+        window, group = None, []
+        for bucket in buckets:
+            if bucket["b"] != window:
+                yield from _in_range(self.layout.expand_groups(group), start, end)
+                window, group = bucket["b"], []
+            group.append(bucket)
+        yield from _in_range(self.layout.expand_groups(group), start, end)
+
+    def ingested_range(self):
+        """Returns (oldest, newest) sys_ingested_at, or (None, None) when nothing is stored."""
+        if self.layout is None:
+            query = {"sys_ingested_at": {"$type": "date"}}
+            first = self.collection.find_one(query, sort=[("sys_ingested_at", 1)])
+            last = self.collection.find_one(query, sort=[("sys_ingested_at", -1)])
+            if first is None:
+                return None, None
+            return first["sys_ingested_at"], last["sys_ingested_at"]
+
+        first = self.buckets.find_one({}, sort=[("b", 1)])
+        last = self.buckets.find_one({}, sort=[("b", -1)])
+        if first is None:
+            return None, None
+        return first["b"], last["b"] + timedelta(seconds=self.layout.bucket_seconds)
+
+    def fetch_older_than(self, cutoff, limit):
+        """Returns (records, ids to delete) for the oldest records ingested before cutoff."""
+        if self.layout is None:
+            docs = list(self.collection.find({"sys_ingested_at": {"$lt": cutoff}}).sort("_id", 1).limit(limit))
+            return [{k: v for k, v in doc.items() if k != "_id"} for doc in docs], [doc["_id"] for doc in docs]
+
+        # A bucket goes once its whole window is older than cutoff
+        window_start = cutoff - timedelta(seconds=self.layout.bucket_seconds)
+        buckets = list(
+            self.buckets.find({"b": {"$lte": window_start}}).sort([("b", 1), ("u", 1), ("_id", 1)])
+            .limit(max(1, limit // self.layout.max_bucket_records))
+        )
+        if buckets:
+            # Only the last (u, b) pair can be cut by the limit; its partials go with it
+            last = buckets[-1]
+            taken = {bucket["_id"] for bucket in buckets}
+            buckets.extend(
+                bucket for bucket in self.buckets.find({"u": last["u"], "b": last["b"]})
+                if bucket["_id"] not in taken
+            )
+        records = self.layout.expand_groups(buckets)
+        return records, [bucket["_id"] for bucket in buckets]
+
+    def delete_ids(self, ids):
+        target = self.collection if self.layout is None else self.buckets
+        target.delete_many({"_id": {"$in": ids}})
 
     def close(self):
+        if hasattr(self, 'pool'):
+            self.pool.shutdown()
         if hasattr(self, 'client'):
-            self.client.close()
\ No newline at end of file
+            self.client.close()
+
+def _time_range(start, end):
+    condition = {"$type": "date"}
+    if start is not None:
+        condition["$gte"] = start
+    if end is not None:
+        condition["$lt"] = end
+    return condition
+
+def _in_range(records, start, end):
+    records = [
+        r for r in records
+        if isinstance(r.get("sys_ingested_at"), datetime)
+        and (start is None or r["sys_ingested_at"] >= start)
+        and (end is None or r["sys_ingested_at"] < end)
+    ]
+    return sorted(records, key=lambda r: r["sys_ingested_at"])
@@ -0,0 +1,147 @@
+import threading
+
+import mysql.connector
+
+from core.rollups import MAX_KEY_LENGTH
+
+KEY_TYPES = {'username': f'VARCHAR({MAX_KEY_LENGTH})', 'bucket': 'DATETIME'}
+GROUP_TYPE = f'VARCHAR({MAX_KEY_LENGTH})'
+COLUMN_TYPES = {
+    'count': 'BIGINT NOT NULL DEFAULT 0',
+    'sum': 'DOUBLE',
+    'min': 'DOUBLE',
+    'max': 'DOUBLE',
+    'latest': 'TEXT',
+    'latest_at': 'DATETIME(6)'
+}
+# How an upsert folds a batch's value ({new}) into the stored one ({col}); a latest
+# column is assigned before its _at column ({at}, {new_at}), which it compares on
+MERGE = {
+    'count': '{col} + {new}',
+    'sum': 'COALESCE({col} + {new}, {col}, {new})',
+    'min': 'CASE WHEN {new} IS NULL OR {new} >= {col} THEN {col} ELSE {new} END',
+    'max': 'CASE WHEN {new} IS NULL OR {new} <= {col} THEN {col} ELSE {new} END',
+    'latest': 'CASE WHEN {new_at} IS NULL OR {new_at} < {at} THEN {col} ELSE {new} END',
+    'latest_at': 'CASE WHEN {new} IS NULL OR {new} < {col} THEN {col} ELSE {new} END'
+}
+# WAL LSNs already folded into the rollups, per log; not rollup_<name>, so no rollup can clash
+APPLIED_TABLE = 'rollups_applied'
+APPLIED_COLUMNS = 'source VARCHAR(64) NOT NULL, lsn BIGINT NOT NULL, PRIMARY KEY (source, lsn)'
+
+def merge_assignments(rollup, incoming):
+    """`col = <merge>` for every value column; incoming(col) names the batch's value."""
+    assignments = []
+    for column, merge in rollup.columns:
+        at = column + '_at'
+        expression = MERGE[merge].format(col=column, new=incoming(column), at=at, new_at=incoming(at))
+        assignments.append(f"{column} = {expression}")
+    return ', '.join(assignments)
+
+def column_definitions(rollup):
+    keys = [f"{c} {KEY_TYPES.get(c, GROUP_TYPE)} NOT NULL" for c in rollup.key_columns]
+    return keys + [f"{column} {COLUMN_TYPES[merge]}" for column, merge in rollup.columns]
+
+class RollupStore:
+    """
+    Keeps each rollup in a MySQL table, rollup_<name>, whose primary key is
+    the rollup's keys with username first. A batch is applied as one
+    INSERT ... ON DUPLICATE KEY UPDATE that folds its partial aggregates
+    into the stored ones, so instances sharing the tables can all write to
+    them. A lookup reads one username's rows through the primary key.
+
+    The LSNs a batch came from are inserted into rollups_applied in the
+    same transaction as its upserts, so applied() tells which records of
+    a replayed batch are already counted.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        self.conn = mysql.connector.connect(**self.config, autocommit=True)
+
+    def _execute(self, query, params=(), fetch=None, many=False):
+        with self.lock:
+            if self.conn is None or not self.conn.is_connected():
+                self.connect()
+            cursor = self.conn.cursor(dictionary=fetch == 'dicts')
+            try:
+                if many:
+                    cursor.executemany(query, params)
+                else:
+                    cursor.execute(query, params)
+                if fetch:
+                    return cursor.fetchall()
+                return cursor.rowcount
+            finally:
+                cursor.close()
+
+    def ensure(self, rollup):
+        """Creates the rollup's table, or adds aggregates defined since it was created."""
+        self._execute(
+            f"CREATE TABLE IF NOT EXISTS {rollup.table} "
+            f"({', '.join(column_definitions(rollup))}, PRIMARY KEY ({', '.join(rollup.key_columns)}))"
+        )
+        existing = {row[0] for row in self._execute(f"SHOW COLUMNS FROM {rollup.table}", fetch='all')}
+        for column, merge in rollup.columns:
+            if column not in existing:
+                print(f"[Rollups] Adding column '{column}' to {rollup.table}")
+                self._execute(f"ALTER TABLE {rollup.table} ADD COLUMN {column} {COLUMN_TYPES[merge]}")
+
+    def ensure_applied(self):
+        self._execute(f"CREATE TABLE IF NOT EXISTS {APPLIED_TABLE} ({APPLIED_COLUMNS})")
+
+    def applied(self, source, lsns):
+        """The LSNs among lsns whose records source already folded in."""
+        rows = self._execute(
+            f"SELECT lsn FROM {APPLIED_TABLE} WHERE source = %s AND lsn BETWEEN %s AND %s",
+            (source, min(lsns), max(lsns)), fetch='all'
+        )
+        return {row[0] for row in rows} & set(lsns)
+
+    def upsert(self, updates, source=None, lsns=()):
+        """Applies (rollup, rows) pairs and marks source's lsns applied, all in one transaction."""
+        statements = []
+        for rollup, rows in updates:
+            columns = rollup.key_columns + [column for column, _ in rollup.columns]
+            statements.append((
+                f"INSERT INTO {rollup.table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+                f"ON DUPLICATE KEY UPDATE {merge_assignments(rollup, lambda column: f'VALUES({column})')}",
+                rows
+            ))
+        if lsns:
+            statements.append((
+                f"INSERT INTO {APPLIED_TABLE} (source, lsn) VALUES (%s, %s)", [(source, lsn) for lsn in lsns]
+            ))
+
+        with self.lock:
+            if self.conn is None or not self.conn.is_connected():
+                self.connect()
+            cursor = self.conn.cursor()
+            try:
+                self.conn.start_transaction()
+                for query, rows in statements:
+                    cursor.executemany(query, rows)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            finally:
+                cursor.close()
+
+    def forget(self, source, checkpoint):
+        """Drops markers up to the WAL checkpoint; replay never yields those LSNs again."""
+        self._execute(f"DELETE FROM {APPLIED_TABLE} WHERE source = %s AND lsn <= %s", (source, checkpoint))
+
+    def fetch(self, rollup, username, filters, limit):
+        conditions = ['username = %s'] + [f"{column} = %s" for column in filters]
+        order = ', '.join(f"{column} DESC" for column in reversed(rollup.key_columns[1:])) or 'username'
+        return self._execute(
+            f"SELECT * FROM {rollup.table} WHERE {' AND '.join(conditions)} ORDER BY {order} LIMIT %s",
+            [username, *filters.values(), limit], fetch='dicts'
+        )
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
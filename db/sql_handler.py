@@ -1,9 +1,24 @@
+import json
 import mysql.connector
 import os
 from dotenv import load_dotenv
 
+from core.classifier import OVERFLOW_COLUMN
+
 load_dotenv()
 
+# Column types update_schema may widen in place, narrowest first
+WIDENING_RANK = {'tinyint(1)': 0, 'boolean': 0, 'int': 1, 'float': 2}
+# Indexed prefix length for TEXT columns
+TEXT_INDEX_PREFIX = 64
+# Column type and expression of the virtual column exposing a hot overflow key, per decided sql_type
+GENERATED_COLUMNS = {
+    'INT': ('BIGINT', "CAST({value} AS SIGNED)"),
+    'FLOAT': ('DOUBLE', "CAST({value} AS DOUBLE)"),
+    'BOOLEAN': ('BOOLEAN', "{value} = 'true'"),
+    'TEXT': ('VARCHAR(255)', "LEFT({value}, 255)")
+}
+
 class SQLHandler:
     def __init__(self):
         self.config = {
@@ -32,7 +47,7 @@ class SQLHandler:
             id INT AUTO_INCREMENT PRIMARY KEY,
             username VARCHAR(255),
             timestamp DATETIME,
-            sys_ingested_at DATETIME,
+            sys_ingested_at DATETIME(3),
             INDEX (sys_ingested_at),
             INDEX (username)
         )
@@ -40,32 +55,289 @@ class SQLHandler:
         self.cursor.execute(query)
         self.conn.commit()
         self._refresh_schema_cache()
+        if self.column_types.get('sys_ingested_at') == 'datetime':
+            # Tables from before milliseconds were kept; migrated fields are matched on the exact time
+            print(f"[SQL Handler] Keeping milliseconds of sys_ingested_at in {self.table_name}")
+            self.cursor.execute(f"ALTER TABLE {self.table_name} MODIFY COLUMN sys_ingested_at DATETIME(3)")
+            self.conn.commit()
+            self.column_types['sys_ingested_at'] = 'datetime(3)'
 
     def _refresh_schema_cache(self):
         self.cursor.execute(f"DESCRIBE {self.table_name}")
-        self.existing_cols = {row[0] for row in self.cursor.fetchall()}
+        rows = self.cursor.fetchall()
+        self.existing_cols = {row[0] for row in rows}
+        self.column_types = {
+            row[0]: (row[1].decode() if isinstance(row[1], bytes) else row[1]).lower()
+            for row in rows
+        }
+        # Virtual columns over overflow keys; never written, left out of returned rows
+        self.generated_cols = {row[0] for row in rows if 'GENERATED' in str(row[5]).upper()}
+
+    def refresh_schema(self):
+        """Re-reads the table's columns, e.g. after another instance altered it."""
+        self._refresh_schema_cache()
+
+    def sync_schema(self, schema_decisions):
+        """For instances that don't alter the table: refresh the cache once a decided column is missing."""
+        if not hasattr(self, 'existing_cols'):
+            self._refresh_schema_cache()
+        missing = [
+            decision.get('column', field) for field, decision in schema_decisions.items()
+            if decision['target'] in ['SQL', 'BOTH'] and decision.get('column', field) not in self.existing_cols
+        ]
+        missing += [
+            decision['column'] for decision in schema_decisions.values()
+            if decision['target'] == 'JSON' and (OVERFLOW_COLUMN not in self.existing_cols
+                                                 or decision.get('indexed') != (decision['column'] in self.existing_cols))
+        ]
+        if missing:
+            self._refresh_schema_cache()
 
     def update_schema(self, schema_decisions):
         if not hasattr(self, 'existing_cols'):
             self._refresh_schema_cache()
 
         for field, decision in schema_decisions.items():
-            if decision['target'] in ['SQL', 'BOTH'] and field not in self.existing_cols:
+            column = decision.get('column', field)
+            if decision['target'] in ['SQL', 'BOTH'] and column not in self.existing_cols:
                 sql_type = decision.get('sql_type', 'TEXT')
                 is_unique = decision.get('is_unique', False)
                 
                 constraint = " UNIQUE" if is_unique else ""
-                print(f"[SQL Handler] Evolving Schema: Adding column '{field}' as {sql_type}{constraint}")
+                print(f"[SQL Handler] Evolving Schema: Adding column '{column}' as {sql_type}{constraint}")
                 
-                alter_query = f"ALTER TABLE {self.table_name} ADD COLUMN {field} {sql_type}{constraint}"
+                alter_query = f"ALTER TABLE {self.table_name} ADD COLUMN {column} {sql_type}{constraint}"
                 try:
                     self.cursor.execute(alter_query)
-                    self.existing_cols.add(field)
+                    self.existing_cols.add(column)
+                    self.column_types[column] = sql_type.lower()
                 except mysql.connector.Error as err:
-                    print(f"Failed to add column {field}: {err}")
+                    print(f"Failed to add column {column}: {err}")
+
+            elif decision['target'] in ['SQL', 'BOTH']:
+                self._widen_column(column, decision.get('sql_type', 'TEXT'))
+
+            elif decision['target'] == 'JSON':
+                self._update_overflow(field, decision)
         
         self.conn.commit()
 
+    def _update_overflow(self, field, decision):
+        """Adds the overflow column, then a hot key's generated column and index, or drops a cooled one."""
+        if OVERFLOW_COLUMN not in self.existing_cols:
+            print(f"[SQL Handler] Evolving Schema: Adding JSON overflow column '{OVERFLOW_COLUMN}'")
+            try:
+                self.cursor.execute(f"ALTER TABLE {self.table_name} ADD COLUMN {OVERFLOW_COLUMN} JSON")
+                self.existing_cols.add(OVERFLOW_COLUMN)
+                self.column_types[OVERFLOW_COLUMN] = 'json'
+            except mysql.connector.Error as err:
+                print(f"Failed to add column {OVERFLOW_COLUMN}: {err}")
+                return
+
+        column = decision['column']
+        if decision.get('indexed') and column not in self.existing_cols:
+            sql_type, expression = GENERATED_COLUMNS[decision['sql_type']]
+            expression = expression.format(value=f"{OVERFLOW_COLUMN}->>'{json_path(field)}'")
+            print(f"[SQL Handler] Indexing overflow key '{field}' as generated column '{column}'")
+            try:
+                # Virtual: added without touching rows; only the index is built
+                self.cursor.execute(
+                    f"ALTER TABLE {self.table_name} ADD COLUMN {column} {sql_type} AS ({expression}) VIRTUAL"
+                )
+                self.existing_cols.add(column)
+                self.generated_cols.add(column)
+                self.column_types[column] = sql_type.lower()
+                self.cursor.execute(
+                    f"ALTER TABLE {self.table_name} ADD INDEX {column} ({column}), ALGORITHM=INPLACE, LOCK=NONE"
+                )
+            except mysql.connector.Error as err:
+                print(f"Failed to add generated column {column}: {err}")
+        elif not decision.get('indexed') and column in self.existing_cols:
+            print(f"[SQL Handler] Overflow key '{field}' cooled; dropping generated column '{column}'")
+            self.drop_column(column)
+
+    def _widen_column(self, column, sql_type):
+        current = self.column_types.get(column)
+        target_rank = WIDENING_RANK.get(sql_type.lower())
+        current_rank = WIDENING_RANK.get(current)
+        if target_rank is None or current_rank is None or target_rank <= current_rank:
+            return
+
+        print(f"[SQL Handler] Widening column '{column}' from {current} to {sql_type}")
+        try:
+            self.cursor.execute(f"ALTER TABLE {self.table_name} MODIFY COLUMN {column} {sql_type}")
+            self.column_types[column] = sql_type.lower()
+        except mysql.connector.Error as err:
+            print(f"Failed to widen column {column}: {err}")
+
+    def fetch_column(self, column):
+        """Returns (username, sys_ingested_at, value) for every row where the column is set."""
+        query = f"SELECT username, sys_ingested_at, {column} FROM {self.table_name} WHERE {column} IS NOT NULL"
+        self.cursor.execute(query)
+        return self.cursor.fetchall()
+
+    def fetch_json_field(self, field):
+        """Returns (username, sys_ingested_at, value) for every row whose overflow holds the key."""
+        if OVERFLOW_COLUMN not in self.existing_cols:
+            return []
+        self.cursor.execute(
+            f"SELECT username, sys_ingested_at, JSON_EXTRACT({OVERFLOW_COLUMN}, %s) FROM {self.table_name} "
+            f"WHERE JSON_CONTAINS_PATH({OVERFLOW_COLUMN}, 'one', %s)",
+            (json_path(field), json_path(field))
+        )
+        return [(username, sys_time, json.loads(value)) for username, sys_time, value in self.cursor.fetchall()]
+
+    def move_to_json(self, field, sql_type=None):
+        """Copies a column into the overflow column, within the table, then drops it."""
+        if field not in self.existing_cols:
+            return
+        # BOOLEAN columns hold 0/1; the key must read back as true/false
+        value = f"CAST(IF({field}, 'true', 'false') AS JSON)" if sql_type == 'BOOLEAN' else field
+        self.cursor.execute(
+            f"UPDATE {self.table_name} SET {OVERFLOW_COLUMN} = JSON_SET(COALESCE({OVERFLOW_COLUMN}, JSON_OBJECT()), %s, {value}) "
+            f"WHERE {field} IS NOT NULL",
+            (json_path(field),)
+        )
+        self.conn.commit()
+        self.drop_column(field)
+
+    def drop_json_field(self, field, column=None):
+        """Removes a key from every row's overflow, and its generated column if there is one."""
+        if column:
+            self.drop_column(column)
+        if OVERFLOW_COLUMN not in self.existing_cols:
+            return
+        self.cursor.execute(
+            f"UPDATE {self.table_name} SET {OVERFLOW_COLUMN} = JSON_REMOVE({OVERFLOW_COLUMN}, %s) "
+            f"WHERE JSON_CONTAINS_PATH({OVERFLOW_COLUMN}, 'one', %s)",
+            (json_path(field), json_path(field))
+        )
+        self.conn.commit()
+
+    def find(self, filters, limit=10, json_filters=None):
+        """
+        Returns up to `limit` rows matching every column=value filter, and
+        every overflow key=value in json_filters, as dicts.
+        Runs on its own connection so queries never share the writer's cursor.
+        """
+        conditions = [f"{column} = %s" for column in filters]
+        params = list(filters.values())
+        for field, value in (json_filters or {}).items():
+            # Compared as JSON, so 1, "1" and true stay distinct
+            conditions.append(f"JSON_EXTRACT({OVERFLOW_COLUMN}, %s) = CAST(%s AS JSON)")
+            params += [json_path(field), json.dumps(value)]
+        where = ' AND '.join(conditions) or '1=1'
+        generated = set(self.generated_cols)
+        conn = mysql.connector.connect(**self.config)
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(f"SELECT * FROM {self.table_name} WHERE {where} LIMIT %s", [*params, limit])
+            return [unpack_row(row, generated) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+
+    def scan(self, start=None, end=None, batch_size=1000):
+        """
+        Yields rows as dicts in sys_ingested_at order, for start <= sys_ingested_at < end.
+        The cursor is unbuffered, so rows stay on the server until fetched,
+        batch_size at a time, on a connection of its own.
+        """
+        conditions, params = ["sys_ingested_at IS NOT NULL"], []
+        if start is not None:
+            conditions.append("sys_ingested_at >= %s")
+            params.append(start)
+        if end is not None:
+            conditions.append("sys_ingested_at < %s")
+            params.append(end)
+
+        generated = set(self.generated_cols)
+        # consume_results lets close() discard rows a caller stopped reading
+        conn = mysql.connector.connect(**self.config, consume_results=True)
+        try:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(
+                f"SELECT * FROM {self.table_name} WHERE {' AND '.join(conditions)} ORDER BY sys_ingested_at, id",
+                params
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield unpack_row(row, generated)
+        finally:
+            conn.close()
+
+    def ingested_range(self):
+        """Returns (oldest, newest) sys_ingested_at, or (None, None) for an empty table."""
+        conn = mysql.connector.connect(**self.config)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT MIN(sys_ingested_at), MAX(sys_ingested_at) FROM {self.table_name}")
+            return cursor.fetchone()
+        finally:
+            conn.close()
+
+    def fetch_older_than(self, cutoff, limit):
+        """Returns (rows as dicts, ids) for the oldest rows ingested before cutoff."""
+        cursor = self.conn.cursor(dictionary=True)
+        cursor.execute(
+            f"SELECT * FROM {self.table_name} WHERE sys_ingested_at < %s ORDER BY id LIMIT %s", (cutoff, limit)
+        )
+        rows = [unpack_row(row, self.generated_cols) for row in cursor.fetchall()]
+        cursor.close()
+        return rows, [row['id'] for row in rows]
+
+    def delete_rows(self, ids):
+        for i in range(0, len(ids), 1000):
+            chunk = ids[i:i + 1000]
+            self.cursor.execute(
+                f"DELETE FROM {self.table_name} WHERE id IN ({', '.join(['%s'] * len(chunk))})", chunk
+            )
+        self.conn.commit()
+
+    def drop_column(self, column):
+        if not hasattr(self, 'existing_cols'):
+            self._refresh_schema_cache()
+        if column not in self.existing_cols:
+            return
+
+        self.cursor.execute(f"ALTER TABLE {self.table_name} DROP COLUMN {column}")
+        self.conn.commit()
+        self.existing_cols.discard(column)
+        self.generated_cols.discard(column)
+        self.column_types.pop(column, None)
+
+    def indexes(self):
+        """Returns {index name: [columns in order]} for the table."""
+        self.cursor.execute(f"SHOW INDEX FROM {self.table_name}")
+        indexes = {}
+        for row in sorted(self.cursor.fetchall(), key=lambda r: (r[2], r[3])):
+            indexes.setdefault(row[2], []).append(row[4])
+        return indexes
+
+    def create_index(self, name, columns):
+        if not hasattr(self, 'existing_cols'):
+            self._refresh_schema_cache()
+
+        parts = [
+            f"{c}({TEXT_INDEX_PREFIX})" if self.column_types.get(c, '').endswith('text') else c
+            for c in columns
+        ]
+        try:
+            # In-place build: inserts keep flowing while the index is created
+            self.cursor.execute(
+                f"ALTER TABLE {self.table_name} ADD INDEX {name} ({', '.join(parts)}), ALGORITHM=INPLACE, LOCK=NONE"
+            )
+        except mysql.connector.Error as err:
+            print(f"Failed to create index {name}: {err}")
+
+    def drop_index(self, name):
+        try:
+            self.cursor.execute(f"ALTER TABLE {self.table_name} DROP INDEX {name}, ALGORITHM=INPLACE, LOCK=NONE")
+        except mysql.connector.Error as err:
+            print(f"Failed to drop index {name}: {err}")
+
     def insert_batch(self, records):
         if not records:
             return
@@ -73,13 +345,15 @@ class SQLHandler:
         if not hasattr(self, 'existing_cols'):
             self._refresh_schema_cache()
 
-        valid_columns = self.existing_cols
+        valid_columns = self.existing_cols - self.generated_cols
 
         for record in records:
             filtered_rec = {k: v for k, v in record.items() if k in valid_columns}
             
             if not filtered_rec:
                 continue
+            if OVERFLOW_COLUMN in filtered_rec:
+                filtered_rec[OVERFLOW_COLUMN] = json.dumps(filtered_rec[OVERFLOW_COLUMN])
 
             columns = ', '.join(filtered_rec.keys())
             placeholders = ', '.join(['%s'] * len(filtered_rec))
@@ -96,4 +370,19 @@ class SQLHandler:
 
     def close(self):
         if self.conn:
-            self.conn.close()
\ No newline at end of file
+            self.conn.close()
+
+def json_path(field):
+    return f'$."{field}"'
+
+def unpack_row(row, generated):
+    """Lifts overflow keys into the row as fields and leaves out generated columns."""
+    overflow = row.pop(OVERFLOW_COLUMN, None)
+    for column in generated:
+        row.pop(column, None)
+    if overflow:
+        if isinstance(overflow, (bytes, bytearray)):
+            overflow = overflow.decode()
+        for key, value in json.loads(overflow).items():
+            row.setdefault(key, value)
+    return row
\ No newline at end of file
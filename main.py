@@ -6,38 +6,110 @@ import threading
 import queue
 import time
 from datetime import datetime
+from urllib.parse import urlsplit
 
+from core.byte_queue import ByteBoundedQueue, estimate_size
+from core.change_feed import ChangeFeed
 from core.normalizer import Normalizer
-from core.analyzer import Analyzer
+from core.analyzer import Analyzer, SamplingPolicy
 from core.classifier import Classifier
+from core.cluster import ClusterMember
+from core.cold_tier import ColdTier
+from core.coordinator import ShardCoordinator
+from core.dedup import Deduplicator
+from core.field_registry import FieldRegistry
+from core.index_advisor import IndexAdvisor
 from core.query_engine import QueryEngine
+from core.rollups import Rollups
 from core.router import Router
+from core.tracing import SamplingProfiler, Tracer
+from core.wal import WriteAheadLog
 from db.sql_handler import SQLHandler
 from db.mongo_handler import MongoHandler
+from db.cluster_store import ClusterStore
+from db.rollup_store import RollupStore
+from config import FEED_DIR, FEED_RETAIN_BYTES, FEED_SEGMENT_BYTES, ROLLUPS, load_metadata, save_metadata
 
 BATCH_SIZE = 50
-METADATA_FILE = "metadata/schema_map.json"
-DATA_STREAM_URL = "http://127.0.0.1:8000/record/5000"
-MAX_QUEUE_SIZE = 1000
+# e.g. http://127.0.0.1:8000/record/100000?rate=0&batch=200&scenario=type_flip
+DATA_STREAM_URL = os.getenv("STREAM_URL", "http://127.0.0.1:8000/record/5000")
+# Queues are bounded by estimated record bytes; overflow spills to disk
+MAX_QUEUE_BYTES = 64 * 1024 * 1024
+SPILL_BYTES = 256 * 1024 * 1024
+SPILL_DIR = "data/spill"
+WAL_DIR = "data/wal"
+WAL_GROUP_SIZE = 500
+WAL_GROUP_INTERVAL = 0.05
+# Re-sent records are recognized by a Bloom filter persisted here
+DEDUP_PATH = "data/dedup/filter.bin"
+DEDUP_ERROR_RATE = 0.001
+DEDUP_CAPACITY = 1000000
+DEDUP_MAX_BYTES = 64 * 1024 * 1024
+DEDUP_SAVE_INTERVAL = 5.0
+NUM_PROCESSORS = 2
+MERGE_INTERVAL = 1.0
+# Processor threads share the GIL; SHARD_PROCESSES=1 analyzes each shard in its own process
+SHARD_PROCESSES = os.getenv("SHARD_PROCESSES", "0") == "1"
+# Processors analyze SAMPLE_FRACTION of each batch while the raw queue is over SAMPLE_HIGH_WATER
+# full or records wait SAMPLE_MAX_LAG seconds, until it drains below SAMPLE_LOW_WATER
+SAMPLE_HIGH_WATER = 0.5
+SAMPLE_LOW_WATER = 0.2
+SAMPLE_MAX_LAG = 2.0
+SAMPLE_FRACTION = 0.2
+INDEX_ADVISE_INTERVAL = 30.0
+# Fields the analyzer and classifier keep state for; rarely seen MongoDB-only ones are evicted past it
+FIELD_CAPACITY = 10000
+FIELD_SCORE_DECAY = 0.5
+FIELD_COMPACT_INTERVAL = 10.0
+# Stable scalars from this frequency up to the SQL band go to the JSON overflow column
+OVERFLOW_THRESHOLD = 0.5
+# Records older than this move to Parquet files under COLD_DIR
+COLD_DIR = "data/cold"
+COLD_AFTER_DAYS = 30
+COLD_INTERVAL = 3600.0
+# CLUSTER_MODE=1 lets several instances share the databases; each needs its own data/ and metadata/
+CLUSTER_MODE = os.getenv("CLUSTER_MODE") == "1"
+INSTANCE_ID = os.getenv("INSTANCE_ID")
+CLUSTER_LEASE_SECONDS = 10.0
+CLUSTER_SNAPSHOT_INTERVAL = 60.0
 STOP_EVENT = threading.Event()
+TRACER = Tracer()
 
-def load_metadata():
-    if os.path.exists(METADATA_FILE):
+def enqueue(raw_queue, item):
+    while not STOP_EVENT.is_set():
         try:
-            with open(METADATA_FILE, 'r') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            return {}
-    return {}
-
-def save_metadata(stats):
-    os.makedirs(os.path.dirname(METADATA_FILE), exist_ok=True)
-    with open(METADATA_FILE, 'w') as f:
-        json.dump(stats, f, indent=4)
-
-def ingest_worker(raw_queue, data_url):
+            raw_queue.put(item, timeout=1)
+            return
+        except queue.Full:
+            continue
+
+def save_dedup(wal, dedup):
+    # Flush first so the saved filter only holds keys of durable records
+    wal.flush()
+    dedup.save()
+
+def ingest_worker(raw_queue, data_url, wal, dedup):
+    replayed = committed_before = 0
+    for lsn, record, committed in wal.replay():
+        if STOP_EVENT.is_set():
+            break
+        # Logged after the filter was last saved; re-sends of it are duplicates too
+        dedup.add(record)
+        if committed:
+            # Already in both databases; acked above a gap in the checkpoint
+            committed_before += 1
+            continue
+        enqueue(raw_queue, (lsn, record))
+        replayed += 1
+    if replayed or committed_before:
+        print(
+            f"[Ingestor] Replayed {replayed} records from the write-ahead log "
+            f"({committed_before} already committed were skipped)."
+        )
+
     print(f"[Ingestor] Connecting to data stream at {data_url}...")
     normalizer = Normalizer()
+    last_save = time.time()
     
     try:
         response = requests.get(data_url, stream=True)
@@ -49,33 +121,44 @@ def ingest_worker(raw_queue, data_url):
             
             if event.data:
                 try:
-                    raw_record = json.loads(event.data)
-                    clean_record = normalizer.normalize_record(raw_record)
-                    
-                    try:
-                        raw_queue.put(clean_record, timeout=1) 
-                    except queue.Full:
-                        while raw_queue.full() and not STOP_EVENT.is_set():
-                            time.sleep(0.1)
-                        if not STOP_EVENT.is_set():
-                            raw_queue.put(clean_record)
-
+                    with TRACER.stage("ingest"):
+                        payload = json.loads(event.data)
                 except json.JSONDecodeError:
                     continue
+
+                # Batched events carry a list of records
+                raw_records = payload if event.event == "batch" else [payload]
+                for raw_record in raw_records:
+                    with TRACER.stage("normalize"):
+                        clean_record = normalizer.normalize_record(raw_record)
+                    with TRACER.stage("dedup"):
+                        duplicate = dedup.seen(clean_record)
+                    if duplicate:
+                        continue
+                    with TRACER.stage("ingest"):
+                        lsn = wal.append(clean_record)
+                    enqueue(raw_queue, (lsn, clean_record))
+
+                if time.time() - last_save >= DEDUP_SAVE_INTERVAL:
+                    save_dedup(wal, dedup)
+                    last_save = time.time()
                     
     except Exception as e:
         print(f"[Ingestor] Error: {e}")
     finally:
+        save_dedup(wal, dedup)
         print("[Ingestor] Thread stopping.")
 
-def process_worker(raw_queue, write_queue, analyzer, classifier):
+def process_worker(raw_queue, write_queue, shard, coordinator, sampling, wal):
     print("[Processor] Worker started.")
     buffer = []
+    lsns = []
     
     while not STOP_EVENT.is_set() or not raw_queue.empty():
         try:
-            record = raw_queue.get(timeout=1)
+            lsn, record = raw_queue.get(timeout=1)
             buffer.append(record)
+            lsns.append(lsn)
             raw_queue.task_done()
         except queue.Empty:
             pass
@@ -85,49 +168,83 @@ def process_worker(raw_queue, write_queue, analyzer, classifier):
                 continue
             
             try:
-                analyzer.analyze_batch(buffer)
-                stats = analyzer.get_schema_stats()
-                schema_decisions = classifier.decide_schema(stats)
+                # Spilled records mean the in-memory queue is already full
+                fill = 1.0 if raw_queue.spilled() else raw_queue.memory_bytes / raw_queue.max_bytes
+                ingested = buffer[0].get('sys_ingested_at')
+                lag = time.time() - ingested.timestamp() if isinstance(ingested, datetime) else 0.0
+                with TRACER.stage("analyze"):
+                    shard.analyze_batch(buffer, sampling.sample_size(len(buffer), fill, lag))
+                with TRACER.stage("classify"):
+                    epoch, schema_decisions = coordinator.maybe_merge()
 
+                # The router checkpoints the coordinator's latest snapshot; it stays out of the queue
                 payload = {
                     "batch": buffer,
                     "decisions": schema_decisions,
-                    "stats": analyzer.export_stats(),
-                    "classifier_decisions": classifier.export_decisions()
+                    "epoch": epoch,
+                    "lsns": lsns
                 }
                 write_queue.put(payload)
             except Exception as e:
                 print(f"[Processor] Error: {e}")
+                wal.dead_letter(lsns, buffer, e)
             
             buffer = []
+            lsns = []
     
     print("[Processor] Thread stopping.")
 
-def router_worker(write_queue, router):
+def router_worker(write_queue, router, wal, index_advisor, cold_tier, feed, coordinator):
     print("[Router] Worker started.")
     
     while not STOP_EVENT.is_set() or not write_queue.empty():
+        payload = None
         try:
             payload = write_queue.get(timeout=1)
             batch = payload['batch']
-            decisions = payload['decisions']
+            decisions = router.resolve_decisions(payload['decisions'], payload.get('epoch'))
             
-            router.sql_handler.update_schema(decisions)
-            router.process_batch(batch, decisions)
+            leads_schema = router.leads_schema
+            with TRACER.stage("schema_update"):
+                if leads_schema:
+                    router.sql_handler.update_schema(decisions)
+                else:
+                    # The lease holder alters the table; pick up the columns it added
+                    router.sql_handler.sync_schema(decisions)
+            placements = router.process_batch(batch, decisions, payload.get('lsns'))
+            if leads_schema:
+                with TRACER.stage("index_advice"):
+                    index_advisor.maybe_apply(router.sql_handler, router.previous_decisions)
+                with TRACER.stage("offload"):
+                    cold_tier.maybe_offload(router.sql_handler, router.mongo_handler, router.previous_decisions)
             
-            full_metadata = {
-                "analyzer": payload['stats'],
-                "classifier_decisions": payload.get('classifier_decisions', {}),
-                "router_decisions": router.export_decisions()
-            }
-            save_metadata(full_metadata)
+            with TRACER.stage("publish"):
+                # Before the ack: a crash in between republishes the batch rather than losing it
+                feed.publish(batch, placements, router.decision_epoch, payload.get('lsns', []))
+
+            with TRACER.stage("checkpoint"):
+                snapshot = coordinator.snapshot
+                full_metadata = {
+                    "analyzer": snapshot.get('stats', {}),
+                    "classifier_decisions": snapshot.get('classifier_decisions', {}),
+                    "router_decisions": router.export_decisions(),
+                    "index_predicates": index_advisor.export_predicates(),
+                    "field_registry": snapshot.get('field_registry')
+                }
+                save_metadata(full_metadata)
+                wal.ack(payload.get('lsns', []))
+            TRACER.observe_durable(batch)
             
             write_queue.task_done()
             
         except queue.Empty:
-            pass
+            router.idle()
         except Exception as e:
             print(f"[Router] Error: {e}")
+            if payload is not None:
+                # Parts of the batch may already be stored; the rest would block the checkpoint
+                wal.dead_letter(payload.get('lsns', []), payload['batch'], e)
+                write_queue.task_done()
 
     print("[Router] Thread stopping.")
 
@@ -138,7 +255,8 @@ def main():
     
     print("\n[1/4] Checking data stream availability...")
     try:
-        response = requests.get(DATA_STREAM_URL.replace('/record/5000', '/'), timeout=2)
+        stream = urlsplit(DATA_STREAM_URL)
+        response = requests.get(f"{stream.scheme}://{stream.netloc}/", timeout=2)
         print("      ✓ Data stream server is running")
     except requests.exceptions.RequestException:
         print("\n⚠️  WARNING: Simulation server not detected!")
@@ -146,15 +264,47 @@ def main():
         return
 
     print("\n[2/4] Initializing components...")
-    raw_queue = queue.Queue(maxsize=MAX_QUEUE_SIZE)
-    write_queue = queue.Queue(maxsize=MAX_QUEUE_SIZE)
+    raw_queue = ByteBoundedQueue(
+        MAX_QUEUE_BYTES, spill_path=os.path.join(SPILL_DIR, "raw.ring"), spill_bytes=SPILL_BYTES
+    )
+    write_queue = ByteBoundedQueue(
+        MAX_QUEUE_BYTES, spill_path=os.path.join(SPILL_DIR, "write.ring"), spill_bytes=SPILL_BYTES,
+        # A spilled payload pickles its decisions along with the batch
+        sizeof=lambda payload: estimate_size(payload['batch']) + estimate_size(payload['decisions'])
+    )
     
-    analyzer = Analyzer()
-    classifier = Classifier(lower_threshold=0.75, upper_threshold=0.85)
+    analyzer = Analyzer(columnar=True)
+    sampling = SamplingPolicy(
+        high_water=SAMPLE_HIGH_WATER, low_water=SAMPLE_LOW_WATER, max_lag=SAMPLE_MAX_LAG, fraction=SAMPLE_FRACTION
+    )
+    classifier = Classifier(lower_threshold=0.75, upper_threshold=0.85, overflow_threshold=OVERFLOW_THRESHOLD)
     
     sql_handler = SQLHandler() 
     mongo_handler = MongoHandler()
-    router = Router(sql_handler, mongo_handler)
+    cluster = None
+    if CLUSTER_MODE:
+        cluster = ClusterMember(
+            ClusterStore(sql_handler.config), instance_id=INSTANCE_ID,
+            lease_seconds=CLUSTER_LEASE_SECONDS, snapshot_interval=CLUSTER_SNAPSHOT_INTERVAL
+        )
+    wal = WriteAheadLog(WAL_DIR, group_size=WAL_GROUP_SIZE, group_interval=WAL_GROUP_INTERVAL)
+    rollup_store = RollupStore(sql_handler.config)
+    # Counts each WAL record once, even when a batch is replayed after a crash
+    rollups = Rollups(rollup_store, ROLLUPS, log=wal)
+    router = Router(sql_handler, mongo_handler, tracer=TRACER, cluster=cluster, rollups=rollups)
+    registry = FieldRegistry(capacity=FIELD_CAPACITY, decay=FIELD_SCORE_DECAY, interval=FIELD_COMPACT_INTERVAL)
+    coordinator = ShardCoordinator(
+        analyzer, classifier, merge_interval=MERGE_INTERVAL, cluster=cluster, registry=registry,
+        processes=SHARD_PROCESSES
+    )
+    index_advisor = IndexAdvisor(analyzer, interval=INDEX_ADVISE_INTERVAL)
+    cold_tier = ColdTier(COLD_DIR, analyzer, max_age_days=COLD_AFTER_DAYS, interval=COLD_INTERVAL)
+    dedup = Deduplicator(
+        DEDUP_PATH, error_rate=DEDUP_ERROR_RATE, initial_capacity=DEDUP_CAPACITY, max_bytes=DEDUP_MAX_BYTES
+    )
+    feed = ChangeFeed(
+        FEED_DIR, dedup.record_id, segment_bytes=FEED_SEGMENT_BYTES, retain_bytes=FEED_RETAIN_BYTES
+    )
     
     print("\n[3/4] Connecting to databases...")
     try:
@@ -163,6 +313,12 @@ def main():
     except Exception as e:
         print(f"      ✗ MySQL connection failed: {e}")
         return
+    try:
+        mongo_handler.ensure_indexes()
+        print("      ✓ MongoDB indexes ready")
+    except Exception as e:
+        print(f"      ✗ MongoDB setup failed: {e}")
+        return
 
 
     saved_metadata = load_metadata()
@@ -171,6 +327,8 @@ def main():
             analyzer.load_stats(saved_metadata['analyzer'])
             classifier.load_decisions(saved_metadata.get('classifier_decisions', {}))
             router.load_decisions(saved_metadata.get('router_decisions', {}))
+            index_advisor.load_predicates(saved_metadata.get('index_predicates', []))
+            registry.load_summary(saved_metadata.get('field_registry'))
             field_count = len(saved_metadata['analyzer'].get('field_stats', {}))
         else:
             analyzer.load_stats(saved_metadata)
@@ -180,16 +338,40 @@ def main():
     else:
         print("      ℹ Starting fresh (no previous metadata)")
 
+    if cluster is not None:
+        # Cluster-wide stats and decisions replace the local ones; the router keeps its own
+        # record of what it routed, so a later lease holder still sees the moves to migrate
+        try:
+            cluster.store.connect()
+            cluster.bootstrap(analyzer, classifier)
+            print(f"      ✓ Joined cluster as {cluster.instance_id}")
+        except Exception as e:
+            print(f"      ✗ Cluster store unavailable: {e}")
+            return
+
     print("\n[4/4] Starting worker threads...")
-    t_ingest = threading.Thread(target=ingest_worker, args=(raw_queue, DATA_STREAM_URL))
-    t_process = threading.Thread(target=process_worker, args=(raw_queue, write_queue, analyzer, classifier))
-    t_router = threading.Thread(target=router_worker, args=(write_queue, router))
+    t_ingest = threading.Thread(target=ingest_worker, args=(raw_queue, DATA_STREAM_URL, wal, dedup))
+    t_processors = [
+        threading.Thread(
+            target=process_worker, args=(raw_queue, write_queue, coordinator.create_shard(), coordinator, sampling, wal)
+        )
+        for _ in range(NUM_PROCESSORS)
+    ]
+    t_router = threading.Thread(
+        target=router_worker, args=(write_queue, router, wal, index_advisor, cold_tier, feed, coordinator)
+    )
 
     t_ingest.start()
-    t_process.start()
+    for t_process in t_processors:
+        t_process.start()
     t_router.start()
 
-    query_engine = QueryEngine(analyzer, raw_queue)
+    profiler = SamplingProfiler()
+    query_engine = QueryEngine(
+        analyzer, raw_queue, tracer=TRACER, profiler=profiler, router=router, classifier=classifier,
+        index_advisor=index_advisor, dedup=dedup, cold_tier=cold_tier, sampling=sampling, registry=registry,
+        feed=feed, rollups=rollups
+    )
 
     print("\n" + "="*60)
     print("  SYSTEM READY")
@@ -199,6 +381,15 @@ def main():
     print("  • stats <field>    - Display detailed analysis for a specific field")
     print("  • all_stats        - View statistics for all tracked fields")
     print("  • queue            - Check current queue sizes")
+    print("  • find f=v [...]   - Query records by field value")
+    print("  • why <field>      - Explain a field's placement")
+    print("  • indexes          - Index advisor candidates and budgets")
+    print("  • cold             - Parquet cold-tier files and sizes")
+    print("  • export <dir>     - Write rejoined records to NDJSON/Arrow files")
+    print("  • feed             - Change feed offset and retained segments")
+    print("  • rollup <name> <user> - Per-user summary rows, e.g. hourly averages")
+    print("  • trace            - Per-stage timings and ingest-to-durable latency")
+    print("  • profile start|stop - Sample all threads into a flamegraph file")
     print("  • help             - Show detailed command help")
     print("  • exit             - Shut down the system gracefully\n")
     
@@ -218,12 +409,33 @@ def main():
         STOP_EVENT.set()
     finally:
         print("Stopping worker threads...")
+        profiler.stop()
         t_ingest.join()
-        t_process.join()
+        for t_process in t_processors:
+            t_process.join()
         t_router.join()
+
+        # Fold in whatever the shards analyzed since the last merge
+        coordinator.close()
+        coordinator.merge()
+        save_metadata({
+            "analyzer": analyzer.export_stats(),
+            "classifier_decisions": classifier.export_decisions(),
+            "router_decisions": router.export_decisions(),
+            "index_predicates": index_advisor.export_predicates(),
+            "field_registry": registry.export_summary()
+        })
         
+        if cluster is not None:
+            cluster.leave()
+            cluster.store.close()
+        rollup_store.close()
         sql_handler.close()
         mongo_handler.close()
+        raw_queue.close()
+        write_queue.close()
+        feed.close()
+        wal.close()
         print("✓ Shutdown complete.\n")
 
 if __name__ == "__main__":
@@ -100,14 +100,76 @@ def generate_record():
         
     return record
 
+# Drift scenarios: each one rewrites a record once the stream is past `drift_at`.
+# They target fields whose seeded weights place them near or in SQL.
+def _type_flip(record):
+    if "spo2" in record:
+        record["spo2"] = f"{record['spo2']}%"
+
+def _frequency_gain(record):
+    record.setdefault("subscription", FIELD_POOL["subscription"]())
+
+def _frequency_loss(record):
+    record.pop("purchase_value", None)
+
+def _new_nested_key(record):
+    metadata = record.setdefault("metadata", {})
+    metadata["firmware"] = {"build": random.randint(100, 120), "channel": random.choice(["stable", "beta"])}
+
+SCENARIOS = {
+    "type_flip": _type_flip,
+    "frequency_gain": _frequency_gain,
+    "frequency_loss": _frequency_loss,
+    "new_nested_key": _new_nested_key
+}
+
+def generate_scenario_record(index, count, scenario=None, drift_at=0.5):
+    record = generate_record()
+    if scenario and index >= count * drift_at:
+        SCENARIOS[scenario](record)
+    return record
+
 @app.get("/")
 async def single_record():
     return generate_record()
 
 @app.get("/record/{count}")
-async def stream_records(count: int):
+async def stream_records(count: int, rate: float = 100.0, batch: int = 1,
+                         scenario: str = None, drift_at: float = 0.5, seed: int = None):
+    """
+    Streams `count` records at about `rate` records/sec (0 = as fast as
+    possible). With batch > 1, each SSE event ("batch") carries a JSON list
+    of up to `batch` records. `scenario` applies a drift from SCENARIOS
+    after `drift_at` of the stream; `seed` makes the stream reproducible.
+    """
+    if scenario and scenario not in SCENARIOS:
+        return {"error": f"Unknown scenario '{scenario}'", "scenarios": sorted(SCENARIOS)}
+
+    batch = max(1, batch)
+
     async def event_generator():
-        for _ in range(count):
-            await asyncio.sleep(0.01)
-            yield {"event": "record", "data": json.dumps(generate_record())}
+        if seed is not None:
+            random.seed(seed)
+            faker.seed_instance(seed)
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        sent = 0
+        while sent < count:
+            size = min(batch, count - sent)
+            records = [generate_scenario_record(sent + i, count, scenario, drift_at) for i in range(size)]
+            sent += size
+
+            if batch == 1:
+                yield {"event": "record", "data": json.dumps(records[0])}
+            else:
+                yield {"event": "batch", "data": json.dumps(records)}
+
+            if rate > 0:
+                # Pace against the stream start so sleep overshoot doesn't accumulate
+                delay = start + sent / rate - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    await asyncio.sleep(0)
     return EventSourceResponse(event_generator())
@@ -0,0 +1,45 @@
+"""
+Prints committed batches from the change feed as NDJSON, one batch per line.
+
+Usage:
+    python tail_feed.py [--directory data/feed] [--from OFFSET | --offset-file PATH]
+                        [--follow] [--max-records N]
+
+With --offset-file, the offset of every printed batch is saved there, so
+the next run resumes after it.
+"""
+import argparse
+import json
+import sys
+
+from core.change_feed import FeedReader
+from config import FEED_DIR
+
+def tail_feed():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--directory", default=FEED_DIR)
+    start = parser.add_mutually_exclusive_group()
+    start.add_argument("--from", dest="offset", type=int, default=0, help="last offset already consumed")
+    start.add_argument("--offset-file", help="reads and saves the consumed offset")
+    parser.add_argument("--follow", action="store_true", help="keep waiting for new batches")
+    parser.add_argument("--max-records", type=int, default=1000, help="records read per poll")
+    parser.add_argument("--interval", type=float, default=0.5, help="seconds between polls when caught up")
+    args = parser.parse_args()
+
+    reader = FeedReader(args.directory, offset=args.offset, offset_path=args.offset_file)
+    if args.follow:
+        polls = reader.follow(args.max_records, args.interval)
+    else:
+        polls = iter(lambda: reader.poll(args.max_records), [])
+
+    try:
+        for batches in polls:
+            for batch in batches:
+                sys.stdout.write(json.dumps(batch) + "\n")
+            sys.stdout.flush()
+            reader.commit()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    tail_feed()
@@ -0,0 +1,96 @@
+import random
+from datetime import datetime, timedelta
+
+from core.analyzer import Analyzer, SamplingPolicy
+
+KEYS = ("count", "null_count", "detected_type", "types", "min", "max", "max_length", "is_nested", "unique_ratio")
+
+def _batch(size, seed=7):
+    rng = random.Random(seed)
+    base = datetime(2024, 1, 1)
+    batch = []
+    for i in range(size):
+        record = {"sys_ingested_at": base + timedelta(seconds=i), "username": f"user_{rng.randint(0, 50)}"}
+        if rng.random() < 0.8:
+            record["age"] = rng.randint(18, 70)
+        if rng.random() < 0.5:
+            record["score"] = rng.choice([1, 1.0, True, 2.5, None, "n/a"])
+        if rng.random() < 0.4:
+            record["item"] = rng.choice(["book", "phone", None])
+        if rng.random() < 0.3:
+            record["metadata"] = {"is_bot": rng.random() < 0.5, "sensor": {"version": rng.randint(1, 3)}}
+        batch.append(record)
+    return batch
+
+def _summary(analyzer):
+    return {field: {key: stats[key] for key in KEYS} for field, stats in analyzer.get_schema_stats().items()}
+
+def test_row_and_columnar_analysis_agree():
+    batch = _batch(2000)
+    rows, columns = Analyzer(columnar=False), Analyzer(columnar=True)
+    for i in range(0, len(batch), 100):
+        rows.analyze_batch(batch[i:i + 100])
+        columns.analyze_batch(batch[i:i + 100])
+    assert _summary(rows) == _summary(columns)
+
+def test_equal_values_of_different_types_are_distinct():
+    for columnar in (False, True):
+        analyzer = Analyzer(columnar=columnar)
+        analyzer.analyze_batch([{"flag": 1}, {"flag": 1.0}, {"flag": True}])
+        assert analyzer.field_stats["flag"].sketch.count() == 3
+
+def test_merged_shards_match_one_analyzer():
+    batch = _batch(1500)
+    whole, merged = Analyzer(columnar=True), Analyzer(columnar=True)
+    shards = [Analyzer(columnar=True) for _ in range(3)]
+    for i in range(0, len(batch), 100):
+        whole.analyze_batch(batch[i:i + 100])
+        shards[i // 100 % 3].analyze_batch(batch[i:i + 100])
+    for shard in shards:
+        merged.merge_stats(shard.drain_stats())
+
+    assert merged.total_records_processed == whole.total_records_processed
+    assert _summary(merged) == _summary(whole)
+
+def test_drain_resets_the_shard_and_the_path_cap_holds_when_merged():
+    merged, shard = Analyzer(max_nested_paths=2), Analyzer(max_nested_paths=2)
+    shard.analyze_batch([{"m": {"a": 1, "b": 2, "c": 3}}])
+    merged.merge_stats(shard.drain_stats())
+    assert (shard.field_stats, shard.nested_paths, shard.dropped_path_values) == ({}, set(), 0)
+
+    shard.analyze_batch([{"m": {"d": 4}}])
+    merged.merge_stats(shard.drain_stats())
+    assert merged.nested_paths == {"m.a", "m.b"}
+    assert merged.dropped_path_values == 2
+
+def test_nulls_leave_a_field_stable_and_nullable():
+    for columnar in (False, True):
+        analyzer = Analyzer(columnar=columnar)
+        analyzer.analyze_batch([{"item": "book"}, {"item": None}, {"item": "phone"}, {"only_null": None}])
+        stats = analyzer.get_schema_stats()
+        item = stats["item"]
+        assert item["type_stability"] == "stable"
+        assert (item["detected_type"], item["nullable"], item["null_count"]) == ("str", True, 1)
+        assert stats["only_null"]["detected_type"] == "NoneType"
+
+def test_sampled_counts_scale_to_the_whole_batch():
+    random.seed(11)
+    batch = [{"a": i, **({"b": i} if i % 10 < 3 else {})} for i in range(1000)]
+    analyzer = Analyzer(columnar=True)
+    analyzer.analyze_batch(batch, sample_size=200)
+
+    stats = analyzer.get_schema_stats()
+    assert analyzer.total_records_processed == analyzer.sampled_records == 1000
+    assert stats["a"]["count"] == 1000
+    assert (stats["a"]["frequency_ratio"], stats["a"]["frequency_error"]) == (1.0, 0.0)
+    assert 0 < stats["b"]["frequency_error"] < 0.1
+    assert abs(stats["b"]["frequency_ratio"] - 0.3) <= 2 * stats["b"]["frequency_error"]
+
+def test_sampling_starts_under_load_and_stops_once_it_drops():
+    policy = SamplingPolicy(high_water=0.5, low_water=0.2, max_lag=2.0, fraction=0.2)
+    assert policy.sample_size(100, fill=0.1, lag=0.0) is None
+    assert policy.sample_size(100, fill=0.6, lag=0.0) == 20
+    # Between the water marks the policy keeps what it was doing
+    assert policy.sample_size(100, fill=0.3, lag=0.0) == 20
+    assert policy.sample_size(100, fill=0.1, lag=0.5) is None
+    assert policy.sample_size(100, fill=0.0, lag=3.0) == 20
@@ -0,0 +1,80 @@
+from datetime import datetime
+
+from db.bucket_layout import BucketLayout, KeyDictionary
+
+def _bucket(layout, records, partials=()):
+    bodies = []
+    for batch, partial in ((records, False), (list(partials), True)):
+        for _, update in layout.updates(batch, partial=partial):
+            bodies.extend(update["$push"]["r"]["$each"])
+    return {"u": "a", "r": bodies}
+
+def test_records_round_trip_through_codes():
+    layout = BucketLayout(KeyDictionary())
+    ts = datetime(2024, 1, 1, 0, 0, 5, 250000)
+    record = {"username": "a", "sys_ingested_at": ts, "metadata": {"sensor": {"version": 2}}, "tags": [{"k": 1}]}
+
+    bucket = _bucket(layout, [record])
+    assert "metadata" not in bucket["r"][0]
+    assert layout.expand(bucket) == [record]
+
+def test_records_with_only_shared_keys_are_not_stored():
+    layout = BucketLayout(KeyDictionary())
+    assert layout.updates([{"username": "a", "sys_ingested_at": datetime(2024, 1, 1), "timestamp": "t"}]) == []
+
+def test_partial_joins_the_record_with_the_same_time():
+    layout = BucketLayout(KeyDictionary())
+    first = datetime(2024, 1, 1, 0, 0, 5, 100000)
+    second = datetime(2024, 1, 1, 0, 0, 5, 300000)
+    records = [
+        {"username": "a", "sys_ingested_at": first, "x": 1},
+        {"username": "a", "sys_ingested_at": second, "x": 2}
+    ]
+    partials = [{"username": "a", "sys_ingested_at": second, "spo2": 97}]
+
+    expanded = layout.expand(_bucket(layout, records, partials))
+    assert [r.get("spo2") for r in expanded] == [None, 97]
+
+def test_whole_second_partial_falls_back_to_the_nearest_record():
+    layout = BucketLayout(KeyDictionary())
+    records = [{"username": "a", "sys_ingested_at": datetime(2024, 1, 1, 0, 0, 4, 700000), "x": 1}]
+    partials = [{"username": "a", "sys_ingested_at": datetime(2024, 1, 1, 0, 0, 5), "spo2": 95}]
+
+    expanded = layout.expand(_bucket(layout, records, partials))
+    assert expanded == [dict(records[0], spo2=95)]
+
+def test_partial_without_a_record_is_kept():
+    layout = BucketLayout(KeyDictionary())
+    records = [{"username": "a", "sys_ingested_at": datetime(2024, 1, 1, 0, 0, 5, 100000), "x": 1}]
+    partials = [{"username": "a", "sys_ingested_at": datetime(2024, 1, 1, 0, 0, 9, 100000), "spo2": 95}]
+
+    expanded = layout.expand(_bucket(layout, records, partials))
+    assert len(expanded) == 2
+    assert expanded[1]["spo2"] == 95
+
+def test_full_buckets_open_a_new_one():
+    layout = BucketLayout(KeyDictionary(), max_bucket_records=2)
+    ts = datetime(2024, 1, 1, 0, 0, 5)
+    pairs = layout.updates([{"username": "a", "sys_ingested_at": ts, "x": i} for i in range(5)])
+    assert [update["$inc"]["n"] for _, update in pairs] == [2, 2, 1]
+    assert all(query["n"] == {"$lt": 2} for query, _ in pairs)
+
+def test_partial_in_a_sibling_bucket_joins_its_record():
+    layout = BucketLayout(KeyDictionary(), max_bucket_records=1)
+    first = datetime(2024, 1, 1, 0, 0, 5, 100000)
+    second = datetime(2024, 1, 1, 0, 0, 5, 300000)
+    records = [
+        {"username": "a", "sys_ingested_at": first, "x": 1},
+        {"username": "a", "sys_ingested_at": second, "x": 2}
+    ]
+    partials = [{"username": "a", "sys_ingested_at": first, "spo2": 97}]
+    bucket = layout.bucket_start(first)
+    docs = [
+        {"u": "a", "b": bucket, "r": update["$push"]["r"]["$each"]}
+        for batch, partial in ((records, False), (partials, True))
+        for _, update in layout.updates(batch, partial=partial)
+    ]
+    assert len(docs) == 3
+
+    expanded = layout.expand_groups(docs)
+    assert [(r["x"], r.get("spo2")) for r in expanded] == [(1, 97), (2, None)]
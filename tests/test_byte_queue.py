@@ -0,0 +1,50 @@
+import queue
+
+import pytest
+
+from core.byte_queue import ByteBoundedQueue, SpillRing
+
+def test_ring_wraps_around_its_end(tmp_path):
+    ring = SpillRing(str(tmp_path / "ring"), 64)
+    written = []
+    for i in range(20):
+        data = bytes([i]) * (10 + i % 7)
+        assert ring.can_fit(len(data))
+        ring.write(data)
+        written.append(data)
+        if ring.count > 2:
+            assert ring.read() == written.pop(0)
+    while written:
+        assert ring.read() == written.pop(0)
+    assert ring.used == 0
+    ring.close()
+
+def test_ring_refuses_what_it_cannot_hold(tmp_path):
+    ring = SpillRing(str(tmp_path / "ring"), 32)
+    assert not ring.can_fit(32)
+    ring.write(b"x" * 20)
+    assert not ring.can_fit(10)
+    ring.close()
+
+def test_queue_spills_past_its_budget_and_keeps_order(tmp_path):
+    q = ByteBoundedQueue(20, spill_path=str(tmp_path / "spill"), spill_bytes=4096, sizeof=lambda item: 10)
+    for i in range(10):
+        q.put({"n": i}, block=False)
+    assert q.memory_bytes == 20
+    assert q.spilled() == 8
+
+    # Memory frees up, but later items still queue behind the spilled ones
+    assert q.get(block=False) == {"n": 0}
+    q.put({"n": 10}, block=False)
+    assert [q.get(block=False)["n"] for _ in range(10)] == list(range(1, 11))
+    assert q.empty()
+    q.close()
+
+def test_queue_without_room_raises_full(tmp_path):
+    q = ByteBoundedQueue(10, spill_path=str(tmp_path / "spill"), spill_bytes=64, sizeof=lambda item: 10)
+    q.put(b"a", block=False)
+    with pytest.raises(queue.Full):
+        while True:
+            q.put(b"b" * 16, block=False)
+    assert q.spilled() >= 1
+    q.close()
@@ -0,0 +1,54 @@
+import os
+
+from core.change_feed import ChangeFeed, FeedReader
+
+def _publish(feed, count, start=0):
+    for i in range(start, start + count):
+        batch = [{"username": f"u{i}", "n": i}]
+        feed.publish(batch, [(("n",), ())], epoch=1, lsns=[i + 1])
+
+def _feed(path, **options):
+    return ChangeFeed(str(path), lambda record: record["username"], **options)
+
+def test_reader_resumes_after_its_committed_offset(tmp_path):
+    feed = _feed(tmp_path / "feed", segment_bytes=300)
+    _publish(feed, 6)
+    offset_path = str(tmp_path / "consumer" / "offset")
+
+    reader = FeedReader(str(tmp_path / "feed"), offset_path=offset_path)
+    assert [b["offset"] for b in reader.poll(max_records=4)] == [1, 2, 3, 4]
+    reader.commit()
+    # Read past the commit but never committed: delivered again after a restart
+    reader.poll(max_records=1)
+
+    resumed = FeedReader(str(tmp_path / "feed"), offset_path=offset_path)
+    _publish(feed, 2, start=6)
+    batches = resumed.poll()
+    assert [b["offset"] for b in batches] == [5, 6, 7, 8]
+    assert batches[0]["records"][0]["id"] == "u4"
+    assert batches[0]["placements"] == [{"sql": ["n"], "mongo": []}]
+    assert resumed.poll() == []
+    feed.close()
+
+def test_feed_continues_offsets_after_a_torn_tail(tmp_path):
+    feed = _feed(tmp_path)
+    _publish(feed, 3)
+    feed.close()
+    with open(feed.segment_path, 'ab') as f:
+        f.write(b'{"offset": 4, "epo')
+
+    reopened = _feed(tmp_path)
+    _publish(reopened, 1, start=3)
+    assert [b["offset"] for b in FeedReader(str(tmp_path)).poll()] == [1, 2, 3, 4]
+    reopened.close()
+
+def test_reader_skips_to_the_oldest_retained_offset(tmp_path):
+    feed = _feed(tmp_path, segment_bytes=200, retain_bytes=400)
+    _publish(feed, 10)
+    oldest = min(int(name[5:-7]) for name in os.listdir(tmp_path))
+    assert oldest > 1
+
+    batches = FeedReader(str(tmp_path)).poll()
+    assert batches[0]["offset"] == oldest
+    assert batches[-1]["offset"] == 10
+    feed.close()
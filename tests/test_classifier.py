@@ -0,0 +1,52 @@
+from core.classifier import Classifier
+
+def _metrics(detected_type, frequency_ratio=1.0, count=1000, types=None, nullable=False):
+    return {
+        "detected_type": detected_type,
+        "frequency_ratio": frequency_ratio,
+        "count": count,
+        "types": types or [detected_type],
+        "type_stability": "unstable" if types and len(types) > 1 else "stable",
+        "is_nested": False,
+        "nullable": nullable
+    }
+
+def test_promoted_subpath_accepts_only_its_column_type():
+    decision = Classifier().decide_schema({"metadata.version": _metrics("int")})["metadata.version"]
+    assert decision["target"] == "SQL"
+    assert decision["promoted_from"] == "metadata"
+    assert decision["value_types"] == ["bool", "int"]
+
+def test_nullable_field_is_a_nullable_column():
+    decision = Classifier().decide_schema({"item": _metrics("str", nullable=True)})["item"]
+    assert (decision["target"], decision["sql_type"], decision["nullable"]) == ("SQL", "TEXT", True)
+
+def test_mixed_numbers_widen_to_the_broadest_type():
+    decision = Classifier().decide_schema({"score": _metrics("mixed", types=["bool", "int", "float"])})["score"]
+    assert (decision["target"], decision["sql_type"]) == ("SQL", "FLOAT")
+    assert "float" in decision["value_types"]
+
+def test_real_type_conflicts_stay_in_mongo():
+    decision = Classifier().decide_schema({"code": _metrics("mixed", types=["int", "str"])})["code"]
+    assert decision["target"] == "MONGO"
+
+def test_move_waits_out_the_minimum_dwell():
+    classifier = Classifier(min_dwell_seconds=60)
+    classifier.decide_schema({"age": _metrics("int", frequency_ratio=0.5)})
+    assert classifier.decide_schema({"age": _metrics("int", frequency_ratio=0.9)})["age"]["target"] == "SQL"
+
+    held = classifier.decide_schema({"age": _metrics("int", frequency_ratio=0.5)})["age"]
+    assert held["target"] == "SQL"
+    assert "minimum dwell" in classifier.decision_reasons["age"]["reason"]
+
+def test_move_out_of_sql_needs_a_benefit_above_its_cost():
+    cheap = Classifier()
+    cheap.decide_schema({"age": _metrics("int", count=100)})
+    assert cheap.decide_schema({"age": _metrics("int", frequency_ratio=0.5, count=200)})["age"]["target"] == "MONGO"
+
+    costly = Classifier()
+    costly.decide_schema({"age": _metrics("int", count=100)})
+    decision = costly.decide_schema({"age": _metrics("int", frequency_ratio=0.5, count=1000000)})["age"]
+    assert decision["target"] == "SQL"
+    reason = costly.decision_reasons["age"]
+    assert reason["cost"] > reason["benefit"]
@@ -0,0 +1,53 @@
+import math
+import random
+from datetime import datetime
+
+from core.dedup import Deduplicator, ScalableBloomFilter
+
+def _keys(count, seed):
+    rng = random.Random(seed)
+    return [(rng.getrandbits(64), rng.getrandbits(64) | 1) for _ in range(count)]
+
+def test_false_positive_rate_stays_under_the_bound_as_filters_grow():
+    bloom = ScalableBloomFilter(initial_capacity=1000, error_rate=0.01)
+    for h1, h2 in _keys(30000, seed=1):
+        bloom.add(h1, h2)
+    assert len(bloom.filters) > 3
+
+    probes = _keys(50000, seed=2)
+    rate = sum(bloom.contains(h1, h2) for h1, h2 in probes) / len(probes)
+    # The bound holds in expectation; allow three standard errors of sampling noise
+    assert rate <= 0.01 + 3 * math.sqrt(0.01 * 0.99 / len(probes))
+
+def test_every_added_key_is_found():
+    bloom = ScalableBloomFilter(initial_capacity=500, error_rate=0.001)
+    keys = _keys(5000, seed=3)
+    for h1, h2 in keys:
+        bloom.add(h1, h2)
+    assert all(bloom.contains(h1, h2) for h1, h2 in keys)
+
+def test_memory_cap_forgets_the_oldest_keys():
+    bloom = ScalableBloomFilter(initial_capacity=1000, error_rate=0.01, max_bytes=8 * 1024)
+    for h1, h2 in _keys(20000, seed=4):
+        bloom.add(h1, h2)
+    assert bloom.nbytes <= 8 * 1024
+    assert bloom.forgotten > 0
+    assert bloom.count + bloom.forgotten == 20000
+
+def test_record_id_ignores_pipeline_fields():
+    dedup = Deduplicator("unused")
+    record = {"username": "a", "heart_rate": 70}
+    stamped = dict(record, sys_ingested_at=datetime(2024, 1, 1))
+    assert dedup.record_id(record) == dedup.record_id(stamped)
+    assert dedup.record_id(record) != dedup.record_id({"username": "a", "heart_rate": 71})
+
+def test_seen_state_survives_a_save(tmp_path):
+    path = str(tmp_path / "filter.bin")
+    dedup = Deduplicator(path, initial_capacity=1000)
+    assert not dedup.seen({"username": "a"})
+    assert dedup.seen({"username": "a"})
+    dedup.save()
+
+    reloaded = Deduplicator(path, initial_capacity=1000)
+    assert reloaded.seen({"username": "a"})
+    assert not reloaded.seen({"username": "b"})
@@ -0,0 +1,54 @@
+from datetime import datetime
+
+from core.export import Exporter
+
+DECISIONS = {
+    "a": {"target": "SQL", "sql_type": "INT"},
+    "note": {"target": "MONGO"},
+}
+
+class _Store:
+    def __init__(self, records):
+        self.records = records
+
+    def scan(self, start, end, batch_size):
+        return iter(sorted(self.records, key=lambda r: r["sys_ingested_at"]))
+
+def _ts(second, millis=0):
+    return datetime(2024, 1, 1, 12, 0, second, millis * 1000)
+
+def _export(rows, docs):
+    return list(Exporter(_Store(rows), _Store(docs), DECISIONS).records())
+
+def test_document_joins_the_row_with_its_exact_time():
+    rows = [
+        {"id": 1, "username": "u", "sys_ingested_at": _ts(0, 100), "a": 1},
+        {"id": 2, "username": "u", "sys_ingested_at": _ts(0, 300), "a": 2},
+    ]
+    docs = [{"username": "u", "sys_ingested_at": _ts(0, 300), "note": "x"}]
+    records = _export(rows, docs)
+    assert len(records) == 2
+    first, second = sorted(records, key=lambda r: r["a"])
+    assert first == {"username": "u", "sys_ingested_at": _ts(0, 100), "a": 1}
+    assert second == {"username": "u", "sys_ingested_at": _ts(0, 300), "a": 2, "note": "x"}
+
+def test_documents_of_other_users_stay_apart():
+    rows = [{"id": 1, "username": "u", "sys_ingested_at": _ts(0, 100), "a": 1}]
+    docs = [{"username": "v", "sys_ingested_at": _ts(0, 100), "note": "x"}]
+    records = _export(rows, docs)
+    assert {"username": "u", "sys_ingested_at": _ts(0, 100), "a": 1} in records
+    assert {"username": "v", "sys_ingested_at": _ts(0, 100), "note": "x"} in records
+
+def test_legacy_whole_second_row_joins_within_half_a_second():
+    rows = [{"id": 1, "username": "u", "sys_ingested_at": _ts(1), "a": 1}]
+    docs = [{"username": "u", "sys_ingested_at": _ts(0, 700), "note": "x"}]
+    assert _export(rows, docs) == [
+        {"username": "u", "sys_ingested_at": _ts(1), "a": 1, "note": "x"}
+    ]
+
+def test_join_keeps_the_row_time():
+    rows = [{"id": 1, "username": "u", "sys_ingested_at": _ts(1), "a": 1}]
+    docs = [{"username": "u", "sys_ingested_at": _ts(1, 200), "note": "x"}]
+    [record] = _export(rows, docs)
+    assert record["sys_ingested_at"] == _ts(1)
+    assert record["note"] == "x"
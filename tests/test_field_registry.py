@@ -0,0 +1,36 @@
+from core.analyzer import Analyzer
+from core.classifier import Classifier
+from core.field_registry import FieldRegistry
+
+def _analyzer():
+    analyzer = Analyzer(columnar=True)
+    batch = [{"username": "a", "age": i} for i in range(50)]
+    batch += [{f"sensor_{i}": i} for i in range(20)]
+    batch += [{"rare_sql": 1}, {"rare_queried": 1}]
+    analyzer.analyze_batch(batch)
+    return analyzer
+
+def test_coldest_mongo_only_fields_are_evicted_down_to_capacity():
+    analyzer, classifier = _analyzer(), Classifier()
+    classifier.previous_decisions["rare_sql"] = {"target": "SQL"}
+    classifier.record_access(["rare_queried"])
+    registry = FieldRegistry(capacity=10, headroom=0.0)
+
+    victims = registry.compact(analyzer, classifier)
+    assert len(victims) == 14
+    assert all(key.startswith("sensor_") for key in victims)
+    assert {"username", "age", "rare_sql", "rare_queried"} <= set(analyzer.field_stats)
+    assert len(analyzer.field_stats) == registry.tracked == 10
+
+def test_evicted_keys_survive_as_a_summary():
+    analyzer, classifier = _analyzer(), Classifier()
+    registry = FieldRegistry(capacity=10, headroom=0.0)
+    victims = registry.compact(analyzer, classifier)
+
+    summary = registry.export_summary()
+    assert summary["evicted"] == len(victims)
+    assert summary["shapes"]["sensor_#"] == sum(key.startswith("sensor_") for key in victims)
+
+    reloaded = FieldRegistry(capacity=10)
+    reloaded.load_summary(summary)
+    assert reloaded.export_summary() == summary
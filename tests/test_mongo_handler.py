@@ -0,0 +1,56 @@
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError, OperationFailure
+
+import db.mongo_handler as mongo_handler
+from db.mongo_handler import MongoHandler
+
+class _Collection:
+    def __init__(self, failures):
+        self.failures = list(failures)
+        self.calls = []
+
+    def insert_many(self, docs, ordered=True):
+        self.calls.append(list(docs))
+        if self.failures:
+            raise self.failures.pop(0)
+
+    def create_index(self, keys, **kwargs):
+        self.calls.append(keys)
+        if self.failures:
+            raise self.failures.pop(0)
+
+@pytest.fixture
+def handler(monkeypatch):
+    monkeypatch.setenv("MONGO_URI", "mongodb://localhost:1")
+    monkeypatch.setenv("MONGO_LAYOUT", "document")
+    monkeypatch.setattr(mongo_handler, "RETRY_BACKOFF", 0)
+    # The client connects lazily, so nothing here touches the network
+    handler = MongoHandler()
+    yield handler
+    handler.close()
+
+def test_insert_retries_only_transient_failures(handler):
+    docs = [{"n": 0}, {"n": 1}, {"n": 2}]
+    handler.collection = _Collection([BulkWriteError({"writeErrors": [
+        {"index": 0, "code": 11000, "errmsg": "duplicate"},
+        {"index": 1, "code": 91, "errmsg": "shutting down"},
+        {"index": 2, "code": 121, "errmsg": "failed validation"}
+    ]})])
+    handler._insert_chunk(docs)
+    assert handler.collection.calls == [docs, [{"n": 1}]]
+
+def test_insert_gives_up_after_the_retry_budget(handler):
+    handler.collection = _Collection([AutoReconnect("down")] * 10)
+    handler._insert_chunk([{"n": 0}])
+    assert len(handler.collection.calls) == mongo_handler.INSERT_RETRIES + 1
+
+def test_index_creation_retries_transient_errors(handler):
+    handler.collection = _Collection([AutoReconnect("down"), OperationFailure("stepping down", code=189)])
+    handler.ensure_indexes()
+    assert handler.collection.calls == ["sys_ingested_at"] * 3
+
+def test_index_creation_raises_lasting_errors(handler):
+    handler.collection = _Collection([OperationFailure("bad options", code=67)])
+    with pytest.raises(OperationFailure):
+        handler.ensure_indexes()
+    assert len(handler.collection.calls) == 1
@@ -0,0 +1,126 @@
+from datetime import datetime
+
+import pytest
+
+from benchmarks.stand_ins import SQLiteRollupStore
+from core.rollups import MAX_KEY_LENGTH, Rollup, Rollups
+from core.wal import WriteAheadLog
+
+HOURLY = {
+    "name": "hourly",
+    "bucket": "hour",
+    "aggregates": {
+        "readings": ["count", "hr"],
+        "records": ["count", None],
+        "hr_sum": ["sum", "hr"],
+        "hr_min": ["min", "hr"],
+        "hr_max": ["max", "hr"],
+        "hr_avg": ["avg", "hr"],
+        "device": ["latest", "device"]
+    }
+}
+
+def _record(minute, hr=None, device=None, **extra):
+    record = {"username": "a", "timestamp": datetime(2024, 1, 1, 9, minute).isoformat(), **extra}
+    if hr is not None:
+        record["hr"] = hr
+    if device is not None:
+        record["device"] = device
+    return record
+
+def test_batches_merge_into_stored_aggregates():
+    rollups = Rollups(SQLiteRollupStore(), [HOURLY])
+    rollups.apply([_record(5, 70, "old"), _record(50, 90, "newest"), _record(20)])
+    # Older than the stored latest device, and a non-numeric reading
+    rollups.apply([_record(10, 60, "stale"), _record(15, "high")])
+
+    row, = rollups.lookup("hourly", "a")
+    assert row["bucket"] == datetime(2024, 1, 1, 9)
+    assert row["records"] == 5
+    assert row["readings"] == 4
+    assert row["hr_sum"] == 220
+    assert (row["hr_min"], row["hr_max"]) == (60, 90)
+    assert row["hr_avg"] == pytest.approx(220 / 3)
+    assert row["device"] == "newest"
+    assert row["device_at"] == datetime(2024, 1, 1, 9, 50)
+
+def test_aggregates_of_a_batch_without_values_keep_stored_ones():
+    rollups = Rollups(SQLiteRollupStore(), [HOURLY])
+    rollups.apply([_record(5, 70, "phone")])
+    rollups.apply([_record(6)])
+
+    row, = rollups.lookup("hourly", "a")
+    assert (row["records"], row["readings"], row["hr_min"], row["hr_max"]) == (2, 1, 70, 70)
+    assert row["device"] == "phone"
+
+def test_records_missing_a_group_value_are_left_out():
+    definition = {"name": "by_action", "group_by": ["meta.action"], "aggregates": {"n": ["count", None]}}
+    rollups = Rollups(SQLiteRollupStore(), [definition])
+    rollups.apply([_record(1, meta={"action": "buy"}), _record(2, meta={"action": "buy"}), _record(3)])
+
+    assert [(row["meta__action"], row["n"]) for row in rollups.lookup("by_action", "a")] == [("buy", 2)]
+    assert rollups.lookup("by_action", "a", {"meta.action": "buy"})[0]["n"] == 2
+
+def test_long_group_values_are_cut_and_still_found():
+    definition = {"name": "by_tag", "group_by": ["tag"], "aggregates": {"n": ["count", None]}}
+    rollups = Rollups(SQLiteRollupStore(), [definition])
+    long_tag = "x" * 300
+    rollups.apply([_record(1, tag=long_tag), _record(2, tag=long_tag), _record(3, tag=long_tag + "y")])
+
+    rows = rollups.lookup("by_tag", "a")
+    assert len(rows) == 2
+    assert all(len(row["tag"]) == MAX_KEY_LENGTH for row in rows)
+    assert rollups.lookup("by_tag", "a", {"tag": long_tag})[0]["n"] == 2
+
+def test_replayed_records_are_counted_once(tmp_path):
+    wal = WriteAheadLog(str(tmp_path / "wal"))
+    batch = [_record(minute, 70) for minute in range(6)]
+    lsns = [wal.append(record) for record in batch]
+    wal.flush()
+    wal.close()
+
+    # The first four were folded in before the crash, none were acked
+    wal = WriteAheadLog(str(tmp_path / "wal"))
+    store = SQLiteRollupStore(str(tmp_path / "rollups.db"))
+    Rollups(store, [HOURLY], log=wal).apply(batch[:4], lsns[:4])
+    rollups = Rollups(store, [HOURLY], log=wal)
+    rollups.apply(batch, lsns)
+
+    assert rollups.skipped == 4
+    assert rollups.lookup("hourly", "a")[0]["records"] == 6
+    wal.close()
+
+class _FailingStore:
+    def __init__(self, store):
+        self.store = store
+        self.failing = True
+
+    def upsert(self, *args):
+        if self.failing:
+            raise RuntimeError("rollup tables unavailable")
+        return self.store.upsert(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+def test_a_failed_batch_is_retried_with_the_next_one():
+    store = _FailingStore(SQLiteRollupStore())
+    rollups = Rollups(store, [HOURLY])
+    with pytest.raises(RuntimeError):
+        rollups.apply([_record(1, 70)])
+    assert len(rollups.pending) == 1
+
+    store.failing = False
+    rollups.apply([_record(2, 80)])
+    assert not rollups.pending
+    assert rollups.lookup("hourly", "a")[0]["readings"] == 2
+
+def test_bad_definitions_are_rejected():
+    with pytest.raises(ValueError):
+        Rollup("Bad-Name", {"n": ["count", None]})
+    with pytest.raises(ValueError):
+        Rollup("ok", {"n": ["median", "hr"]})
+    with pytest.raises(ValueError):
+        Rollup("ok", {"n": ["sum", None]})
+    with pytest.raises(ValueError):
+        Rollup("ok", {"n": ["count", None]}, bucket="week")
@@ -0,0 +1,59 @@
+from core.classifier import OVERFLOW_COLUMN, Classifier
+from core.router import Router
+
+class _Store:
+    def __init__(self):
+        self.batches = []
+
+    def insert_batch(self, records):
+        self.batches.append(records)
+
+def _sparse_int():
+    """An int field below the SQL band, in the overflow band of threshold 0.3."""
+    return {
+        "detected_type": "int", "frequency_ratio": 0.5, "count": 500, "types": ["int"],
+        "type_stability": "stable", "is_nested": False, "nullable": False
+    }
+
+def _route(batch, decisions):
+    sql, mongo = _Store(), _Store()
+    placements = Router(sql, mongo).process_batch(batch, decisions)
+    return sql.batches[0], mongo.batches[0], placements
+
+def test_overflow_keys_go_to_the_json_column():
+    decisions = Classifier(overflow_threshold=0.3).decide_schema({"error_code": _sparse_int()})
+    assert decisions["error_code"]["target"] == "JSON"
+
+    batch = [
+        {"username": "a", "error_code": 404},
+        {"username": "b", "error_code": "timeout"},
+        {"username": "c", "error_code": None}
+    ]
+    sql, mongo, placements = _route(batch, decisions)
+    assert sql[0] == {"username": "a", OVERFLOW_COLUMN: {"error_code": 404}}
+    # Off-type values would not cast into the key's generated column
+    assert mongo[1] == {"username": "b", "error_code": "timeout"}
+    assert OVERFLOW_COLUMN not in sql[2] and "error_code" not in mongo[2]
+    assert placements[0] == (("error_code",), ())
+
+def test_queried_overflow_keys_get_an_indexed_column():
+    classifier = Classifier(overflow_threshold=0.3)
+    metrics = _sparse_int()
+    assert not classifier.decide_schema({"error_code": metrics})["error_code"]["indexed"]
+    classifier.record_access(["error_code"])
+    decision = classifier.decide_schema({"error_code": metrics})["error_code"]
+    assert decision["indexed"]
+    assert decision["column"] == "jv_error_code"
+
+def test_off_type_promoted_values_stay_in_the_document():
+    decisions = {
+        "metadata": {"target": "MONGO"},
+        "metadata.version": {
+            "target": "SQL", "sql_type": "INT", "value_types": ["bool", "int"],
+            "column": "metadata__version", "promoted_from": "metadata"
+        }
+    }
+    batch = [{"username": "a", "metadata": {"version": 2}}, {"username": "b", "metadata": {"version": "2.1"}}]
+    sql, mongo, _ = _route(batch, decisions)
+    assert sql == [{"username": "a", "metadata__version": 2}, {"username": "b"}]
+    assert [doc["metadata"] for doc in mongo] == [{"version": 2}, {"version": "2.1"}]
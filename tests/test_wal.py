@@ -0,0 +1,85 @@
+import json
+import os
+
+from core.wal import WriteAheadLog
+
+def _log(directory, count):
+    wal = WriteAheadLog(str(directory))
+    lsns = [wal.append({"i": i}) for i in range(count)]
+    wal.flush()
+    return wal, lsns
+
+def test_replay_yields_records_after_the_checkpoint(tmp_path):
+    wal, lsns = _log(tmp_path, 5)
+    wal.ack(lsns[:2])
+    wal.close()
+
+    wal = WriteAheadLog(str(tmp_path))
+    assert wal.checkpoint == lsns[1]
+    assert [(lsn, record["i"]) for lsn, record, _ in wal.replay()] == [(3, 2), (4, 3), (5, 4)]
+    wal.close()
+
+def test_acks_above_a_gap_survive_a_restart(tmp_path):
+    wal, lsns = _log(tmp_path, 10)
+    wal.ack([1, 2, 5, 6, 7, 9])
+    wal.close()
+
+    wal = WriteAheadLog(str(tmp_path))
+    assert wal.checkpoint == 2
+    assert wal.acked == {5, 6, 7, 9}
+    committed = {lsn: done for lsn, _, done in wal.replay()}
+    assert committed == {3: False, 4: False, 5: True, 6: True, 7: True, 8: False, 9: True, 10: False}
+    wal.close()
+
+def test_filling_the_gap_advances_the_checkpoint(tmp_path):
+    wal, lsns = _log(tmp_path, 4)
+    wal.ack([2, 3])
+    assert wal.checkpoint == 0
+    wal.ack([1])
+    assert wal.checkpoint == 3
+    assert wal.acked == set()
+    wal.close()
+
+def test_reads_a_checkpoint_file_without_acked_ranges(tmp_path):
+    wal, _ = _log(tmp_path, 6)
+    wal.close()
+    with open(tmp_path / "checkpoint", 'w') as f:
+        f.write("4")
+
+    wal = WriteAheadLog(str(tmp_path))
+    assert (wal.checkpoint, wal.acked) == (4, set())
+    assert [lsn for lsn, _, _ in wal.replay()] == [5, 6]
+    wal.close()
+
+def test_dead_letter_sets_records_aside_and_acks_them(tmp_path):
+    wal, lsns = _log(tmp_path, 3)
+    wal.dead_letter(lsns[:2], [{"i": 0}, {"i": 1}], ValueError("bad batch"))
+    assert wal.checkpoint == 2
+
+    with open(wal.dead_letter_path) as f:
+        lines = [json.loads(line) for line in f]
+    assert [line["lsn"] for line in lines] == [1, 2]
+    assert lines[0]["error"] == "bad batch"
+    assert lines[1]["record"] == {"i": 1}
+    wal.close()
+
+def test_torn_tail_is_dropped_on_open(tmp_path):
+    wal, _ = _log(tmp_path, 3)
+    wal.close()
+    segment = sorted(name for name in os.listdir(tmp_path) if name.startswith("wal-"))[-1]
+    with open(tmp_path / segment, 'ab') as f:
+        f.write(b"\x07\x00\x00")
+
+    wal = WriteAheadLog(str(tmp_path))
+    assert [lsn for lsn, _, _ in wal.replay()] == [1, 2, 3]
+    assert wal.append({"i": 3}) == 4
+    wal.close()
+
+def test_log_id_is_kept_across_restarts(tmp_path):
+    wal = WriteAheadLog(str(tmp_path))
+    log_id = wal.log_id
+    wal.close()
+    wal = WriteAheadLog(str(tmp_path))
+    assert wal.log_id == log_id
+    wal.close()
+    assert WriteAheadLog(str(tmp_path / "other")).log_id != log_id